@@ -0,0 +1,288 @@
+"""time the note manager, the pdf export and the selection window on synthetic notes
+
+python benchmarks/bench_notes.py                        # 100, 1k, 10k and 100k notes
+python benchmarks/bench_notes.py --sizes 100 1000 --compare bench_1234abc.json
+
+results are written to bench_<commit>.json (or --output) so that two commits can be compared"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from note_editor.note_manager import NoteManager, categories  # noqa: E402
+from note_editor.storage import id_field, new_note_id, write_csv  # noqa: E402
+
+words = ('the of and a to in is you that it he was for on are as with his they at be this have from or one had '
+         'by word but not what all were we when your can said there use an each which she do how their if will '
+         'up other about out many then them these so some her would make like him into time has look two more '
+         'write go see number no way could people my than first water been call who oil its now find long down '
+         'day did get come made may part').split()
+
+
+def sentence(rng, n_words):
+    return ' '.join(rng.choice(words) for _ in range(n_words))
+
+
+def make_body(rng):
+    """notes with indented lines, tabs inside lines and a few very long lines"""
+    lines = []
+    for _ in range(rng.randint(3, 40)):
+        kind = rng.random()
+        if kind < 0.2:
+            lines.append('\t' * rng.randint(1, 3) + sentence(rng, rng.randint(2, 12)))
+        elif kind < 0.3:
+            lines.append(sentence(rng, 3) + '\t' + sentence(rng, 2) + '\t\t' + sentence(rng, 4))
+        elif kind < 0.35:
+            lines.append(sentence(rng, rng.randint(60, 200)))
+        elif kind < 0.4:
+            lines.append('')
+        else:
+            lines.append(sentence(rng, rng.randint(4, 16)))
+    return '\n'.join(lines)
+
+
+def make_note(rng):
+    """random note following the categories"""
+    note = {}
+    for category in categories:
+        if category.name == 'year':
+            value = str(rng.randint(1900, 2024))
+        elif category.values:
+            value = rng.choice(category.values)
+        elif category.name == 'notes':
+            value = make_body(rng)
+        elif category.name == 'link':
+            value = 'https://example.org/' + rng.choice(words) if rng.random() < 0.3 else ''
+        elif category.name == 'episode':
+            value = str(rng.randint(1, 20)) if rng.random() < 0.2 else ''
+        elif category.name == 'subtitle':
+            value = sentence(rng, rng.randint(1, 5)) if rng.random() < 0.5 else ''
+        else:
+            value = sentence(rng, rng.randint(1, 6)).capitalize()
+        note[category.name] = value
+    return note
+
+
+def make_corpus(path, size, seed=0):
+    rng = random.Random(seed)
+    notes = [make_note(rng) for _ in range(size)]
+    for note in notes:
+        note[id_field] = new_note_id()
+    write_csv(path, [category.name for category in categories] + [id_field], notes)
+    return notes
+
+
+class SampleStyles:
+    """styles of add_page built from a new sample style sheet at each lookup, as make_style did"""
+
+    def __getitem__(self, key):
+        from reportlab.lib.styles import getSampleStyleSheet
+        from note_editor import pdf_maker
+        style = getSampleStyleSheet()[key[0]]
+        style.fontName = pdf_maker.font
+        style.fontSize = key[1]
+        return style
+
+
+def measure(func, repeat):
+    """run func repeat times, return the durations in seconds"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def measure_memory(func):
+    """bytes held by what func returns"""
+    gc.collect()
+    tracemalloc.start()
+    kept = func()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def bench_size(size, args, record):
+    directory = tempfile.mkdtemp(prefix='note_bench_')
+    try:
+        path = os.path.join(directory, 'notes.csv')
+        notes = make_corpus(path, size, args.seed)
+        rng = random.Random(args.seed + 1)
+
+        def load(lazy):
+            def run():
+                NoteManager(path, lazy=lazy)
+            return run
+
+        # the first open saves every note as the first version of the history, the next ones do not read it
+        history_path = NoteManager(path).history.path
+        history_size = directory_size(history_path)
+        record(size, 'load', measure(load(False), args.repeat))
+        record(size, 'load_lazy', measure(load(True), args.repeat))
+        record(size, 'memory', [measure_memory(lambda: NoteManager(path))], unit='B')
+        record(size, 'memory_lazy', [measure_memory(lambda: NoteManager(path, lazy=True))], unit='B')
+
+        note_manager = NoteManager(path)
+        record(size, 'dump', measure(note_manager.dump, args.repeat))
+
+        # per edit, averaged over args.edits edits
+        def add():
+            for _ in range(args.edits):
+                note_manager.add_note(make_note(rng))
+
+        # updates keep the ids
+        ids = list(note_manager.notes)
+
+        def update():
+            for _ in range(args.edits):
+                note_manager.update_note(make_note(rng), rng.choice(ids))
+
+        record(size, 'add_note', [t / args.edits for t in measure(add, args.repeat)])
+        record(size, 'update_note', [t / args.edits for t in measure(update, args.repeat)])
+        record(size, 'compact', measure(note_manager.compact, 1))
+        # history growth per edit, it does not depend on the number of notes
+        edits = 2 * args.edits * args.repeat
+        record(size, 'history_per_edit', [(directory_size(history_path) - history_size) / edits], unit='B')
+
+        # time the gui thread waits per edit when a background thread writes them
+        background = NoteManager(path, background=True)
+
+        def add_background():
+            for _ in range(args.edits):
+                background.add_note(make_note(rng))
+
+        record(size, 'add_note_background', [t / args.edits for t in measure(add_background, args.repeat)])
+        background.compact()
+
+        from note_editor.pdf_maker import StyleRegistry, add_page, format_str, make_pdf
+        bodies = [note['notes'] for note in notes]
+        record(size, 'format_str', measure(lambda: [format_str(body) for body in bodies], args.repeat))
+        # flowables of one page per note, the layout itself is in make_pdf: with the styles of
+        # an export, and with a style sheet per paragraph as before StyleRegistry
+        pages = notes[:args.pages]
+        for name, styles in (('add_page', StyleRegistry()), ('add_page_sheet', SampleStyles())):
+            def run_pages(styles=styles):
+                for note in pages:
+                    add_page(note, note[id_field], styles)
+            record(size, name, [t / len(pages) for t in measure(run_pages, args.repeat)])
+        if size <= args.pdf_max:
+            pdf_path = os.path.join(directory, 'notes.pdf')
+            # first export lays out every page, the next one only the chunk of an edited note
+            record(size, 'make_pdf_cold', measure(lambda: make_pdf(pdf_path, note_manager, workers=args.workers), 1))
+            note_manager.update_note(make_note(rng), next(iter(note_manager.notes)))
+            record(size, 'make_pdf_edit', measure(lambda: make_pdf(pdf_path, note_manager, workers=args.workers), 1))
+
+        bench_select(size, note_manager, args, record)
+        record(size, 'restore', measure(lambda: note_manager.restore(1), 1))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_select(size, note_manager, args, record):
+    """open the selection window on a withdrawn root, needs a display"""
+    try:
+        import tkinter as tk
+        from note_editor.notes_class import SelectNote
+        root = tk.Tk()
+    except Exception as error:
+        print('  make_table skipped: ' + str(error).splitlines()[0], file=sys.stderr)
+        return
+    root.withdraw()
+    main = argparse.Namespace(root=root, note_manager=note_manager)
+    try:
+        window = SelectNote(main)
+        root.update()
+
+        def run():
+            window.make_table(note_manager)
+            root.update()
+        record(size, 'make_table', measure(run, args.repeat))
+    finally:
+        root.destroy()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, path):
+    """print the ratio of each median to the one of a previous run"""
+    with open(path) as f:
+        previous = {(r['size'], r['name']): r['median'] for r in json.load(f)['results']}
+    print('\ncompared to ' + path)
+    for result in results:
+        before = previous.get((result['size'], result['name']))
+        if before:
+            print('{size:>7} {name:<14} {ratio:6.2f}x'.format(ratio=result['median'] / before, **result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark note_editor on synthetic notes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--edits', type=int, default=100, help='notes added and updated per run')
+    parser.add_argument('--pdf-max', type=int, default=10000, help='largest corpus exported to pdf')
+    parser.add_argument('--pages', type=int, default=500, help='notes laid out by the add_page cases')
+    parser.add_argument('--workers', type=int, default=None, help='pdf processes, all cores by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file, bench_<commit>.json by default')
+    parser.add_argument('--compare', help='json file of a previous run')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = []
+
+    def record(size, name, runs, unit='s'):
+        result = {'size': size, 'name': name, 'unit': unit, 'min': min(runs), 'median': statistics.median(runs),
+                  'runs': runs}
+        results.append(result)
+        if unit == 'B' and result['median'] < 2 ** 20:
+            print('{size:>7} {name:<14} {kib:10.1f} KiB'.format(kib=result['median'] / 2 ** 10, **result))
+        elif unit == 'B':
+            print('{size:>7} {name:<14} {mib:10.1f} MiB'.format(mib=result['median'] / 2 ** 20, **result))
+        else:
+            print('{size:>7} {name:<14} {median:10.4f} s'.format(**result))
+
+    for size in args.sizes:
+        bench_size(size, args, record)
+
+    output = args.output or 'bench_' + commit + '.json'
+    with open(output, 'w') as f:
+        json.dump({'commit': commit,
+                   'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'cpus': os.cpu_count(),
+                   'args': vars(args),
+                   'results': results}, f, indent=1)
+    print('saved ' + output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""command line interface without tkinter, for scripts and servers without a display
+
+note-batch export ~/notes.pdf                  # build the pdf of the notes
+note-batch export ~/notes --split-by author    # one pdf per author in ~/notes, with index.pdf
+note-batch watch ~/notes.pdf                   # build it again whenever the notes file changes
+note-batch import other_notes.csv              # append the notes of a csv file
+note-batch import books.jsonl --map Name=title # ... or json lines, with a column renamed
+note-batch stats                               # count notes by media type, authors, years
+note-batch duplicates                          # list groups of notes with similar titles and authors
+note-batch history                             # list the saved versions of the notes
+note-batch history --note ID                   # ... or those of one note (ids: see duplicates)
+note-batch restore 42                          # bring the notes back to a version
+note-batch restore --at "2024-03-01 18:00"     # ... or to the last one saved at that time
+
+--notes picks another notes file, the backend defaults to the one of config.ini"""
+import argparse
+import collections
+import datetime
+import os
+import sys
+import time
+
+from note_editor.config import load_config
+from note_editor.note_manager import NoteManager
+from note_editor.storage import id_field
+
+
+def open_notes(args, read_only=True):
+    """notes of the command line, lazily loaded: bodies are only read when a page is rendered
+
+    commands that only read the notes leave the files as they are, see NoteManager"""
+    config = load_config()
+    backend = args.backend or config.get('storage', 'backend', fallback='csv')
+    path = os.path.expanduser(args.notes) if args.notes else None
+    return NoteManager(path, backend=backend, lazy=True, read_only=read_only)
+
+
+def export(args):
+    # reportlab is only needed here
+    from note_editor.pdf_maker import make_pdf
+    from note_editor.split_pdf import make_split_pdf
+    note_manager = open_notes(args)
+    start = time.perf_counter()
+    path_to_pdf = os.path.expanduser(args.output)
+    cache_dir = os.path.expanduser(args.cache_dir) if args.cache_dir else None
+    if args.split_by:
+        built = make_split_pdf(path_to_pdf, note_manager, args.split_by, cache_dir=cache_dir, workers=args.workers,
+                               force=args.force)
+        print('{} pdf rebuilt'.format(len(built)))
+    elif not make_pdf(path_to_pdf, note_manager, cache_dir=cache_dir, workers=args.workers, force=args.force):
+        print('{} is up to date, --force to build it anyway'.format(path_to_pdf))
+        return
+    print('{} notes exported to {} in {:.1f} s'.format(len(note_manager.notes), path_to_pdf,
+                                                       time.perf_counter() - start))
+
+
+def watch(args):
+    from note_editor.pdf_maker import make_pdf
+    from note_editor.split_pdf import make_split_pdf
+    from note_editor.watcher import Watcher
+    note_manager = open_notes(args)
+    path_to_pdf = os.path.expanduser(args.output)
+
+    def export(removed, added):
+        start = time.perf_counter()
+        if args.split_by:
+            built = len(make_split_pdf(path_to_pdf, note_manager, args.split_by, workers=args.workers))
+        else:
+            built = int(make_pdf(path_to_pdf, note_manager, workers=args.workers))
+        print('{} {} notes removed, {} added, {} pdf built in {:.1f} s'.format(
+            time.strftime('%H:%M:%S'), len(removed), len(added), built, time.perf_counter() - start), flush=True)
+
+    watcher = Watcher(note_manager, export, interval=args.interval, delay=args.delay)
+    print('watching {}, ctrl-c to stop'.format(', '.join(note_manager.storage.files())), flush=True)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def import_notes(args):
+    from note_editor.importer import Importer
+    mapping = {}
+    for item in args.map:
+        column, _, name = item.partition('=')
+        if not name:
+            raise ValueError('--map expects COLUMN=CATEGORY, not ' + item)
+        mapping[column] = name
+    note_manager = open_notes(args, read_only=False)
+    importer = Importer(note_manager, mapping, batch_size=args.batch_size)
+    report = importer.run([os.path.expanduser(path) for path in args.sources])
+    note_manager.compact()
+    for path, number, reason in report.invalid[:10]:
+        print('{}: row {}: {}'.format(path, number, reason), file=sys.stderr)
+    if len(report.invalid) > 10:
+        print('... {} more invalid rows'.format(len(report.invalid) - 10), file=sys.stderr)
+    print('{}, {} in total'.format(report, len(note_manager.notes)))
+
+
+def stats(args):
+    note_manager = open_notes(args)
+    notes = list(note_manager.notes.values())
+    print('notes: {}'.format(len(notes)))
+    print('file: {} ({} bytes)'.format(note_manager.path, os.path.getsize(note_manager.path)
+                                       if os.path.exists(note_manager.path) else 0))
+    print('authors: {}'.format(len({note['author'].casefold() for note in notes})))
+    years = sorted(int(note['year']) for note in notes if note['year'].strip().isdigit())
+    if years:
+        print('years: {} - {}'.format(years[0], years[-1]))
+    print('media types:')
+    for media_type, n in collections.Counter(note['media_type'] for note in notes).most_common():
+        print('  {:<12} {}'.format(media_type or '(none)', n))
+
+
+def duplicates(args):
+    from note_editor.duplicates import DuplicateIndex
+    note_manager = open_notes(args)
+    start = time.perf_counter()
+    index = DuplicateIndex()
+    index.attach(note_manager)
+    clusters = index.clusters()
+    for cluster in clusters:
+        # ids sort in creation order
+        for note in sorted(cluster, key=lambda note: note[id_field]):
+            print('{}  {} - {} ({})'.format(note[id_field], note['title'], note['author'], note['year']))
+        print()
+    print('{} groups, {} notes, found in {:.1f} s'.format(len(clusters), sum(map(len, clusters)),
+                                                          time.perf_counter() - start))
+
+
+def format_time(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))
+
+
+def history(args):
+    note_manager = open_notes(args)
+    if args.note:
+        versions = note_manager.history.note_versions(args.note)
+        if not versions:
+            raise ValueError('no note {} in the history'.format(args.note))
+        for number, when, note in versions:
+            if note is None:
+                print('{:>6}  {}  removed'.format(number, format_time(when)))
+            else:
+                print('{:>6}  {}  {} - {} ({})'.format(number, format_time(when), note['title'],
+                                                       note['author'], note['year']))
+        return
+    log = note_manager.history.log()
+    for number, when, added, updated, removed in log[-args.last:]:
+        print('{:>6}  {}  {} added, {} updated, {} removed'.format(number, format_time(when), added, updated, removed))
+    if not log:
+        print('no version saved yet')
+
+
+def restore(args):
+    note_manager = open_notes(args, read_only=False)
+    if args.at:
+        version = note_manager.history.version_at(datetime.datetime.fromisoformat(args.at).timestamp())
+        if not version:
+            raise ValueError('no version saved before ' + args.at)
+    elif args.version is not None:
+        version = args.version
+    else:
+        raise ValueError('restore expects a version or --at')
+    removed, added = note_manager.restore(version)
+    note_manager.compact()
+    print('version {} restored: {} notes removed, {} added, {} in total'.format(
+        version, len(removed), len(added), len(note_manager.notes)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='note-batch', description='note editor without the gui')
+    parser.add_argument('--notes', help='notes file, the one next to the package by default')
+    parser.add_argument('--backend', choices=('csv', 'sqlite'), help='storage of the notes file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('export', help='build the pdf of the notes')
+    command.add_argument('output', help='pdf file, or folder with --split-by')
+    command.add_argument('--split-by', choices=('media_type', 'author', 'year'),
+                         help='one pdf per value of a category, unchanged ones are not rebuilt')
+    command.add_argument('--workers', type=int, default=None, help='processes laying out pages, all cores by default')
+    command.add_argument('--cache-dir', help='cached pages, page_cache next to the notes by default')
+    command.add_argument('--force', action='store_true',
+                         help='build even if the notes did not change since the last export')
+    command.set_defaults(func=export)
+
+    command = commands.add_parser('watch', help='build the pdf again whenever the notes file changes')
+    command.add_argument('output', help='pdf file, or folder with --split-by')
+    command.add_argument('--split-by', choices=('media_type', 'author', 'year'), help='as for export')
+    command.add_argument('--workers', type=int, default=None, help='processes laying out pages, all cores by default')
+    command.add_argument('--interval', type=float, default=2.0, help='seconds between two checks of the file')
+    command.add_argument('--delay', type=float, default=5.0,
+                         help='seconds without changes before the notes are read again')
+    command.set_defaults(func=watch)
+
+    command = commands.add_parser('import', help='append the notes of csv or json lines files, without duplicates')
+    command.add_argument('sources', nargs='+', help='csv files with a header, or .jsonl files of objects')
+    command.add_argument('--map', action='append', default=[], metavar='COLUMN=CATEGORY',
+                         help='take a column of the sources as a category')
+    command.add_argument('--batch-size', type=int, default=1000, help='notes added to the list at once')
+    command.set_defaults(func=import_notes)
+
+    command = commands.add_parser('stats', help='count the notes')
+    command.set_defaults(func=stats)
+
+    command = commands.add_parser('duplicates', help='list groups of notes with similar titles and authors')
+    command.set_defaults(func=duplicates)
+
+    command = commands.add_parser('history', help='list the saved versions of the notes')
+    command.add_argument('--note', metavar='ID', help='versions of one note, with its title')
+    command.add_argument('--last', type=int, default=20, help='number of versions listed')
+    command.set_defaults(func=history)
+
+    command = commands.add_parser('restore', help='bring the notes back to a version, kept in the history too')
+    command.add_argument('version', type=int, nargs='?', help='number of the version, see history')
+    command.add_argument('--at', metavar='TIME',
+                         help='last version saved at that time: 2024-03-01 or "2024-03-01 18:00"')
+    command.set_defaults(func=restore)
+
+    args = parser.parse_args(argv)
+    try:
+        args.func(args)
+    except (OSError, ValueError) as error:
+        print('note-batch: ' + str(error), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import configparser
+import os
+
+config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+
+
+def default_config():
+    """settings of a first start"""
+    config = configparser.ConfigParser()
+    # previous pdf location
+    config.add_section('save_path')
+    config['save_path']['head'] = "~"
+    config['save_path']['tail'] = 'notes_on_stuff.pdf'
+    # 'csv' or 'sqlite'
+    config.add_section('storage')
+    config['storage']['backend'] = 'csv'
+    # read note bodies only when needed
+    config['storage']['lazy'] = 'yes'
+    # binary copy of notes.csv read at startup instead of the csv (csv backend)
+    config['storage']['snapshot'] = 'yes'
+    # write edits from a background thread, the window never waits for the disk
+    config['storage']['background_writes'] = 'yes'
+    # processes laying out pdf pages, 0 for one per core
+    config.add_section('pdf')
+    config['pdf']['workers'] = '0'
+    # media_type, author or year: one pdf per value in a folder named after the pdf, empty for a single pdf
+    config['pdf']['split_by'] = ''
+    # file receiving a chrome trace of load, save and pdf stages on exit, empty to disable
+    config.add_section('trace')
+    config['trace']['path'] = ''
+    return config
+
+
+def load_config(path=config_path):
+    """read the config file, create it with the defaults if there is none"""
+    if not os.path.exists(path):
+        save_config(default_config(), path)
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def save_config(config, path=config_path):
+    with open(path, 'w') as f:
+        config.write(f)
@@ -0,0 +1,221 @@
+"""near duplicate notes: same title and author up to case, accents, a leading article or a typo
+
+Titles are cut into character bigrams and summarized by a MinHash signature, whose bands
+are the keys of buckets (locality sensitive hashing): notes with similar titles share a
+bucket with high probability, others rarely do. Only notes sharing a bucket are compared,
+on title and author, so finding the duplicates of a note does not depend on the number of
+notes and listing every cluster is close to linear"""
+import difflib
+import hashlib
+import re
+import unicodedata
+from array import array
+
+# titles are cut into character n-grams of this size
+gram_size = 2
+# signature: bands of rows min hashes, two titles are compared if a whole band is equal
+bands = 8
+rows = 4
+# buckets larger than this hold titles made of common n-grams, they are not compared
+# pairwise: near duplicates almost always share another, smaller bucket
+max_bucket = 200
+# titles sharing fewer n-grams than this (jaccard index) are not compared,
+# a typo in a title of two short words keeps 0.4
+min_overlap = 0.4
+# titles (and authors) whose similarity ratio reaches this are duplicates
+title_threshold = 0.85
+author_threshold = 0.8
+articles = ('the', 'a', 'an')
+
+word_re = re.compile(r'\w+')
+
+
+def normalize(text):
+    """lower case words without accents, punctuation or a leading article"""
+    text = text.casefold()
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    words = word_re.findall(text)
+    if len(words) > 1 and words[0] in articles:
+        del words[0]
+    return ' '.join(words)
+
+
+def n_grams(title):
+    padded = ' ' + title + ' '
+    return {padded[i:i + gram_size] for i in range(max(len(padded) - gram_size + 1, 1))}
+
+
+def overlap(a, b):
+    """jaccard index of two sets of n-grams"""
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+def similarity(a, b, threshold=0.0):
+    """1 for equal normalized texts, 0 for nothing in common, 0 below threshold"""
+    if a == b:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, a, b)
+    # cheap upper bounds first, as difflib.get_close_matches
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return 0.0
+    score = matcher.ratio()
+    return score if score >= threshold else 0.0
+
+
+def match(title, author, other_title, other_author):
+    """similarity of two normalized titles if both titles and authors match, else 0"""
+    score = similarity(title, other_title, title_threshold)
+    # an author missing on one side does not tell them apart
+    if score and author and other_author and not similarity(author, other_author, author_threshold):
+        return 0.0
+    return score
+
+
+class DuplicateIndex:
+    """buckets of notes with similar titles, follows the edits of a NoteManager"""
+
+    def __init__(self):
+        # band key -> notes
+        self.buckets = {}
+        # bigram -> its min hash values, bigrams are few and repeat a lot
+        self.hashes = {}
+        # notes indexed, those without a title are left out
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def attach(self, note_manager):
+        """index the notes and follow their edits"""
+        self.build(note_manager.notes.values())
+        note_manager.observers.append(self.update)
+
+    def build(self, notes):
+        """index notes, from any thread as long as nothing else uses the index meanwhile"""
+        for note in notes:
+            self.add(note)
+
+    def gram_hashes(self, gram):
+        values = self.hashes.get(gram)
+        if values is None:
+            values = array('Q', hashlib.shake_128(gram.encode('utf-8')).digest(8 * bands * rows))
+            values = self.hashes[gram] = tuple(values)
+        return values
+
+    def keys(self, title):
+        """band keys of a normalized title"""
+        grams = n_grams(title)
+        signature = list(map(min, *map(self.gram_hashes, grams))) if len(grams) > 1 \
+            else list(self.gram_hashes(next(iter(grams))))
+        return [hash((band,) + tuple(signature[band * rows:(band + 1) * rows])) for band in range(bands)]
+
+    def add(self, note):
+        title = normalize(note['title'])
+        # notes without a title are never duplicates
+        if not title:
+            return
+        for key in self.keys(title):
+            self.buckets.setdefault(key, []).append(note)
+        self.count += 1
+
+    def remove(self, note):
+        title = normalize(note['title'])
+        if not title:
+            return
+        for key in self.keys(title):
+            bucket = self.buckets[key]
+            for i, indexed in enumerate(bucket):
+                if indexed is note:
+                    del bucket[i]
+                    break
+            if not bucket:
+                del self.buckets[key]
+        self.count -= 1
+
+    def update(self, old, new):
+        """observer of NoteManager"""
+        if old is not None:
+            self.remove(old)
+        if new is not None:
+            self.add(new)
+
+    def similar(self, note, exclude=None, limit=5):
+        """(similarity, note) of the notes that look like a duplicate of note, best first
+
+        note may be a plain dict of title and author, exclude is a note left out (the one edited)"""
+        title = normalize(note['title'])
+        author = normalize(note['author'])
+        if not title:
+            return []
+        grams = n_grams(title)
+        seen = set()
+        found = []
+        for key in self.keys(title):
+            for other in self.buckets.get(key, ()):
+                if other is exclude or id(other) in seen:
+                    continue
+                seen.add(id(other))
+                other_title = normalize(other['title'])
+                if overlap(grams, n_grams(other_title)) < min_overlap:
+                    continue
+                score = match(title, author, other_title, normalize(other['author']))
+                if score:
+                    found.append((score, other))
+        found.sort(key=lambda item: -item[0])
+        return found[:limit]
+
+    def clusters(self):
+        """groups of notes that are duplicates of each other, largest first
+
+        notes with the same normalized title and author are duplicates without comparing them,
+        the other titles are compared with those sharing a bucket, each pair once"""
+        # normalized (title, author) -> notes
+        groups = {}
+        key_of = {}
+        for bucket in self.buckets.values():
+            for note in bucket:
+                if id(note) not in key_of:
+                    key = key_of[id(note)] = (normalize(note['title']), normalize(note['author']))
+                    groups.setdefault(key, []).append(note)
+        parent = {key: key for key in groups}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        grams = {}
+        compared = set()
+        # the second sequence is the one difflib preprocesses, it is set once per title
+        matcher = difflib.SequenceMatcher()
+        for bucket in self.buckets.values():
+            keys = list(dict.fromkeys(key_of[id(note)] for note in bucket))
+            if len(keys) > max_bucket:
+                continue
+            for key in keys:
+                if key[0] not in grams:
+                    grams[key[0]] = n_grams(key[0])
+            for i, key in enumerate(keys):
+                key_grams = grams[key[0]]
+                for other in keys[i + 1:]:
+                    if (key, other) in compared:
+                        continue
+                    compared.add((key, other))
+                    # upper bound of the ratio from the lengths, as real_quick_ratio
+                    lengths = len(key[0]) + len(other[0])
+                    if 2 * min(len(key[0]), len(other[0])) < title_threshold * lengths \
+                            or overlap(key_grams, grams[other[0]]) < min_overlap:
+                        continue
+                    if matcher.b is not key[0]:
+                        matcher.set_seq2(key[0])
+                    matcher.set_seq1(other[0])
+                    if (matcher.quick_ratio() >= title_threshold and matcher.ratio() >= title_threshold
+                            and (not key[1] or not other[1] or similarity(key[1], other[1], author_threshold))):
+                        parent[find(other)] = find(key)
+        clusters = {}
+        for key, notes in groups.items():
+            clusters.setdefault(find(key), []).extend(notes)
+        return sorted((cluster for cluster in clusters.values() if len(cluster) > 1), key=len, reverse=True)
@@ -0,0 +1,243 @@
+"""every saved version of the notes, to bring back all of them or one note as they were
+
+files in a folder next to the notes (notes_history):
+    blobs.bin       each content of a note once, zlib compressed json, appended
+    versions.jsonl  one line per saved version: its time, the ids of the notes it changed with
+                    their content hash (None when removed) and where the new contents are in blobs.bin
+
+A version only lists what changed since the previous one: unchanged notes share the blob of
+the version that wrote them, and a note brought back to an earlier content shares that blob
+too. Both files grow with the edits, not with the number of notes times the number of saves.
+A version is read by replaying the lines before it.
+
+The history is written after the notes, without waiting for the disk: a crash may lose its
+last versions, the next full write of the notes records them again (see record)"""
+import bisect
+import itertools
+import json
+import os
+import time
+import zlib
+
+from note_editor import trace
+from note_editor.locking import FileLock
+from note_editor.storage import Note, full_note, note_key
+
+
+class History:
+    """versions of the notes written by a storage, shared by the programs editing them
+
+    versions are numbered from 1, in the order they were saved"""
+
+    def __init__(self, path):
+        self.path = path
+        self.blobs_path = os.path.join(path, 'blobs.bin')
+        self.versions_path = os.path.join(path, 'versions.jsonl')
+        self.file_lock = FileLock(path + '.lock')
+        # note id -> content hash in the last version
+        self.current = {}
+        # content hash -> (offset, size) of its blob
+        self.blobs = {}
+        # time of each version
+        self.times = []
+        # bytes of versions.jsonl read, the lines after it were written by another program
+        self.size = 0
+        # path -> file kept open for appends, opening it would cost more than a small version
+        self.appends = {}
+
+    def __len__(self):
+        with self.file_lock:
+            self.update()
+            return len(self.times)
+
+    def lines(self, start=0):
+        """(offset after the line, version) of the complete lines of versions.jsonl from start"""
+        if not os.path.exists(self.versions_path):
+            return
+        with open(self.versions_path, 'rb') as v:
+            v.seek(start)
+            for line in v:
+                # a line cut by a crash mid-write is dropped by the next record
+                if not line.endswith(b'\n'):
+                    return
+                start += len(line)
+                yield start, json.loads(line.decode('utf-8'))
+
+    def update(self):
+        """read the versions saved since the last call, the caller holds the lock
+
+        the history is only read when first used, not when the notes are loaded"""
+        try:
+            if os.stat(self.versions_path).st_size == self.size:
+                return
+        except OSError:
+            return
+        for self.size, version in self.lines(self.size):
+            self.apply(self.current, version)
+            for key, location in version['blobs'].items():
+                self.blobs[key] = tuple(location)
+            self.times.append(version['time'])
+
+    @staticmethod
+    def apply(state, version):
+        """state (note id -> content hash) after a version, an update keeps the place of the note"""
+        for note_id, key in version['notes'].items():
+            if key is None:
+                state.pop(note_id, None)
+            else:
+                state[note_id] = key
+
+    def begin(self, notes):
+        """save the notes as loaded as the first version if nothing was saved yet
+
+        the edits that follow can then be undone too, an existing history is not read"""
+        if os.path.exists(self.versions_path):
+            return
+        try:
+            self.record(notes)
+        except OSError:
+            # read only directory, the notes can not be edited either
+            pass
+
+    def record(self, notes, changes=None, keys=None):
+        """save a version of the notes after a write, return its number, None if nothing changed
+
+        changes maps the ids written since the last version to their note (None when removed),
+        without changes every note is compared with the last version, by keys (the content
+        hash of each note, in order) when given. The first version holds every note"""
+        with self.file_lock:
+            self.update()
+            if changes is None or not self.times:
+                changes = self.diff(notes, keys)
+            else:
+                changes = {note_id: None if note is None else (note_key(note), note)
+                           for note_id, note in changes.items()}
+                changes = {note_id: change for note_id, change in changes.items()
+                           if self.current.get(note_id) != (change and change[0])}
+            if not changes:
+                return None
+            with trace.span('history record', notes=len(changes)):
+                self.write(changes)
+            return len(self.times)
+
+    def diff(self, notes, keys=None):
+        """changes from the last version to notes, see record"""
+        changes = {}
+        if keys is None:
+            keys = map(note_key, notes.values())
+        for (note_id, note), key in zip(notes.items(), keys):
+            if self.current.get(note_id) != key:
+                changes[note_id] = (key, note)
+        for note_id in self.current:
+            if note_id not in notes:
+                changes[note_id] = None
+        return changes
+
+    def append_file(self, path):
+        file = self.appends.get(path)
+        if file is None:
+            os.makedirs(self.path, exist_ok=True)
+            file = self.appends[path] = open(path, 'ab')
+        return file
+
+    def write(self, changes):
+        """append the new blobs and the line of a version, the caller holds the lock"""
+        new_blobs = {}
+        b = self.append_file(self.blobs_path)
+        # at the end of the file, whatever another program appended
+        b.seek(0, os.SEEK_END)
+        start = offset = b.tell()
+        for change in changes.values():
+            if change is None or change[0] in self.blobs or change[0] in new_blobs:
+                continue
+            data = zlib.compress(json.dumps(dict(full_note(change[1]))).encode('utf-8'))
+            b.write(data)
+            new_blobs[change[0]] = (offset, len(data))
+            offset += len(data)
+        b.flush()
+        trace.count('history bytes', offset - start)
+        version = {'time': time.time(), 'blobs': new_blobs,
+                   'notes': {note_id: change and change[0] for note_id, change in changes.items()}}
+        v = self.append_file(self.versions_path)
+        # drop a line cut by a crash, it was never read
+        v.truncate(self.size)
+        v.write(json.dumps(version).encode('utf-8') + b'\n')
+        v.flush()
+        self.size = v.tell()
+        self.apply(self.current, version)
+        self.blobs.update(new_blobs)
+        self.times.append(version['time'])
+
+    def version_at(self, when):
+        """number of the last version saved at or before a time (seconds since the epoch), 0 if none"""
+        with self.file_lock:
+            self.update()
+            return bisect.bisect_right(self.times, when)
+
+    def log(self):
+        """(number, time, added, updated, removed) of every version, counts of notes"""
+        with self.file_lock:
+            self.update()
+            lines = list(self.lines())
+        state = {}
+        log = []
+        for number, (_, version) in enumerate(lines, 1):
+            added = updated = removed = 0
+            for note_id, key in version['notes'].items():
+                if key is None:
+                    removed += 1
+                elif note_id in state:
+                    updated += 1
+                else:
+                    added += 1
+            self.apply(state, version)
+            log.append((number, version['time'], added, updated, removed))
+        return log
+
+    def check(self, number):
+        """raise ValueError unless a version of that number was saved"""
+        if not 1 <= number <= len(self):
+            raise ValueError('no version {} in the history, it has {}'.format(number, len(self.times)))
+
+    def state(self, number):
+        """note id -> content hash of a version"""
+        self.check(number)
+        state = {}
+        for _, version in itertools.islice(self.lines(), number):
+            self.apply(state, version)
+        return state
+
+    def notes(self, number, current=None):
+        """notes by id as they were in a version
+
+        notes of current (by id) with the same content are returned instead of being read"""
+        state = self.state(number)
+        current = current or {}
+        kept = {note_id for note_id, key in state.items()
+                if note_id in current and note_key(current[note_id]) == key}
+        contents = self.read_blobs({key for note_id, key in state.items() if note_id not in kept})
+        return {note_id: current[note_id] if note_id in kept else contents[key] for note_id, key in state.items()}
+
+    def note_versions(self, note_id):
+        """(number, time, note) of the versions that changed a note, note is None when removed"""
+        with self.file_lock:
+            self.update()
+            lines = list(self.lines())
+        found = []
+        for number, (_, version) in enumerate(lines, 1):
+            if note_id in version['notes']:
+                found.append((number, version['time'], version['notes'][note_id]))
+        contents = self.read_blobs({key for _, _, key in found if key is not None})
+        return [(number, when, key and contents[key]) for number, when, key in found]
+
+    def read_blobs(self, keys):
+        """content hash -> Note, read in file order"""
+        contents = {}
+        if not keys:
+            return contents
+        with open(self.blobs_path, 'rb') as b:
+            for key in sorted(keys, key=self.blobs.__getitem__):
+                offset, size = self.blobs[key]
+                b.seek(offset)
+                contents[key] = Note(json.loads(zlib.decompress(b.read(size)).decode('utf-8')))
+        return contents
@@ -0,0 +1,142 @@
+"""bulk import of notes from csv or json lines files
+
+rows are streamed: read, mapped onto the categories, checked and added to the NoteManager
+by batches, the notes file is written once at the end. A note whose title, author and year
+match an existing or already imported note (ignoring case, spaces and punctuation) is
+skipped as a duplicate"""
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+
+from note_editor.note_manager import categories, list_media
+from note_editor.storage import Note
+
+
+def normalize(value):
+    """text compared by the duplicate check: case, spacing and punctuation ignored"""
+    return ' '.join(re.sub(r'[^\w]+', ' ', value.casefold()).split())
+
+
+def duplicate_key(note):
+    """hash of the normalized title, author and year"""
+    text = '\0'.join(normalize(note.get(name) or '') for name in ('title', 'author', 'year'))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+
+def read_rows(path):
+    """dicts of a csv file (with a header) or of a json lines file (.jsonl, .ndjson), one at a time"""
+    if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson'):
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    raise ValueError('{}:{}: {}'.format(path, line_number, error)) from None
+                if not isinstance(row, dict):
+                    raise ValueError('{}:{}: not an object'.format(path, line_number))
+                yield row
+    else:
+        with open(path, newline='') as f:
+            yield from csv.DictReader(f, skipinitialspace=True)
+
+
+class ImportReport:
+    """what an import did"""
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.duplicates = 0
+        # (file, row number, reason) of the rows left out
+        self.invalid = []
+        self.seconds = 0.0
+
+    def rate(self):
+        """notes imported per second"""
+        return self.imported / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return ('{} notes imported, {} duplicates, {} invalid, {} rows read in {:.1f} s ({:.0f} notes/s)'
+                .format(self.imported, self.duplicates, len(self.invalid), self.read, self.seconds, self.rate()))
+
+
+class Importer:
+    """streaming import into a NoteManager
+
+    mapping renames columns of the source to categories ({'Name': 'title'}), columns
+    named after a category (in any case) are taken as is, other columns are ignored"""
+
+    def __init__(self, note_manager, mapping=None, batch_size=1000):
+        self.note_manager = note_manager
+        self.names = [category.name for category in categories]
+        self.mapping = {key.strip().casefold(): value for key, value in (mapping or {}).items()}
+        for value in self.mapping.values():
+            if value not in self.names:
+                raise ValueError('not a category: ' + value)
+        self.batch_size = batch_size
+        self.media = {media.casefold(): media for media in list_media}
+        # source column -> category, filled as columns are met
+        self.columns = {}
+        # keys of the notes already there, and of the imported ones
+        self.keys = {duplicate_key(note) for note in note_manager.notes.values()}
+
+    def category(self, column):
+        """category of a source column, None to ignore it"""
+        if column not in self.columns:
+            name = column.strip().casefold()
+            self.columns[column] = self.mapping.get(name, name if name in self.names else None)
+        return self.columns[column]
+
+    def convert(self, row):
+        """Note of a source row, raise ValueError if it can not be imported"""
+        values = dict.fromkeys(self.names, '')
+        for column, value in row.items():
+            name = self.category(column) if column is not None else None
+            if name is not None and value is not None:
+                values[name] = value if isinstance(value, str) else str(value)
+        media_type = values['media_type'].strip().casefold()
+        if media_type not in self.media:
+            raise ValueError('unknown media_type: ' + values['media_type'])
+        values['media_type'] = self.media[media_type]
+        # same rule as NoteWindow.save_note
+        if not any(value.strip() for value in values.values()):
+            raise ValueError('empty note')
+        return Note(values)
+
+    def run(self, paths):
+        """import every row of the files, return an ImportReport"""
+        report = ImportReport()
+        start = time.perf_counter()
+        batch = []
+        try:
+            for path in paths:
+                for number, row in enumerate(read_rows(path), 1):
+                    report.read += 1
+                    try:
+                        note = self.convert(row)
+                    except ValueError as error:
+                        report.invalid.append((path, number, str(error)))
+                        continue
+                    key = duplicate_key(note)
+                    if key in self.keys:
+                        report.duplicates += 1
+                        continue
+                    self.keys.add(key)
+                    batch.append(note)
+                    if len(batch) == self.batch_size:
+                        self.note_manager.add_notes(batch, write=False)
+                        report.imported += len(batch)
+                        batch = []
+            self.note_manager.add_notes(batch, write=False)
+            report.imported += len(batch)
+        finally:
+            # the batches added so far, even if a file could not be read
+            if report.imported:
+                self.note_manager.dump()
+        report.seconds = time.perf_counter() - start
+        return report
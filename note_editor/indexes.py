@@ -0,0 +1,115 @@
+import bisect
+import sys
+
+from note_editor.storage import id_field
+
+
+def text_key(value):
+    """case insensitive order, the one of the table of content"""
+    return value.casefold().capitalize()
+
+
+def year_key(value):
+    """numbers first, in numeric order, then anything else"""
+    value = value.strip()
+    if value.isdigit():
+        # the length first: '987' < '1999'
+        return '0' + chr(len(value.lstrip('0')) + 48) + value.lstrip('0')
+    return '1' + value.casefold()
+
+
+class SortedIndex:
+    """notes kept sorted by one category
+
+    keys, ids and notes are parallel lists: the sort key of each note, computed once when it
+    enters the index (short keys are interned, authors and years repeat), its id and the
+    note. Ties are in id order, the order in which the notes were created, so that the
+    index is the same however it was built. Adding or removing a note is a binary search
+    plus one insertion or deletion in the lists"""
+
+    def __init__(self, name, key=text_key):
+        self.name = name
+        self.key = key
+        self.keys = []
+        self.ids = []
+        self.notes = []
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __iter__(self):
+        """notes in order"""
+        return iter(self.notes)
+
+    def make_key(self, note):
+        key = self.key(note[self.name])
+        return sys.intern(key) if len(key) < 64 else key
+
+    def build(self, notes):
+        """index a whole list of notes at once"""
+        values = [note[self.name] for note in notes]
+        # one key per distinct value, notes with equal values share it
+        unique = {}
+        for value in set(values):
+            key = self.key(value)
+            unique[value] = sys.intern(key) if len(key) < 64 else key
+        keys = list(map(unique.__getitem__, values))
+        ids = [note[id_field] for note in notes]
+        # sorted is stable: sorted by id then by key, ties are in id order
+        order = sorted(range(len(notes)), key=ids.__getitem__)
+        order.sort(key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.ids = [ids[i] for i in order]
+        self.notes = [notes[i] for i in order]
+
+    def place(self, key, note_id, start=0):
+        """position of a key and id: among the notes with the same key, by id"""
+        start = bisect.bisect_left(self.keys, key, start)
+        end = bisect.bisect_right(self.keys, key, start)
+        return bisect.bisect_left(self.ids, note_id, start, end)
+
+    def add(self, note):
+        key = self.make_key(note)
+        i = self.place(key, note[id_field])
+        self.keys.insert(i, key)
+        self.ids.insert(i, note[id_field])
+        self.notes.insert(i, note)
+
+    def add_many(self, notes):
+        """add notes at once: one pass over the index instead of one insertion per note"""
+        new = sorted((self.make_key(note), note[id_field], i) for i, note in enumerate(notes))
+        keys = []
+        ids = []
+        indexed = []
+        start = 0
+        for key, note_id, i in new:
+            end = self.place(key, note_id, start)
+            keys.extend(self.keys[start:end])
+            ids.extend(self.ids[start:end])
+            indexed.extend(self.notes[start:end])
+            keys.append(key)
+            ids.append(note_id)
+            indexed.append(notes[i])
+            start = end
+        keys.extend(self.keys[start:])
+        ids.extend(self.ids[start:])
+        indexed.extend(self.notes[start:])
+        self.keys = keys
+        self.ids = ids
+        self.notes = indexed
+
+    def remove(self, note):
+        i = self.place(self.make_key(note), note[id_field])
+        if i == len(self.notes) or self.notes[i] is not note:
+            # the note was modified in place since it was indexed
+            i = next(i for i, indexed in enumerate(self.notes) if indexed is note)
+        del self.keys[i]
+        del self.ids[i]
+        del self.notes[i]
+
+    def update(self, old, new):
+        """observer of NoteManager"""
+        if old is not None:
+            self.remove(old)
+        if new is not None:
+            self.add(new)
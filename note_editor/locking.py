@@ -0,0 +1,95 @@
+"""advisory lock of a notes file, shared by every process that reads or writes it
+
+the lock is taken around each read or write of the files, not while the notes are open:
+two windows (or a window and a script) can edit the same notes, their writes are merged
+(see CsvStorage.merge)"""
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """exclusive lock of a lock file, re-entrant within a process
+
+    with create unset, a missing lock file is not created and the lock is not taken: a
+    program that only reads the notes leaves no file behind"""
+
+    def __init__(self, path, create=True):
+        self.path = path
+        self.create = create
+        self.file = None
+        self.depth = 0
+        # threads of this process, the file lock is between processes
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.depth == 0:
+            try:
+                self.acquire()
+            except OSError:
+                # read only directory: nobody can write the notes there either
+                self.file = None
+        self.depth += 1
+        return self
+
+    def try_enter(self):
+        """take the lock unless a thread or another program holds it, True if taken
+
+        release it with __exit__, for callers that must not wait (the gui thread)"""
+        if not self.lock.acquire(blocking=False):
+            return False
+        if self.depth == 0:
+            try:
+                if not self.acquire(blocking=False):
+                    self.lock.release()
+                    return False
+            except OSError:
+                self.file = None
+        self.depth += 1
+        return True
+
+    def __exit__(self, *args):
+        self.depth -= 1
+        if self.depth == 0 and self.file is not None:
+            self.release()
+        self.lock.release()
+
+    def acquire(self, blocking=True):
+        """lock the file, return False if it is locked by another program and blocking is False"""
+        # kept open between locks, taking the lock is then a single system call
+        if self.file is None or self.file.closed:
+            self.file = open(self.path, 'a+b' if self.create else 'rb')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        return False
+                    time.sleep(0.01)
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,18 +1,47 @@
-import configparser
 import os
+import sys
+import threading
+import time
 import tkinter as tk
+import traceback
 from tkinter import filedialog
 
+import note_editor
+from note_editor import trace
+from note_editor.config import load_config, save_config
+from note_editor.duplicates import DuplicateIndex
 from note_editor.notes_class import NoteManager, SelectNote, NoteWindow
-from note_editor.pdf_maker import make_pdf
+from note_editor.pdf_worker import PdfWorker
+from note_editor.search import SearchIndex
+
+
+class IndexBuild:
+    """an index of the notes built by a thread, see MainWindow.build_index"""
+
+    def __init__(self, index, notes):
+        self.index = index
+        # copy of the notes read by the thread, the gui keeps editing the notes meanwhile
+        self.notes = notes
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='index-build', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.index.build(self.notes)
+        except Exception:
+            # the gui works without the index
+            self.error = traceback.format_exc()
+            sys.stderr.write(self.error)
 
 
 class MainWindow:
     def __init__(self):
         # load config for save path
-        self.config = configparser.ConfigParser()
-        self.config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
-        self.config.read(self.config_path)
+        self.config = load_config()
+        # NOTE_EDITOR_TRACE takes precedence, see note_editor.trace
+        if not trace.enabled() and self.config.get('trace', 'path', fallback=''):
+            trace.enable(os.path.expanduser(self.config['trace']['path']))
         # main window
         self.root = tk.Tk()
         self.root.title('note on stuff')
@@ -50,16 +79,56 @@ class MainWindow:
                                      )
         # a label to show where the pdf is being saved
         self.save_label = tk.Label(self.root)
+        # and one for the state of the pdf build
+        self.pdf_label = tk.Label(self.root)
+        # edits not written yet
+        self.notes_label = tk.Label(self.root)
 
         # pack all widgets:
         self.new_note_btn.pack()
         self.edit_btn.pack()
         self.save_as_btn.pack()
         self.save_label.pack()
+        self.pdf_label.pack()
+        self.notes_label.pack()
         # load values
-        self.note_manager = NoteManager()
+        self.note_manager = NoteManager(backend=self.config.get('storage', 'backend', fallback='csv'),
+                                        lazy=self.config.getboolean('storage', 'lazy', fallback=True),
+                                        snapshot=self.config.getboolean('storage', 'snapshot', fallback=True),
+                                        background=self.config.getboolean('storage', 'background_writes',
+                                                                          fallback=True))
         self.write_label()
 
+        # pdf is built in the background, pdf_delay ms after the last edit
+        # 0 or unset: one process per core
+        self.pdf_worker = PdfWorker(workers=self.config.getint('pdf', 'workers', fallback=0),
+                                    split_by=self.config.get('pdf', 'split_by', fallback='') or None)
+        self.pdf_delay = 5000
+        self.pdf_timer = None
+        # (pdf path, note_manager.generation) of the last build handed to the worker
+        self.built = None
+        # full text index, None until loaded (or built) in the background
+        self.search_index = None
+        # similar titles, None until built in the background
+        self.duplicate_index = None
+        # attribute name -> IndexBuild still running, see build_index
+        self.index_builds = {}
+        self.note_manager.observers.append(self.on_notes_changed)
+        self.poll_pdf_worker()
+        # reportlab is loaded once the window is on screen
+        self.root.after_idle(self.on_shown)
+
+    def on_shown(self):
+        self.pdf_worker.warm()
+        # the indexes take seconds for 20k notes, the window would freeze at the first search
+        # or the first note window
+        path = os.path.splitext(self.note_manager.path)[0] + '_index.bin'
+        self.build_index('search_index', SearchIndex(path))
+        self.build_index('duplicate_index', DuplicateIndex())
+        # set NOTE_EDITOR_STARTUP to print the time from import to the window being shown
+        if os.environ.get('NOTE_EDITOR_STARTUP'):
+            sys.stderr.write('startup: %.3f s\n' % (time.perf_counter() - note_editor.started))
+
     def new_note(self):
         # close selection window
         if self.select_window:
@@ -75,6 +144,32 @@ class MainWindow:
             self.select_window.exit_window()
         self.select_window = SelectNote(self)
 
+    def build_index(self, name, index):
+        """build an index of the notes in a thread (index.build), it is set as attribute name once done
+
+        the thread reads a copy of the notes: the edits made meanwhile are applied by poll_indexes
+        from the gui thread, then the index follows the edits as an observer"""
+        self.index_builds[name] = IndexBuild(index, list(self.note_manager.notes.values()))
+
+    def poll_indexes(self):
+        for name, build in list(self.index_builds.items()):
+            if build.thread.is_alive():
+                continue
+            del self.index_builds[name]
+            if build.error is not None:
+                continue
+            notes = self.note_manager.notes.values()
+            built = {id(note) for note in build.notes}
+            current = {id(note) for note in notes}
+            for note in build.notes:
+                if id(note) not in current:
+                    build.index.update(note, None)
+            for note in notes:
+                if id(note) not in built:
+                    build.index.update(None, note)
+            self.note_manager.observers.append(build.index.update)
+            setattr(self, name, build.index)
+
     def save_as(self):
         head = self.config['save_path']['head']
         tail = self.config['save_path']['tail']
@@ -84,10 +179,11 @@ class MainWindow:
             head, tail = os.path.split(file)
             self.config['save_path']['head'] = head
             self.config['save_path']['tail'] = tail
-            with open(self.config_path, 'w') as f:
-                self.config.write(f)
+            save_config(self.config)
         # update label
         self.write_label()
+        if file:
+            self.schedule_pdf()
 
     def write_label(self):
         head = self.config['save_path']['head']
@@ -102,10 +198,69 @@ class MainWindow:
         except AttributeError:
             pass
 
+    def pdf_path(self):
+        return os.path.join(self.config['save_path']['head'], self.config['save_path']['tail'])
+
+    def on_notes_changed(self, old, new):
+        self.schedule_pdf()
+
+    def schedule_pdf(self):
+        """debounce: build once edits stop for pdf_delay ms"""
+        if self.pdf_timer is not None:
+            self.root.after_cancel(self.pdf_timer)
+        self.pdf_timer = self.root.after(self.pdf_delay, self.export_pdf)
+
+    def export_pdf(self):
+        """hand the current notes to the background worker if the pdf is out of date"""
+        if self.pdf_timer is not None:
+            self.root.after_cancel(self.pdf_timer)
+            self.pdf_timer = None
+        version = (self.pdf_path(), self.note_manager.generation)
+        if version != self.built or self.pdf_worker.status == 'failed':
+            self.built = version
+            self.pdf_worker.submit(version[0], self.note_manager)
+        self.write_pdf_label()
+
+    def write_pdf_label(self):
+        if self.pdf_timer is not None:
+            self.pdf_label.config(text='pdf: pending', fg='black')
+        elif self.pdf_worker.busy():
+            self.pdf_label.config(text='pdf: building...', fg='black')
+        elif self.pdf_worker.status == 'failed':
+            # last line of the traceback holds the exception
+            error = self.pdf_worker.error.strip().splitlines()[-1]
+            self.pdf_label.config(text='pdf build failed (notes are saved): ' + error, fg='red')
+        elif self.pdf_worker.status == 'done':
+            self.pdf_label.config(text='pdf: up to date', fg='black')
+        else:
+            self.pdf_label.config(text='', fg='black')
+
+    def write_notes_label(self):
+        writer = self.note_manager.writer
+        if writer is not None and writer.error is not None:
+            self.notes_label.config(text='notes could not be saved: ' + str(writer.error), fg='red')
+        elif self.note_manager.pending_writes():
+            self.notes_label.config(text='saving notes...', fg='black')
+        else:
+            self.notes_label.config(text='', fg='black')
+
+    def poll_pdf_worker(self):
+        """tk is not thread safe: the worker state is read from the gui thread"""
+        # notes written by another window or a script, open windows hold notes by id
+        if self.note_manager.sync() and self.select_window and self.select_window.root.winfo_exists():
+            self.select_window.search()
+        self.poll_indexes()
+        self.write_pdf_label()
+        self.write_notes_label()
+        self.root.after(250, self.poll_pdf_worker)
+
     def exit_gui(self, *args):
-        path = os.path.join(self.config['save_path']['head'], self.config['save_path']['tail'])
-        # try:
-        make_pdf(path, self.note_manager)
+        # hand off the last build: it finishes after the window is gone, see run
+        self.export_pdf()
+        # wait for the background writes then fold the journal into notes.csv
+        self.note_manager.compact()
+        if self.search_index is not None:
+            self.search_index.save()
 
         self.root.destroy()
 
@@ -113,6 +268,9 @@ class MainWindow:
 def run():
     gui = MainWindow()
     gui.root.mainloop()
+    # the main thread waits for the last build: the process pool of the pdf build can not
+    # start once the interpreter shuts down
+    gui.pdf_worker.wait()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,297 @@
+import contextlib
+import os
+from collections import namedtuple
+
+from note_editor import trace
+from note_editor.history import History
+from note_editor.indexes import SortedIndex, text_key, year_key
+from note_editor.storage import CsvStorage, Note, SqliteStorage, id_field, new_note_id, notes_digest, write_csv
+from note_editor.writer import BackgroundWriter
+
+list_media = ['book', 'movie', 'comic-book', 'short movie', 'podcast', 'drawing', 'leaflet', '']
+Category = namedtuple('Category', ['name', 'cat_type', 'values'])
+# order matters
+categories = (
+            Category('title', 'entry', None),       # needs to be 1st
+            Category('author', 'entry', None),
+            Category('year', 'entry', None),
+            Category('subtitle', 'entry', None),
+            Category('media_type', 'combo', list_media),
+            Category('episode', 'entry', None),
+            Category('link', 'entry', None),
+            Category('one_liner', 'entry', None),   # better if this stays one to last
+            Category('notes', 'text', None)         # needs to be last
+      )
+
+
+class NoteManager:
+    """notes which are dict with category names as keys
+    the category attribute is a tuple with info regarding the category
+
+    Each note has a persistent id (note['note_id'], see storage.new_note_id): self.notes
+    maps ids to notes, in the order of the notes (creation order, an update keeps the
+    place of the note). Windows, pdf anchors and caches refer to notes by id, which stays
+    valid whatever is added or removed meanwhile
+
+    Persistence is delegated to a storage backend:
+    - 'csv' (default): notes.csv with an append-only journal of edits and a binary snapshot
+      read at startup instead of the csv (see CsvStorage)
+    - 'sqlite': notes.db with indexes on the categories used for sorting and selection,
+      migrated from notes.csv the first time it is opened
+
+    With lazy=True, the heavy fields (notes and link) are only read when a note is opened
+    or rendered, startup reads the light columns and where each note is stored
+
+    With background=True, edits are written by a BackgroundWriter thread: the gui never
+    waits for the disk, call flush (or compact) to make sure they are written
+
+    With history=True, every version written is kept in notes_history next to the notes
+    (see History): restore brings back the notes of a version
+
+    With read_only=True, loading the notes writes nothing: a csv without ids keeps them in
+    memory until the first edit, and the notes as loaded are not saved as a first version
+
+    The notes are also kept sorted by title, author and year (see SortedIndex),
+    for the table of content and the columns of SelectNote"""
+
+    # fields deferred in lazy mode, SelectNote and the table of content never need them
+    heavy_fields = ('notes', 'link')
+    # category -> sort key of the indexes
+    sorted_fields = {'title': text_key, 'author': text_key, 'year': year_key}
+
+    def __init__(self, path=None, backend='csv', journal=True, lazy=False, snapshot=True,
+                 background=False, history=True, read_only=False):
+        self.categories = categories
+        self.select_window_open = False
+        keys = [cat.name for cat in self.categories] + [id_field]
+        heavy = self.heavy_fields if lazy else ()
+        # notes live next to the package unless told otherwise
+        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'notes.csv')
+        if backend == 'sqlite':
+            self.path = path or os.path.splitext(csv_path)[0] + '.db'
+            # one-shot migration from the csv sitting next to the database
+            csv_path = os.path.splitext(self.path)[0] + '.csv'
+            self.storage = SqliteStorage(self.path, keys, csv_path=csv_path, heavy=heavy)
+        elif backend == 'csv':
+            self.path = path or csv_path
+            self.storage = CsvStorage(self.path, keys, journal=journal, heavy=heavy, snapshot=snapshot,
+                                      read_only=read_only)
+        else:
+            raise ValueError('unknown storage backend: ' + str(backend))
+        self.history = History(os.path.splitext(self.path)[0] + '_history') if history else None
+        self.storage.history = self.history
+        self.read_only = read_only
+        self.writer = BackgroundWriter(self.storage) if background else None
+        # note id -> note
+        self.notes = {}
+        self.indexes = {name: SortedIndex(name, key) for name, key in self.sorted_fields.items()}
+        # callables notified of every edit with (old note, new note), None when absent
+        self.observers = []
+        # number of edits since the notes were loaded
+        self.generation = 0
+        # (generation, content hash), see content_hash
+        self.digest = None
+        self.load()
+
+    def notify(self, old, new):
+        """let observers know that a note was added (old is None), removed (new is None) or updated"""
+        self.generation += 1
+        for observer in self.observers:
+            observer(old, new)
+
+    def load(self):
+        """load current version of the notes"""
+        with trace.span('NoteManager.load'):
+            self.notes = self.storage.load()
+        if self.history is not None and not self.read_only:
+            self.history.begin(self.notes)
+        with trace.span('sort indexes'):
+            notes = list(self.notes.values())
+            for index in self.indexes.values():
+                index.build(notes)
+        trace.count('notes loaded', len(self.notes))
+
+    def save(self, record):
+        """persist one edit of self.notes (see storage.apply_record)"""
+        if self.writer is not None:
+            self.writer.submit(record, self.notes)
+        else:
+            self.storage.write(self.notes, [record])
+
+    def editing(self):
+        """held while self.notes changes, the background writer copies it between edits"""
+        return self.writer.condition if self.writer is not None else contextlib.nullcontext()
+
+    def flush(self):
+        """wait for the edits queued for the background writer"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def pending_writes(self):
+        """number of edits not written yet"""
+        return self.writer.pending() if self.writer is not None else 0
+
+    def dump(self):
+        """write current version of note_manager to file"""
+        self.flush()
+        with trace.span('NoteManager.dump', notes=len(self.notes)):
+            self.storage.dump(self.notes)
+        if trace.enabled() and os.path.exists(self.path):
+            trace.count('bytes written', os.path.getsize(self.path))
+
+    def compact(self):
+        """flush pending edits of the storage, called on exit"""
+        self.flush()
+        with trace.span('NoteManager.compact'):
+            self.storage.close(self.notes)
+
+    def reload(self):
+        """read the notes again after another program changed them, return (removed, added) notes
+
+        notes whose content did not change stay the same objects, in place in the indexes:
+        only the removed and the new (or modified) notes are notified to the observers"""
+        self.flush()
+        with trace.span('NoteManager.reload'):
+            notes, removed, added = self.storage.reload(self.notes)
+            self.replace(notes, removed, added)
+        return removed, added
+
+    def replace(self, notes, removed, added):
+        """take notes by id as the notes, removed and added being the notes that changed"""
+        with self.editing():
+            self.notes = notes
+        # past a few changes, a new sort is faster than as many insertions
+        incremental = len(removed) + len(added) <= len(notes) // 10
+        with trace.span('update indexes', removed=len(removed), added=len(added)):
+            for index in self.indexes.values():
+                if not incremental:
+                    index.build(list(notes.values()))
+                else:
+                    for note in removed:
+                        index.remove(note)
+                    index.add_many(added)
+        for note in removed:
+            self.notify(note, None)
+        for note in added:
+            self.notify(None, note)
+
+    def restore(self, version):
+        """bring the notes back to a version of the history, return (removed, added) notes
+
+        the restore is written as a new version: the notes before it stay in the history"""
+        if self.history is None:
+            raise ValueError('the history of the notes is turned off')
+        self.flush()
+        with trace.span('NoteManager.restore', version=version):
+            notes = self.history.notes(version, self.notes)
+            removed = [note for note_id, note in self.notes.items() if notes.get(note_id) is not note]
+            added = [note for note_id, note in notes.items() if self.notes.get(note_id) is not note]
+            self.replace(notes, removed, added)
+            self.dump()
+        return removed, added
+
+    def sync(self):
+        """read the notes again if another program wrote them, return True if it did
+
+        notes removed by the other program are gone, the ids of the others stay valid"""
+        if not self.storage.changed():
+            return False
+        self.reload()
+        return True
+
+    def content_hash(self):
+        """hash of the notes in order, computed once per generation"""
+        if self.digest is None or self.digest[0] != self.generation:
+            self.digest = (self.generation, notes_digest(self.notes.values()))
+        return self.digest[1]
+
+    def update_indexes(self, old, new):
+        for index in self.indexes.values():
+            index.update(old, new)
+
+    def get_note(self, note_id):
+        """note of an id, None if it was removed"""
+        return self.notes.get(note_id)
+
+    def make_note(self, note, note_id):
+        """Note of the categories of note (a dict from NoteWindow), with the given id"""
+        items = {cat.name: note.get(cat.name, '') for cat in self.categories}
+        items[id_field] = note_id
+        return Note(items)
+
+    def add_note(self, note):
+        """add note to the note manager class then write to file, return its new id"""
+        note = self.make_note(note, new_note_id())
+        note_id = note[id_field]
+        with self.editing():
+            self.notes[note_id] = note
+            self.save({'op': 'add', 'id': note_id, 'note': dict(note)})
+        self.update_indexes(None, note)
+        self.notify(None, note)
+        return note_id
+
+    def remove_note(self, note_id):
+        """remove note from note manager class then write to file"""
+        with self.editing():
+            old = self.notes.pop(note_id)
+            self.save({'op': 'remove', 'id': note_id})
+        self.update_indexes(old, None)
+        self.notify(old, None)
+
+    def update_note(self, note, note_id):
+        """replace a note by a new version, in place"""
+        note = self.make_note(note, note_id)
+        with self.editing():
+            old = self.notes[note_id]
+            self.notes[note_id] = note
+            self.save({'op': 'update', 'id': note_id, 'note': dict(note)})
+        self.update_indexes(old, note)
+        self.notify(old, note)
+
+    def sorted_notes(self, name):
+        """notes in the order of a sorted category"""
+        return list(self.indexes[name])
+
+    def sorted_ids(self, name):
+        """note ids sorted by a category (case insensitive)"""
+        if name in self.indexes:
+            return [note[id_field] for note in self.indexes[name]]
+        if hasattr(self.storage, 'sorted_ids'):
+            # the storage has every note once the edits are written
+            self.flush()
+            return self.storage.sorted_ids(name)
+        return sorted(self.notes, key=lambda note_id: (self.notes[note_id][name].casefold(), note_id))
+
+    def find(self, name, value):
+        """ids of the notes whose category equals value (case insensitive)"""
+        if hasattr(self.storage, 'find'):
+            self.flush()
+            return self.storage.find(name, value)
+        value = value.casefold()
+        return [note_id for note_id, note in self.notes.items() if note[name].casefold() == value]
+
+    def add_notes(self, notes, write=True):
+        """append many notes with a single write, or none: the caller dumps once done"""
+        notes = [self.make_note(note, new_note_id()) for note in notes]
+        self.flush()
+        with self.editing():
+            self.notes.update((note[id_field], note) for note in notes)
+        if write:
+            self.dump()
+        for index in self.indexes.values():
+            index.add_many(notes)
+        for note in notes:
+            self.notify(None, note)
+
+    def import_csv(self, path):
+        """append the notes of a csv or json lines file, skipping duplicates (see note_editor.importer)"""
+        from note_editor.importer import Importer
+        return Importer(self).run([path])
+
+    def export_csv(self, path):
+        """write all notes to a csv file"""
+        write_csv(path, [cat.name for cat in self.categories], self.notes.values())
+
+    def new_empty_note(self):
+        """generate empty note dictionary"""
+        return {category.name: '' for category in self.categories}
@@ -1,77 +1,10 @@
-import csv
-import os
 import tkinter as tk
-from collections import namedtuple
 from functools import partial
 from tkinter import ttk
 
-list_media = ['book', 'movie', 'comic-book', 'short movie', 'podcast', 'drawing', 'leaflet', '']
-Category = namedtuple('Category', ['name', 'cat_type', 'values'])
-# order matters
-categories = (
-            Category('title', 'entry', None),       # needs to be 1st
-            Category('author', 'entry', None),
-            Category('year', 'entry', None),
-            Category('subtitle', 'entry', None),
-            Category('media_type', 'combo', list_media),
-            Category('episode', 'entry', None),
-            Category('link', 'entry', None),
-            Category('one_liner', 'entry', None),   # better if this stays one to last
-            Category('notes', 'text', None)         # needs to be last
-      )
-
-
-class NoteManager:
-    """list of notes which are dict with category names as keys
-    the category attribute is a tuple with info regarding the category """
-
-    def __init__(self):
-        self.list = []
-        self.categories = categories
-        self.select_window_open = False
-        self.path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'notes.csv')
-        self.load()
-
-    def load(self):
-        """load current version of notes.csv"""
-        if os.path.exists(self.path):
-            with open(self.path) as p:
-                for row in csv.DictReader(p, skipinitialspace=True):
-                    self.list.append({k: v for k, v in row.items()})
-
-    def dump(self):
-        """write current version of note_manager to file and backup version n-1"""
-        """update pdf file"""
-        # if current exists, rename to backup
-        if os.path.exists(self.path):
-            base, ext = os.path.splitext(self.path)
-            os.rename(self.path, base + "_backup" + ext)
-        # write to file
-        keys = [cat.name for cat in self.categories]
-        with open(self.path, 'w', newline='') as output_file:
-            dict_writer = csv.DictWriter(output_file, keys)
-            dict_writer.writeheader()
-            dict_writer.writerows(self.list)
-
-    def add_note(self, note):
-        """add note to the note manager class then write to file"""
-        self.list.append(note)
-        self.dump()
-
-    def remove_note(self, note_number):
-        """remove note from note manager class then write to file"""
-        self.list.pop(note_number)
-        self.dump()
-
-    def update_note(self, note, note_number):
-        """update note by removing previous version and adding new one"""
-        self.remove_note(note_number)
-        self.add_note(note)
-        self.dump()
-
-    def new_empty_note(self):
-        """generate empty note dictionary"""
-        return {category.name: '' for category in self.categories}
+# NoteManager does not need tkinter, it is kept importable from here
+from note_editor.note_manager import NoteManager, Category, categories, list_media  # noqa: F401
+from note_editor.storage import id_field
 
 
 def select_all(event, cat_type):
@@ -88,8 +21,10 @@ def select_all(event, cat_type):
 
 
 class NoteWindow:
-    """Generate a note editor window for writing a new note or editing a previous one"""
-    def __init__(self, main, note_number=None):
+    """Generate a note editor window for writing a new note or editing a previous one
+
+    the edited note is held by id: other notes may be added or removed meanwhile"""
+    def __init__(self, main, note_id=None):
         # window design
         self.parent = main
         self.root = tk.Toplevel(self.parent.root)
@@ -101,11 +36,14 @@ class NoteWindow:
         # make arguments class attribute
         self.categories = self.parent.note_manager.categories
         self.note_manager = self.parent.note_manager
-        self.note_number = note_number
+        self.note_id = note_id
         # load existing values or create empty note
-        if type(self.note_number) == int:
-            self.note = self.note_manager.list[self.note_number]
+        note = self.note_manager.get_note(self.note_id)
+        if note is not None:
+            # edit a copy, the stored note may be read by a pdf build meanwhile
+            self.note = dict(note)
         else:
+            # removed meanwhile, saving adds it again
             self.note = self.note_manager.new_empty_note()
         self.entry_width = 35
 
@@ -132,6 +70,14 @@ class NoteWindow:
         self.delete_button.pack(side=tk.RIGHT)
         self.save_button.pack(side=tk.RIGHT)
 
+        # notes that look like this one, checked as title and author are typed
+        self.duplicate_label = tk.Label(self.root, fg='red', justify=tk.LEFT)
+        self.duplicate_label.pack(after=self.cat_frames['author'], anchor=tk.W)
+        self.duplicate_timer = None
+        for name in ('title', 'author'):
+            self.inputs[name].bind('<KeyRelease>', self.schedule_duplicate_check, add='+')
+        self.check_duplicates()
+
     def populate(self):
         """generate labels and input fields"""
         for name, cat_type, values in self.categories:
@@ -177,6 +123,31 @@ class NoteWindow:
         else:
             return self.inputs[name].get()
 
+    def schedule_duplicate_check(self, event=None):
+        """check once typing stops for 300 ms"""
+        if self.duplicate_timer is not None:
+            self.root.after_cancel(self.duplicate_timer)
+        self.duplicate_timer = self.root.after(300, self.check_duplicates)
+
+    def check_duplicates(self):
+        """warn about existing notes with a similar title and author"""
+        self.duplicate_timer = None
+        index = self.parent.duplicate_index
+        if index is None:
+            # built in the background after startup, no warning until it is done
+            if 'duplicate_index' in self.parent.index_builds:
+                self.duplicate_timer = self.root.after(250, self.check_duplicates)
+            return
+        note = {name: self.inputs[name].get() for name in ('title', 'author')}
+        text = ''
+        if note['title'].strip():
+            # the note being edited is not its own duplicate
+            edited = self.note_manager.get_note(self.note_id)
+            matches = index.similar(note, exclude=edited, limit=3)
+            text = '\n'.join('similar note: {} - {} ({})'.format(other['title'], other['author'], other['year'])
+                             for _, other in matches)
+        self.duplicate_label.config(text=text)
+
     def set_save_focus(self, *args):
         """Save if save button has focus, otherwise, focus"""
         if self.root.focus_get() == self.save_button:
@@ -204,26 +175,29 @@ class NoteWindow:
                             break
 
         # save values
-        if type(self.note_number) == int:
+        # a note removed by another program meanwhile is added again
+        if self.note_manager.get_note(self.note_id) is not None:
             # If editing an existing note
             if is_empty:
                 # if all fields have been emptied, remove
-                self.note_manager.remove_note(self.note_number)
+                self.note_manager.remove_note(self.note_id)
             else:
                 # otherwise, update note
-                self.note_manager.update_note(self.note, self.note_number)
+                self.note_manager.update_note(self.note, self.note_id)
         else:
             if not is_empty:
                 # add note
-                self.note_manager.add_note(self.note)
+                self.note_id = self.note_manager.add_note(self.note)
 
     def delete_note(self):
         """if editing an existing note, remove it from note manager"""
-        if type(self.note_number) == int:
-            self.note_manager.remove_note(self.note_number)
+        if self.note_manager.get_note(self.note_id) is not None:
+            self.note_manager.remove_note(self.note_id)
             self.exit_window()
 
     def exit_window(self, *args):
+        if self.duplicate_timer is not None:
+            self.root.after_cancel(self.duplicate_timer)
         # update number of opened note windows
         self.parent.opened_note_window -= 1
         # close window
@@ -231,6 +205,11 @@ class NoteWindow:
 
 
 class SelectNote:
+    """table of notes to pick one to edit or delete
+
+    Rows are virtualized: only enough row widgets to fill the canvas (plus overscan rows
+    above and below) exist, and they are moved and relabelled as the view scrolls,
+    so that opening and scrolling cost the same for 10 or 10k notes"""
     def __init__(self, main):
         # options
         self.sub_categories = ['title', 'author', 'year']
@@ -240,8 +219,19 @@ class SelectNote:
         self.btn_width = 4
         self.bg_color = 'green'
         self.fg_color = 'orange'
+        # extra rows kept above and below the visible ones
+        self.overscan = 2
         # load var into attributes
         self.parent = main
+        # note ids in display order
+        self.rows = []
+        # recycled row widgets: (canvas item, frame, button, labels)
+        self.pool = []
+        self.row_height = None
+        # column the rows are sorted by (None: order of the notes) and its direction
+        self.sort_by = None
+        self.sort_reverse = False
+        self.title_labels = {}
         # window design
         self.root = tk.Toplevel(self.parent.root)
         self.root.title('Select to edit/delete')
@@ -258,28 +248,30 @@ class SelectNote:
         # Main frame in root
         self.frame_root = tk.Frame(self.root)
         self.frame_root.grid(sticky='news')
+        self.frame_root.grid_rowconfigure(2, weight=1)
         # equal weight to all columns
         for i in range(self.n_cols):
             self.frame_root.grid_columnconfigure(i, weight=1)
 
+        # search box filtering the table through the full text index
+        self.search_entry = tk.Entry(self.frame_root)
+        self.search_entry.grid(row=0, column=0, columnspan=self.n_cols, sticky='ew')
+        self.search_entry.bind('<KeyRelease>', self.schedule_search)
+        self.search_timer = None
+        self.search_entry.focus()
+        # rows of removed notes are dropped once the edits are done, see on_notes_changed
+        self.refilter_timer = None
+
         # create canvas for scrolling behavior
-        self.canvas = tk.Canvas(self.frame_root)
-        self.canvas.grid(row=1, column=0, columnspan=self.n_cols, sticky="news")
-        self.canvas.grid_columnconfigure(0, weight=1)
+        self.canvas = tk.Canvas(self.frame_root, bg=self.bg_color)
+        self.canvas.grid(row=2, column=0, columnspan=self.n_cols, sticky="news")
 
-        # allow for scrolling within the canvas
+        # allow for scrolling within the canvas, rows are refreshed whenever the view moves
         self.vsb = tk.Scrollbar(self.frame_root, orient="vertical", command=self.canvas.yview)
-        self.vsb.grid(row=1, column=self.n_cols, sticky='ns')
-        self.canvas.configure(yscrollcommand=self.vsb.set)
+        self.vsb.grid(row=2, column=self.n_cols, sticky='ns')
+        self.canvas.configure(yscrollcommand=self.on_scroll)
 
-        # Create a frame in the canvas to hold widgets
-        self.frame_notes = tk.Frame(self.canvas, bg=self.bg_color)
-        # equal weight to all columns
-        for i in range(self.n_cols):
-            self.frame_notes.grid_columnconfigure(i, weight=1)
-        self.canvas.create_window((0, 0), window=self.frame_notes, anchor='nw', tags="self.frame_notes")
-
-        # resize frame to fit canvas
+        # resize rows to fit canvas
         self.canvas.bind("<Configure>", self.on_canvas_configure)
 
         # Populate window
@@ -290,49 +282,178 @@ class SelectNote:
         """generate column titles"""
         # generate fake button for alignment purposes
         fake_button = tk.Button(self.frame_root, text='', width=self.btn_width, state=tk.DISABLED)
-        fake_button.grid(row=0, column=0, sticky='nw')
+        fake_button.grid(row=1, column=0, sticky='nw')
         # generate and position columns head
         for i, name in enumerate(self.sub_categories):
             label = tk.Label(self.frame_root,
                              text=name.capitalize(),
                              width=self.max_char,
                              bg=self.bg_color,
-                             fg=self.fg_color
+                             fg=self.fg_color,
+                             cursor='hand2'
                              )
-            label.grid(row=0, column=i+1, sticky='w')
+            label.grid(row=1, column=i+1, sticky='w')
+            # click to sort by this column
+            label.bind('<Button-1>', partial(self.sort, name))
+            self.title_labels[name] = label
 
     def make_table(self, note_manager):
         """populate table with info from note manager"""
-        for note_number, note in enumerate(note_manager.list):
-            # partial to retain number that was clicked:
-            selected_note = partial(self.click, note_number)
-            button = tk.Button(self.frame_notes,
-                               text=str(note_number),
-                               command=selected_note,
-                               width=self.btn_width,
-                               highlightthickness=2
-                               )
+        self.note_manager = note_manager
+        self.note_manager.observers.append(self.on_notes_changed)
+        self.show_rows(self.all_rows())
+
+    def on_notes_changed(self, old, new):
+        """a note was edited (in a note window, or by another program), refilter the rows when idle"""
+        if self.refilter_timer is None:
+            self.refilter_timer = self.root.after_idle(self.refilter)
+
+    def refilter(self):
+        """drop the rows of removed notes and show the others again"""
+        self.refilter_timer = None
+        self.rows = [note_id for note_id in self.rows if self.note_manager.get_note(note_id) is not None]
+        if self.row_height is not None:
+            self.update_scrollregion()
+            self.fill_pool()
+
+    def all_rows(self):
+        """every note id, in the order of the sorted column if any"""
+        if self.sort_by is None:
+            return list(self.note_manager.notes)
+        # read from the sorted indexes of the note manager
+        rows = self.note_manager.sorted_ids(self.sort_by)
+        if self.sort_reverse:
+            rows.reverse()
+        return rows
+
+    def sort(self, name, *args):
+        """sort by a column, clicking the same column again reverses the order"""
+        if self.sort_by == name:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_by, self.sort_reverse = name, False
+        for label_name, label in self.title_labels.items():
+            arrow = (' v' if self.sort_reverse else ' ^') if label_name == name else ''
+            label.config(text=label_name.capitalize() + arrow)
+        if self.search_entry.get().strip():
+            # sort the search results only
+            rank = {note_id: i for i, note_id in enumerate(self.all_rows())}
+            self.show_rows(sorted(self.rows, key=rank.get))
+        else:
+            self.show_rows(self.all_rows())
+
+    def schedule_search(self, event=None):
+        """search once typing stops for 300 ms"""
+        if self.search_timer is not None:
+            self.root.after_cancel(self.search_timer)
+        self.search_timer = self.root.after(300, self.search)
+
+    def search(self, *args):
+        """show the notes matching the search box, best match first"""
+        if self.search_timer is not None:
+            self.root.after_cancel(self.search_timer)
+        self.search_timer = None
+        query = self.search_entry.get()
+        if not query.strip():
+            self.show_rows(self.all_rows())
+            return
+        index = self.parent.search_index
+        if index is None:
+            # loaded in the background after startup, searched once it is done
+            if 'search_index' in self.parent.index_builds:
+                self.search_timer = self.root.after(250, self.search)
+            return
+        notes = index.search(query, limit=500)
+        self.show_rows([note[id_field] for note in notes if self.note_manager.get_note(note[id_field]) is note])
+
+    def show_rows(self, rows):
+        """display the given note ids in that order"""
+        self.rows = rows
+        if self.row_height is None:
+            # measure one row to lay the others out on the canvas
+            self.make_row()
+            self.pool[0][1].update_idletasks()
+            self.row_height = self.pool[0][1].winfo_reqheight()
+            self.canvas.configure(yscrollincrement=self.row_height)
+        self.canvas.yview_moveto(0)
+        self.update_scrollregion()
+        self.fill_pool()
+
+    def make_row(self):
+        """add one row of widgets to the pool"""
+        frame = tk.Frame(self.canvas, bg=self.bg_color)
+        # equal weight to all columns
+        for i in range(self.n_cols):
+            frame.grid_columnconfigure(i, weight=1)
+        button = tk.Button(frame,
+                           width=self.btn_width,
+                           highlightthickness=2
+                           )
+        # position button
+        button.grid(row=0, column=0, sticky='nw')
+        labels = []
+        for i in range(len(self.sub_categories)):
+            label = tk.Label(frame,
+                             width=self.max_char,
+                             bg=self.fg_color)
+            # position label
+            label.grid(row=0, column=i + 1, sticky='w')
+            labels.append(label)
+        item = self.canvas.create_window((0, 0), window=frame, anchor='nw',
+                                         width=self.canvas.winfo_width(), state='hidden')
+        self.pool.append((item, frame, button, labels))
+
+    def fill_pool(self):
+        """create enough rows to cover the canvas then show the ones in view"""
+        visible = self.canvas.winfo_height() // self.row_height + 1
+        while len(self.pool) < min(visible + 2 * self.overscan, len(self.rows)):
+            self.make_row()
+        self.refresh_rows()
+
+    def refresh_rows(self):
+        """move pooled rows to the notes around the current view"""
+        if not self.row_height:
+            return
+        first = int(self.canvas.canvasy(0)) // self.row_height - self.overscan
+        first = max(0, min(first, len(self.rows) - len(self.pool)))
+        for offset, (item, frame, button, labels) in enumerate(self.pool):
+            row = first + offset
+            if row >= len(self.rows):
+                self.canvas.itemconfigure(item, state='hidden')
+                continue
+            note_id = self.rows[row]
+            note = self.note_manager.get_note(note_id)
+            if note is None:
+                # removed, until refilter
+                self.canvas.itemconfigure(item, state='hidden')
+                continue
+            # partial to retain the note that was clicked:
+            selected_note = partial(self.click, note_id)
+            button.configure(text=str(row), command=selected_note)
             button.bind('<Return>', selected_note)
-            # position button
-            button.grid(row=note_number + 1, column=0, sticky='nw')
-
             # populate columns:
-            for i, cat in enumerate(self.sub_categories):
-                text = self.set_char(note[cat]).capitalize()
-                label = tk.Label(self.frame_notes,
-                                 text=text,
-                                 width=self.max_char,
-                                 bg=self.fg_color)
-                # position label
-                label.grid(row=note_number + 1, column=i + 1, sticky='w')
-
-    def click(self, note_number, *args):
+            for label, cat in zip(labels, self.sub_categories):
+                label.configure(text=self.set_char(note[cat]).capitalize())
+            self.canvas.coords(item, 0, row * self.row_height)
+            self.canvas.itemconfigure(item, state='normal')
+
+    def update_scrollregion(self):
+        """virtual height of the table: all rows, including those without widgets"""
+        height = len(self.rows) * self.row_height
+        self.canvas.config(scrollregion=(0, 0, self.canvas.winfo_width(), height))
+
+    def click(self, note_id, *args):
         """open selected note and close current window"""
-        NoteWindow(self.parent, note_number=note_number)
+        NoteWindow(self.parent, note_id=note_id)
         self.exit_window()
 
     def exit_window(self, *args):
         """close window"""
+        if self.search_timer is not None:
+            self.root.after_cancel(self.search_timer)
+        if self.refilter_timer is not None:
+            self.root.after_cancel(self.refilter_timer)
+        self.note_manager.observers.remove(self.on_notes_changed)
         # let parent know that window was closed
         self.parent.select_window = None
         self.root.destroy()
@@ -347,11 +468,18 @@ class SelectNote:
             direction = -1
         self.canvas.yview_scroll(direction, "units")
 
+    def on_scroll(self, first, last):
+        """view moved (wheel, scrollbar or resize): update scrollbar and recycle rows"""
+        self.vsb.set(first, last)
+        self.refresh_rows()
+
     def on_canvas_configure(self, event):
-        """adjust frame to canvas and set scrolling region"""
-        self.canvas.itemconfigure("self.frame_notes", width=event.width)
-        # Set the canvas scrolling region
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+        """adjust rows to canvas and set scrolling region"""
+        for item, _, _, _ in self.pool:
+            self.canvas.itemconfigure(item, width=event.width)
+        self.update_scrollregion()
+        # a taller canvas needs more rows
+        self.fill_pool()
 
     def set_char(self, string):
         """truncate strings to fit labels"""
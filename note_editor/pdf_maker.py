@@ -1,16 +1,28 @@
+import hashlib
+import json
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from reportlab import Version as reportlab_version
 from reportlab.graphics.shapes import Line, Drawing
 from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak, Spacer, Preformatted, Table, TableStyle
 
+from note_editor import trace
+from note_editor.indexes import text_key
+from note_editor.storage import full_note, id_field, note_key, notes_digest
+try:
+    import pypdf
+except ImportError:  # pypdf merges cached pages, without it every export is a full build
+    pypdf = None
+
 parent_path = os.path.dirname(os.path.abspath(__file__))
-# Mono fonts to enable proper tab representation in pdf
-pdfmetrics.registerFont(TTFont('DejaVuSansMono', parent_path + '/DejaVuSansMono.ttf'))
-pdfmetrics.registerFont(TTFont('DejaVuSansMonoBold', parent_path + '/DejaVuSansMono-Bold.ttf'))
+# Mono fonts to enable proper tab representation in pdf, registered by register_fonts
 font = 'DejaVuSansMono'
 font_bold = 'DejaVuSansMonoBold'
 
@@ -19,28 +31,307 @@ page_size = (148 * mm, 210 * mm)
 # generate platypus template
 margins = (15, 15, 30, 30)  # n s e w
 
+# bump when the layout of add_page changes to invalidate cached pages
+cache_version = 1
+# a chunk of cached pages ends on notes whose hash is a multiple of chunk_period:
+# about 32 notes per chunk so that fonts are not embedded once per note
+chunk_period = 32
+max_chunk_size = 4 * chunk_period
+# links of the table of content point here until pages are merged
+note_link = 'note:'
+
+fonts_lock = threading.Lock()
+fonts_registered = False
+
+
+def register_fonts():
+    """parse the ttf files, once per process, before the first document is laid out"""
+    global fonts_registered
+    with fonts_lock:
+        if not fonts_registered:
+            pdfmetrics.registerFont(TTFont(font, parent_path + '/DejaVuSansMono.ttf'))
+            pdfmetrics.registerFont(TTFont(font_bold, parent_path + '/DejaVuSansMono-Bold.ttf'))
+            fonts_registered = True
+
 
-def make_pdf(path_to_pdf, note_manager):
-    """main function"""
-    # platypus default template
+def make_pdf(path_to_pdf, note_manager, cache_dir=None, notes=None, workers=None, orders=None, force=False):
+    """main function, return False if the pdf was up to date
+
+    with pypdf installed, note pages are cached in cache_dir (next to the notes by default)
+    and only chunks with new or edited notes are laid out again, by up to workers processes
+    (all cores by default, 1 to stay in this process)
+    notes defaults to the notes of note_manager, pass a list when building outside of the gui thread,
+    along with orders, the note ids sorted by title and by author (see table_orders)
+    nothing is built if the manifest next to the pdf holds the hash of these notes and
+    settings and the pdf was not modified since, unless force is set"""
     path_to_pdf = os.path.expanduser(path_to_pdf)
-    doc = SimpleDocTemplate(path_to_pdf, pagesize=page_size,
-                            topMargin=margins[0], bottonMargin=margins[1],
-                            leftMargin=margins[2], rightMargin=margins[3])
+    with trace.span('hash notes'):
+        digest = export_hash(note_manager.content_hash() if notes is None else notes_digest(notes))
+    if not force and up_to_date(path_to_pdf, digest):
+        trace.count('skipped builds')
+        return False
+    if notes is None:
+        notes = list(note_manager.notes.values())
+        orders = table_orders(note_manager)
+    with trace.span('make_pdf', notes=len(notes)):
+        if pypdf is None:
+            build_all(path_to_pdf, notes, orders)
+        else:
+            if cache_dir is None:
+                cache_dir = os.path.join(os.path.dirname(os.path.abspath(note_manager.path)), 'page_cache')
+            build_incremental(path_to_pdf, notes, cache_dir, workers or os.cpu_count() or 1, orders)
+    write_manifest(path_to_pdf, digest)
+    if trace.enabled():
+        trace.count('bytes written', os.path.getsize(path_to_pdf))
+    return True
+
+
+def export_hash(digest):
+    """hash of the pdf of notes whose notes_digest is digest"""
+    return hashlib.sha1((style_settings() + digest).encode('utf-8')).hexdigest()
+
+
+def manifest_path(path_to_pdf):
+    """~/notes_on_stuff.pdf -> ~/notes_on_stuff_manifest.json"""
+    return os.path.splitext(path_to_pdf)[0] + '_manifest.json'
+
+
+def pdf_stat(path_to_pdf):
+    """size and modification time, they change if anything else writes the pdf"""
+    stat = os.stat(path_to_pdf)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def up_to_date(path_to_pdf, digest):
+    """True if the pdf was built from notes and settings of this hash and is untouched since"""
+    try:
+        with open(manifest_path(path_to_pdf)) as f:
+            manifest = json.load(f)
+        return manifest['hash'] == digest and manifest['pdf'] == pdf_stat(path_to_pdf)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+
+def write_manifest(path_to_pdf, digest):
+    tmp_path = manifest_path(path_to_pdf) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'hash': digest, 'pdf': pdf_stat(path_to_pdf)}, f)
+    os.replace(tmp_path, manifest_path(path_to_pdf))
+
+
+def table_orders(note_manager):
+    """note ids in the order of both columns of the table of content, from the sorted indexes"""
+    return {name: note_manager.sorted_ids(name) for name in ('title', 'author')}
+
+
+def make_doc(path_to_pdf, doc_class=SimpleDocTemplate, **kwargs):
+    """platypus default template"""
+    register_fonts()
+    return doc_class(path_to_pdf, pagesize=page_size,
+                     topMargin=margins[0], bottonMargin=margins[1],
+                     leftMargin=margins[2], rightMargin=margins[3], **kwargs)
+
+
+def build_all(path_to_pdf, notes, orders=None):
+    """lay out every note in a single document"""
+    doc = make_doc(path_to_pdf)
+    styles = StyleRegistry()
 
     # instantiate flowable with first page (table of content)
-    all_elements = make_first_page(note_manager.list)
+    with trace.span('make_first_page'):
+        all_elements = make_first_page(notes, styles=styles, orders=orders)
 
     # add note pages
-    for number, note in enumerate(note_manager.list):
-        all_elements.extend(add_page(note, number))
+    with trace.span('add_page', notes=len(notes)):
+        for note in notes:
+            all_elements.extend(add_page(full_note(note), note[id_field], styles))
+    trace.count('notes processed', len(notes))
 
     # build pdf ducument
-    doc.multiBuild(all_elements)
+    with trace.span('multiBuild'):
+        doc.multiBuild(all_elements)
+    trace.count('pages emitted', doc.page)
+
+
+def style_settings():
+    """everything besides the note itself that changes how its pages look"""
+    return json.dumps([cache_version, reportlab_version, font, font_bold, page_size, margins])
+
+
+def note_hash(note, settings):
+    """content hash of a note rendered with the given settings
+
+    lazily loaded notes know their content hash, their body is only read if the page is rendered"""
+    data = settings + note_key(note)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def make_chunks(hashes):
+    """group consecutive notes into content defined chunks
+
+    boundaries only depend on the notes themselves, so adding, removing or editing
+    one note leaves the other chunks (and their cached pages) untouched"""
+    chunks = []
+    start = 0
+    for i, h in enumerate(hashes):
+        if int(h[:8], 16) % chunk_period == 0 or i + 1 - start == max_chunk_size:
+            chunks.append((start, i + 1))
+            start = i + 1
+    if start < len(hashes):
+        chunks.append((start, len(hashes)))
+    return chunks
+
+
+class ChunkDocTemplate(SimpleDocTemplate):
+    """template recording where each note starts"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (page index, x, y) of the title of each note
+        self.note_starts = []
+
+    def afterFlowable(self, flowable):
+        if getattr(flowable, 'note_start', False):
+            top = self.frame._y + flowable.height + flowable.getSpaceAfter()
+            self.note_starts.append((self.page - 1, self.frame._x, top))
 
 
-def add_page(note, number):
-    """build the page(s) for a given note"""
+def render_chunk(path, notes, styles=None):
+    """lay out the pages of some notes without anchors, return where each note starts
+
+    invariant documents (no timestamp, fixed id) make a chunk the same whichever process renders it"""
+    doc = make_doc(path, ChunkDocTemplate, invariant=True)
+    elements = []
+    with trace.span('add_page', notes=len(notes)):
+        for note in notes:
+            pages = add_page(note, styles=styles)
+            # first flowable is the title
+            pages[0].note_start = True
+            elements.extend(pages)
+    trace.count('notes processed', len(notes))
+    with trace.span('layout chunk', notes=len(notes)):
+        doc.build(elements)
+    trace.count('pages emitted', doc.page)
+    if len(doc.note_starts) != len(notes):
+        raise ValueError('could not locate the first page of every note in ' + path)
+    return doc.note_starts
+
+
+def build_incremental(path_to_pdf, notes, cache_dir, workers=1, orders=None):
+    """reuse cached pages of unchanged notes, lay out the rest and merge everything"""
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, 'index.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    settings = style_settings()
+    styles = StyleRegistry()
+    with trace.span('hash notes'):
+        hashes = [note_hash(note, settings) for note in notes]
+    chunks = []
+    new_index = {}
+    # chunks to lay out: (key, path, notes)
+    missing = []
+    for start, end in make_chunks(hashes):
+        key = hashlib.sha1(''.join(hashes[start:end]).encode('ascii')).hexdigest()
+        chunk_path = os.path.join(cache_dir, key + '.pdf')
+        if key in index and os.path.exists(chunk_path):
+            new_index[key] = index[key]
+        elif key not in new_index:
+            missing.append((key, chunk_path, notes[start:end]))
+        chunks.append((chunk_path, key))
+
+    toc_path = os.path.join(cache_dir, 'table_of_content.pdf')
+    trace.count('cached chunks', len(chunks) - len(missing))
+    if workers > 1 and len(missing) > 1:
+        # spawn: the gui calls this from a thread, forking a threaded tk process is unsafe
+        # notes are sent as plain dicts, lazy notes hold the storage which does not pickle;
+        # they are read without keeping their bodies, as in the loop below
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(min(workers, len(missing)), mp_context=context) as pool:
+            futures = [(key, pool.submit(trace.run_traced, trace.enabled(), render_chunk,
+                                         chunk_path, [dict(full_note(note)) for note in chunk_notes], styles))
+                       for key, chunk_path, chunk_notes in missing]
+            # table of content is laid out meanwhile
+            make_table_of_content(toc_path, notes, styles, orders)
+            for key, future in futures:
+                new_index[key], events = future.result()
+                trace.add_events(events)
+    else:
+        for key, chunk_path, chunk_notes in missing:
+            new_index[key] = render_chunk(chunk_path, [full_note(note) for note in chunk_notes], styles)
+        # table of content is laid out every time, its links are resolved when merging
+        make_table_of_content(toc_path, notes, styles, orders)
+    with trace.span('merge_pages', chunks=len(chunks)):
+        merge_pages(path_to_pdf, toc_path, [(chunk_path, new_index[key]) for chunk_path, key in chunks],
+                    [note[id_field] for note in notes])
+
+    # forget pages of notes that no longer exist
+    with open(index_path, 'w') as f:
+        json.dump(new_index, f)
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pdf') and name[:-4] not in new_index and name != 'table_of_content.pdf':
+            os.remove(os.path.join(cache_dir, name))
+
+
+def make_table_of_content(path, notes, styles, orders=None):
+    """first pages of the pdf, with note:<note id> links"""
+    with trace.span('make_first_page'):
+        elements = make_first_page(notes, link=note_link, styles=styles, orders=orders)
+    with trace.span('layout table of content'):
+        make_doc(path, invariant=True).build(elements)
+
+
+def merge_pages(path_to_pdf, toc_path, chunks, ids):
+    """assemble table of content and cached pages, restoring the anchor_<note id> destinations
+
+    ids are those of the notes of the chunks, in order"""
+    writer = pypdf.PdfWriter()
+    # keep the merged pages at hand, counting the page tree of the writer is slow
+    toc_pages = [writer.add_page(page) for page in pypdf.PdfReader(toc_path).pages]
+    pages = list(toc_pages)
+    note_starts = []
+    for chunk_path, starts in chunks:
+        offset = len(pages)
+        pages.extend(writer.add_page(page) for page in pypdf.PdfReader(chunk_path).pages)
+        note_starts.extend((offset + page, x, y) for page, x, y in starts)
+
+    numbers = {note_id: number for number, note_id in enumerate(ids)}
+
+    def destination(note_id):
+        page, x, y = note_starts[numbers[note_id]]
+        return pypdf.generic.ArrayObject([pages[page].indirect_reference,
+                                          pypdf.generic.NameObject('/XYZ'),
+                                          pypdf.generic.FloatObject(x),
+                                          pypdf.generic.FloatObject(y),
+                                          pypdf.generic.NumberObject(0)])
+
+    # turn note:<note id> links of the table of content into links to the first page of that note
+    for page in toc_pages:
+        for annot in page.get('/Annots', []):
+            annot = annot.get_object()
+            uri = annot.get('/A', {}).get('/URI', '')
+            if uri.startswith(note_link):
+                del annot['/A']
+                annot[pypdf.generic.NameObject('/Dest')] = destination(uri[len(note_link):])
+    # named after the id: a link to a note stays valid whatever is added or removed before it
+    for note_id, (page, _, _) in zip(ids, note_starts):
+        writer.add_named_destination('anchor_' + note_id, page)
+
+    # write next to the target and swap, so that a failed build keeps the previous pdf
+    tmp_path = path_to_pdf + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        writer.write(f)
+    os.replace(tmp_path, path_to_pdf)
+
+
+def add_page(note, note_id=None, styles=None):
+    """build the page(s) for a given note, with an anchor for the table of content if note_id is given"""
+    if styles is None:
+        styles = default_styles()
     flowables = []
 
     # drawing elements
@@ -50,19 +341,20 @@ def add_page(note, number):
     space = Spacer(1, 4 * mm)
 
     # title + anchor for link to table of content
-    anchor = '<a name="anchor_' + str(number) + '"/>'
-    text = anchor + note['title']
-    style = make_style('Title', 20, bold=True)
+    text = note['title']
+    if note_id is not None:
+        text = '<a name="anchor_' + note_id + '"/>' + text
+    style = styles['Title', 20, True]
     flowables.append(Paragraph(text, style))
 
     # subtitle
     if note['subtitle']:
-        style = make_style('Title', 12)
+        style = styles['Title', 12]
         flowables.append(Paragraph(note['subtitle'], style))
 
     # author and year
     text = note['author'] + ' (' + note['year'] + ')'
-    style = make_style('Title', 14)
+    style = styles['Title', 14]
     flowables.append(Paragraph(text, style))
 
     # Media type and episode:
@@ -72,12 +364,12 @@ def add_page(note, number):
     if note['link']:
         text = text + '<br />\n' +\
                '<link href="' + note['link'] + '">' + 'External Resource' + '</link>'
-    style = make_style('Title', 10)
+    style = styles['Title', 10]
     flowables.append(Paragraph(text, style))
 
     # one liner
     text = note['one_liner']
-    style = make_style('BodyText', 12)
+    style = styles['BodyText', 12]
     flowables.extend([line,
                       Paragraph(text, style),
                       space, line
@@ -85,7 +377,7 @@ def add_page(note, number):
 
     # notes
     text = format_str(note['notes'])
-    style = make_style('BodyText', 12)
+    style = styles['BodyText', 12]
     flowables.append(Preformatted(text, style, maxLineLength=50))
 
     # go to next page
@@ -93,17 +385,60 @@ def add_page(note, number):
     return flowables
 
 
+class FrozenStyle(ParagraphStyle):
+    """paragraph style that can not be modified once built, so that it can be shared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__dict__['frozen'] = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('frozen'):
+            raise AttributeError('style ' + self.name + ' is read only')
+        super().__setattr__(name, value)
+
+
+class StyleRegistry:
+    """every paragraph style of the pdf, built once per export
+
+    styles are looked up by (name, size, bold) and never modified: one registry serves
+    every paragraph and is pickled as is to the processes laying out pages"""
+    # (name, size, bold) used by add_page and make_first_page
+    used = (('Title', 20, True), ('Title', 14, True), ('Title', 14), ('Title', 12), ('Title', 10),
+            ('BodyText', 12, True), ('BodyText', 12), ('BodyText', 10))
+
+    def __init__(self):
+        # paragraphs look up the font of their style when they are created
+        register_fonts()
+        # preset styles in platypus
+        sample = getSampleStyleSheet()  # styles.list() to print all available
+        self.styles = {}
+        for key in self.used:
+            name, size = key[:2]
+            settings = {k: v for k, v in vars(sample[name]).items() if k not in ('name', 'parent')}
+            # bold styles use the regular font too, as make_style always did
+            settings.update(fontName=font, fontSize=size)
+            self.styles[key] = FrozenStyle(name, **settings)
+
+    def __getitem__(self, key):
+        return self.styles[key]
+
+
+default_registry = None
+
+
+def default_styles():
+    """registry shared by calls that do not pass their own"""
+    global default_registry
+    if default_registry is None:
+        default_registry = StyleRegistry()
+    return default_registry
+
+
 def make_style(name, size, bold=None):
     """set style class"""
-    # preset styles in platypus
-    style_dict = getSampleStyleSheet()  # styles.list() to print all available
-    style = style_dict[name]
-    if bold:
-        style.fontName = font
-    else:
-        style.fontName = font
-    style.fontSize = size
-    return style
+    key = (name, size, True) if bold else (name, size)
+    return default_styles()[key]
 
 
 def format_str(my_str):
@@ -123,10 +458,14 @@ def format_str(my_str):
     return '\n'.join(split_str_new)
 
 
-def make_first_page(list_of_notes):
-    """make table of content: one column sorted by author and one by title"""
-    body_style = make_style('BodyText', 10)
-    head_style = make_style('BodyText', 12, bold=True)
+def make_first_page(list_of_notes, link='#anchor_', styles=None, orders=None):
+    """make table of content: one column sorted by author and one by title
+
+    orders holds the note ids of each column in order, the notes are sorted here without it"""
+    if styles is None:
+        styles = default_styles()
+    body_style = styles['BodyText', 10]
+    head_style = styles['BodyText', 12, True]
     table_style = TableStyle([('VALIGN', (0, 1), (1, -1), 'TOP'),
                               ('INNERGRID', (0, 0), (1, -1), 0.25, colors.black),
                               ('BOTTOMPADDING', (0, 0), (1, 0), 15),
@@ -136,21 +475,23 @@ def make_first_page(list_of_notes):
     # columns head
     table_head = (Paragraph('title', head_style), Paragraph('author', head_style))
 
-    first_page = [Paragraph('Table of content', make_style('Title', 14, bold=True)),
-                  Paragraph('ordered by', make_style('Title', 10))]
+    first_page = [Paragraph('Table of content', styles['Title', 14, True]),
+                  Paragraph('ordered by', styles['Title', 10])]
 
     # anchors are set in the notes' titles
-    list_anchor = ['<link href="#anchor_' + str(i) + '" color="blue">' for i in range(len(list_of_notes))]
+    notes = {note[id_field]: note for note in list_of_notes}
+
+    if orders is None:
+        orders = {name: sorted(notes, key=lambda note_id: (text_key(notes[note_id][name]), note_id))
+                  for name in ('title', 'author')}
 
-    # sort by title
-    list_title = [note['title'].casefold().capitalize() + '</link>' for note in list_of_notes]
-    sorted_title = sorted(zip(list_anchor, list_title), key=lambda x: x[1])
-    title_column = [Paragraph(''.join(x), body_style) for x in list(sorted_title)]
+    def cell(note_id, name):
+        return Paragraph('<link href="' + link + note_id + '" color="blue">' + text_key(notes[note_id][name])
+                         + '</link>', body_style)
 
-    # sort by author
-    list_author = [note['author'].casefold().capitalize() + '</link>' for note in list_of_notes]
-    sorted_author = sorted(zip(list_anchor, list_author), key=lambda x: x[1])
-    author_column = [Paragraph(''.join(x), body_style) for x in list(sorted_author)]
+    # one column sorted by title, one by author
+    title_column = [cell(note_id, 'title') for note_id in orders['title']]
+    author_column = [cell(note_id, 'author') for note_id in orders['author']]
 
     # merge both list fot the Table class
     data = list(zip(title_column, author_column))
@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import traceback
+
+
+def load_pdf_maker():
+    """reportlab takes a while to import, only the pdf build needs it"""
+    from note_editor import pdf_maker
+    pdf_maker.register_fonts()
+    return pdf_maker
+
+
+class PdfWorker:
+    """build the pdf in a background thread so that the gui never waits for reportlab
+
+    only the latest request is kept: submitting while a build runs queues one more
+    build with the newest notes, older pending requests are dropped"""
+
+    def __init__(self, workers=None, split_by=None):
+        # processes laying out pages, see make_pdf
+        self.workers = workers
+        # category of a split export (see note_editor.split_pdf), None for a single pdf
+        self.split_by = split_by
+        self.lock = threading.Lock()
+        self.thread = None
+        # (path, note_manager, notes, orders, force) waiting for the thread
+        self.pending = None
+        # 'idle', 'building', 'done' or 'failed'
+        self.status = 'idle'
+        self.error = None
+
+    def warm(self):
+        """import reportlab and parse the fonts in the background, ahead of the first build"""
+        threading.Thread(target=load_pdf_maker, name='pdf-warm', daemon=True).start()
+
+    def submit(self, path_to_pdf, note_manager, force=False):
+        """queue a build of the current notes, skipped if the pdf is up to date unless force is set"""
+        # copy the notes and their orders: the gui keeps editing them while the thread reads
+        request = (path_to_pdf, note_manager, list(note_manager.notes.values()),
+                   {name: note_manager.sorted_ids(name) for name in ('title', 'author')}, force)
+        with self.lock:
+            self.pending = request
+            if self.thread is None:
+                # not a daemon: a build handed off on exit still completes
+                self.thread = threading.Thread(target=self.run, name='pdf-worker')
+                self.thread.start()
+
+    def run(self):
+        """build until nothing is pending"""
+        while True:
+            with self.lock:
+                request = self.pending
+                self.pending = None
+                if request is None:
+                    self.thread = None
+                    return
+                self.status = 'building'
+            path_to_pdf, note_manager, notes, orders, force = request
+            try:
+                pdf_maker = load_pdf_maker()
+                if self.split_by:
+                    from note_editor.split_pdf import make_split_pdf
+                    # ~/notes_on_stuff.pdf -> ~/notes_on_stuff/media_type_book.pdf, ...
+                    make_split_pdf(os.path.splitext(path_to_pdf)[0], note_manager, self.split_by,
+                                   notes=notes, workers=self.workers, orders=orders, force=force)
+                else:
+                    pdf_maker.make_pdf(path_to_pdf, note_manager, notes=notes, workers=self.workers, orders=orders,
+                                       force=force)
+            except Exception:
+                # notes are already saved, only the pdf is out of date
+                error = traceback.format_exc()
+                sys.stderr.write(error)
+                with self.lock:
+                    self.status, self.error = 'failed', error
+            else:
+                with self.lock:
+                    self.status, self.error = 'done', None
+
+    def busy(self):
+        """True while a build runs or waits"""
+        with self.lock:
+            return self.thread is not None
+
+    def wait(self):
+        """block until pending builds are done"""
+        while True:
+            with self.lock:
+                thread = self.thread
+            if thread is None:
+                return
+            thread.join()
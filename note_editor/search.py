@@ -0,0 +1,246 @@
+import bisect
+import json
+import math
+import os
+import re
+from array import array
+
+from note_editor.storage import full_note, id_field, note_key
+
+# bump when tokenization, note keys or the file layout change, older index files are rebuilt
+index_version = 3
+# a hit in the title is worth more than one in the notes body
+field_weights = {'title': 3, 'author': 2, 'subtitle': 2, 'one_liner': 2}
+# bm25 parameters
+k1 = 1.2
+b = 0.75
+# prefix queries expand to at most this many tokens
+max_expansion = 200
+
+token_re = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """lower case words of a string"""
+    return token_re.findall(text.casefold())
+
+
+class SearchIndex:
+    """inverted index over every category of the notes, with ranked and prefix search
+
+    Documents are note contents identified by note_key, so that the index saved on
+    disk can be matched against the notes at the next start and only the
+    difference is indexed again. Postings are arrays of (doc id, weighted term frequency)
+    pairs; removed documents are tombstoned and dropped when the index is compacted"""
+
+    def __init__(self, path=None):
+        self.path = path
+        # doc id -> note key, None once removed
+        self.keys = []
+        # note key -> doc id
+        self.ids = {}
+        # doc id -> number of weighted tokens
+        self.lengths = array('I')
+        # token -> array of doc id, term frequency, doc id, term frequency...
+        self.postings = {}
+        # sorted tokens for prefix queries
+        self.vocabulary = []
+        self.removed = 0
+        self.total_length = 0
+        # note key -> note objects of the current session with that content
+        self.notes = {}
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, notes):
+        """load the saved index and catch up with notes
+
+        from any thread as long as nothing else uses the index meanwhile"""
+        self.load()
+        current = {}
+        for note in notes:
+            current.setdefault(note_key(note), []).append(note)
+        for key in [key for key in self.ids if key not in current]:
+            self.remove_doc(key)
+        for key, notes in current.items():
+            if key not in self.ids:
+                self.add_doc(key, notes[0])
+        self.notes = current
+
+    def update(self, old, new):
+        """observer of NoteManager: index the new version, drop the old one"""
+        if old is not None:
+            key = note_key(old)
+            notes = [note for note in self.notes.get(key, []) if note is not old]
+            if notes:
+                self.notes[key] = notes
+            else:
+                self.notes.pop(key, None)
+                self.remove_doc(key)
+        if new is not None:
+            key = note_key(new)
+            if key not in self.ids:
+                self.add_doc(key, new)
+            self.notes.setdefault(key, []).append(new)
+
+    def add_doc(self, key, note):
+        """index the tokens of every category of a note"""
+        frequencies = {}
+        # a lazy note is read without keeping its body
+        for name, value in full_note(note).items():
+            # ids are not words anyone searches for
+            if name == id_field:
+                continue
+            weight = field_weights.get(name, 1)
+            for token in tokenize(str(value)):
+                frequencies[token] = frequencies.get(token, 0) + weight
+        doc_id = len(self.keys)
+        self.keys.append(key)
+        self.ids[key] = doc_id
+        length = sum(frequencies.values())
+        self.lengths.append(length)
+        self.total_length += length
+        for token, frequency in frequencies.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = array('I')
+                bisect.insort(self.vocabulary, token)
+            posting.extend((doc_id, frequency))
+        self.dirty = True
+
+    def remove_doc(self, key):
+        """tombstone a document, compact once half of the documents are gone"""
+        doc_id = self.ids.pop(key)
+        self.keys[doc_id] = None
+        self.total_length -= self.lengths[doc_id]
+        self.removed += 1
+        self.dirty = True
+        if self.removed > 1000 and self.removed > len(self.ids):
+            self.compact()
+
+    def compact(self):
+        """renumber documents and rewrite postings without tombstones"""
+        new_ids = {}
+        keys = []
+        lengths = array('I')
+        for doc_id, key in enumerate(self.keys):
+            if key is not None:
+                new_ids[doc_id] = len(keys)
+                keys.append(key)
+                lengths.append(self.lengths[doc_id])
+        postings = {}
+        for token, posting in self.postings.items():
+            new_posting = array('I')
+            for i in range(0, len(posting), 2):
+                doc_id = new_ids.get(posting[i])
+                if doc_id is not None:
+                    new_posting.extend((doc_id, posting[i + 1]))
+            if new_posting:
+                postings[token] = new_posting
+        self.keys = keys
+        self.ids = {key: doc_id for doc_id, key in enumerate(keys)}
+        self.lengths = lengths
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.removed = 0
+        self.dirty = True
+
+    def expand(self, term, prefix):
+        """tokens matched by a query term"""
+        if not prefix:
+            return [term] if term in self.postings else []
+        start = bisect.bisect_left(self.vocabulary, term)
+        tokens = []
+        for token in self.vocabulary[start:start + max_expansion]:
+            if not token.startswith(term):
+                break
+            tokens.append(token)
+        return tokens
+
+    def term_scores(self, tokens):
+        """bm25 score of each document for one query term (best of its expansions)"""
+        n_docs = max(len(self.ids), 1)
+        average_length = max(self.total_length / n_docs, 1)
+        scores = {}
+        for token in tokens:
+            posting = self.postings[token]
+            # tombstoned documents stay in the postings until the next compaction
+            live = [(posting[i], posting[i + 1]) for i in range(0, len(posting), 2)
+                    if self.keys[posting[i]] is not None]
+            doc_frequency = len(live)
+            idf = math.log(1 + (n_docs - doc_frequency + 0.5) / (doc_frequency + 0.5))
+            for doc_id, frequency in live:
+                norm = k1 * (1 - b + b * self.lengths[doc_id] / average_length)
+                score = idf * frequency * (k1 + 1) / (frequency + norm)
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+        return scores
+
+    def search(self, query, limit=50, prefix_last=True):
+        """notes matching every term of the query, best first
+
+        a term ending with * is a prefix, so is the last one when prefix_last is set
+        (search as you type)"""
+        terms = []
+        words = query.split()
+        for i, word in enumerate(words):
+            prefix = word.endswith('*') or (prefix_last and i == len(words) - 1 and not query[-1:].isspace())
+            for token in tokenize(word):
+                terms.append((token, prefix))
+        if not terms:
+            return []
+        expanded = [self.expand(term, prefix) for term, prefix in terms]
+        if not all(expanded):
+            return []
+        # start from the rarest term to keep the candidate set small
+        expanded.sort(key=lambda tokens: sum(len(self.postings[token]) for token in tokens))
+        total = self.term_scores(expanded[0])
+        for tokens in expanded[1:]:
+            if not total:
+                break
+            scores = self.term_scores(tokens)
+            total = {doc_id: score + scores[doc_id] for doc_id, score in total.items() if doc_id in scores}
+        ranked = sorted(total.items(), key=lambda item: -item[1])[:limit]
+        return [note for doc_id, _ in ranked for note in self.notes.get(self.keys[doc_id], [])]
+
+    def save(self):
+        """write the index next to the notes: a json header followed by the postings"""
+        if not self.path or not self.dirty:
+            return
+        tokens = sorted(self.postings)
+        header = {'version': index_version,
+                  'keys': self.keys,
+                  'tokens': tokens,
+                  'sizes': [len(self.postings[token]) for token in tokens]}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(self.lengths.tobytes())
+            for token in tokens:
+                f.write(self.postings[token].tobytes())
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def load(self):
+        """read the index saved by save, start empty if there is none or it is outdated"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            if header.get('version') != index_version or array('I').itemsize != 4:
+                return
+            data = memoryview(f.read())
+        self.keys = header['keys']
+        self.ids = {key: doc_id for doc_id, key in enumerate(self.keys) if key is not None}
+        self.removed = len(self.keys) - len(self.ids)
+        self.lengths = array('I', data[:4 * len(self.keys)].cast('I'))
+        self.total_length = sum(length for doc_id, length in enumerate(self.lengths) if self.keys[doc_id] is not None)
+        position = 4 * len(self.keys)
+        self.postings = {}
+        for token, size in zip(header['tokens'], header['sizes']):
+            self.postings[token] = array('I', data[position:position + 4 * size].cast('I'))
+            position += 4 * size
+        self.vocabulary = header['tokens']
+        self.dirty = False
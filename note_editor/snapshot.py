@@ -0,0 +1,144 @@
+"""binary copy of notes.csv that loads without parsing csv
+
+layout (integers little endian):
+    header      magic, version, csv size, csv mtime_ns, csv crc32, note count, metadata size
+    metadata    json: field names and where each section starts
+    columns     one block per field: the utf-8 values of every note, each followed by a NUL byte
+    ends        fixed width records, one uint64 per value: end of the value in its column block
+    rows        two uint64 per note: byte range of its row in the csv
+    keys        content hash (note_key) of every note, 12 bytes each
+
+a whole column is read with one decode and one split; a single value is found with its end and
+the one before. The file is memory mapped, untouched columns (note bodies in lazy mode) are never read.
+csv stays the reference: the snapshot is only used while the size and mtime of the csv match its header"""
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+snapshot_version = 1
+magic = b'NOTESNAP'
+header = struct.Struct('<8sIQqIII')
+key_size = 12
+
+
+def little_endian(values):
+    """array stored in file order"""
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def write_snapshot(path, stat, crc, fieldnames, columns, rows, keys):
+    """write the snapshot of a csv file
+
+    stat: os.stat of the csv, crc: its crc32
+    columns: for each field, the values of every note (None is stored as an empty string)
+    rows: start and end of the row of every note in the csv, flat
+    keys: note_key of every note"""
+    count = len(keys)
+    blocks = []
+    ends = array('Q')
+    for values in columns:
+        encoded = [(value or '').encode('utf-8') for value in values]
+        blocks.append(b'\0'.join(encoded) + b'\0' if encoded else b'')
+        ends.extend(itertools.accumulate(len(value) + 1 for value in encoded))
+    sections = {}
+    position = 0
+    for name, block in zip(fieldnames, blocks):
+        sections[name] = position
+        position += len(block)
+    metadata = {'fields': list(fieldnames), 'columns': sections}
+    metadata['ends'] = position
+    position += 8 * len(ends)
+    metadata['rows'] = position
+    position += 8 * len(rows)
+    metadata['keys'] = position
+    metadata = json.dumps(metadata).encode('utf-8')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header.pack(magic, snapshot_version, stat.st_size, stat.st_mtime_ns, crc, count, len(metadata)))
+        f.write(metadata)
+        for block in blocks:
+            f.write(block)
+        f.write(little_endian(ends).tobytes())
+        f.write(little_endian(array('Q', rows)).tobytes())
+        f.write(b''.join(bytes.fromhex(key) for key in keys))
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """read access to a snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (file_magic, version, self.csv_size, self.csv_mtime_ns, self.crc, self.count,
+             metadata_size) = header.unpack_from(self.data)
+            if file_magic != magic or version != snapshot_version:
+                raise ValueError('not a snapshot of this version: ' + path)
+            start = header.size
+            metadata = json.loads(self.data[start:start + metadata_size].decode('utf-8'))
+        except (struct.error, ValueError):
+            self.close()
+            raise
+        # offsets in metadata are relative to the end of the metadata
+        base = start + metadata_size
+        self.fields = metadata['fields']
+        self.columns = {name: base + offset for name, offset in metadata['columns'].items()}
+        self.ends = base + metadata['ends']
+        self.rows_start = base + metadata['rows']
+        self.keys_start = base + metadata['keys']
+
+    def close(self):
+        self.data.close()
+
+    def matches(self, stat):
+        """True if the snapshot was written for the csv as it is now"""
+        return (self.csv_size, self.csv_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+    def end(self, field_number, note_number):
+        """end of a value in its column block, -1 before the first value"""
+        if note_number < 0:
+            return -1
+        return struct.unpack_from('<Q', self.data, self.ends + 8 * (field_number * self.count + note_number))[0] - 1
+
+    def column(self, name):
+        """values of a field for every note"""
+        if not self.count:
+            return []
+        field_number = self.fields.index(name)
+        start = self.columns[name]
+        values = self.data[start:start + self.end(field_number, self.count - 1) + 1].decode('utf-8').split('\0')
+        values.pop()
+        if len(values) != self.count:
+            # a value holds a NUL byte itself
+            values = [self.value(i, name) for i in range(self.count)]
+        return values
+
+    def value(self, note_number, name):
+        """one value of one note"""
+        field_number = self.fields.index(name)
+        start = self.columns[name]
+        return self.data[start + self.end(field_number, note_number - 1) + 1:
+                         start + self.end(field_number, note_number)].decode('utf-8')
+
+    def note(self, note_number):
+        """every value of a note, in field order"""
+        return [self.value(note_number, name) for name in self.fields]
+
+    def rows(self):
+        """start and end of the csv row of every note, flat"""
+        return little_endian(array('Q', self.data[self.rows_start:self.rows_start + 16 * self.count]))
+
+    def row(self, note_number):
+        return struct.unpack_from('<QQ', self.data, self.rows_start + 16 * note_number)
+
+    def keys(self):
+        data = self.data[self.keys_start:self.keys_start + key_size * self.count].hex()
+        return [data[i:i + 2 * key_size] for i in range(0, len(data), 2 * key_size)]
@@ -0,0 +1,196 @@
+"""export one pdf per media type, author or year instead of a single document
+
+    directory/
+        index.pdf               links to every pdf below, with their number of notes
+        manifest.json           partitions and the content hash of their notes
+        media_type_book.pdf     notes of a partition, with their own table of content
+        ...
+
+a partition whose notes did not change since the last export keeps its pdf, the others
+are built concurrently, one process each (see make_pdf for the cache of their pages)"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.platypus import Paragraph, Table, TableStyle
+
+from note_editor import pdf_maker, trace
+from note_editor.indexes import text_key, year_key
+from note_editor.storage import full_note, id_field
+
+split_categories = ('media_type', 'author', 'year')
+manifest_name = 'manifest.json'
+index_name = 'index.pdf'
+
+
+def group_key(category, value):
+    """partition of a value: authors are grouped case insensitively, like the table of content"""
+    value = value.strip()
+    return text_key(value) if category == 'author' else value
+
+
+def partitions(notes, category):
+    """(value, note numbers) of every partition, in the order of the category"""
+    groups = {}
+    for number, note in enumerate(notes):
+        groups.setdefault(group_key(category, note[category]), []).append(number)
+    sort_key = year_key if category == 'year' else text_key
+    return sorted(groups.items(), key=lambda item: sort_key(item[0]))
+
+
+def file_names(category, values):
+    """pdf name of each partition, made of the value with a hash when two values would collide"""
+    names = []
+    used = set()
+    for value in values:
+        name = '{}_{}'.format(category, re.sub(r'[^\w-]+', '_', value).strip('_')[:60] or 'none')
+        if name.casefold() in used:
+            name += '_' + hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]
+        used.add(name.casefold())
+        names.append(name + '.pdf')
+    return names
+
+
+def partition_orders(groups, notes, orders):
+    """orders of the table of content of each partition: the ids of its notes, in the order of orders"""
+    place = {}
+    for group, (_, numbers) in enumerate(groups):
+        for number in numbers:
+            place[notes[number][id_field]] = group
+    result = [{name: [] for name in orders} for _ in groups]
+    for name, order in orders.items():
+        for note_id in order:
+            result[place[note_id]][name].append(note_id)
+    return result
+
+
+def build_partition(path, notes, orders, cache_dir, workers=1):
+    """one pdf of the split export, with its own table of content"""
+    if pdf_maker.pypdf is None:
+        pdf_maker.build_all(path, notes, orders)
+    else:
+        pdf_maker.build_incremental(path, notes, cache_dir, workers, orders)
+
+
+def make_split_pdf(directory, note_manager, category, cache_dir=None, notes=None, workers=None, orders=None,
+                   force=False):
+    """write one pdf per value of category in directory, return the paths of the pdf built
+
+    notes and orders are those of make_pdf, workers the number of partitions built at once,
+    force rebuilds every partition"""
+    if category not in split_categories:
+        raise ValueError('can not split notes by ' + str(category))
+    directory = os.path.expanduser(directory)
+    os.makedirs(directory, exist_ok=True)
+    if notes is None:
+        notes = list(note_manager.notes.values())
+        orders = pdf_maker.table_orders(note_manager)
+    if orders is None:
+        orders = {}
+        for name in ('title', 'author'):
+            ordered = sorted(notes, key=lambda note: (text_key(note[name]), note[id_field]))
+            orders[name] = [note[id_field] for note in ordered]
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(note_manager.path)), 'page_cache')
+    cache_dir = os.path.join(cache_dir, 'split', category)
+    workers = workers or os.cpu_count() or 1
+    manifest_path = os.path.join(directory, manifest_name)
+    try:
+        with open(manifest_path) as f:
+            old = json.load(f)
+    except (OSError, ValueError):
+        old = {}
+    old_files = [entry['file'] for entry in old.get('partitions', [])]
+    old_hashes = {entry['file']: entry['hash'] for entry in old.get('partitions', [])
+                  if old.get('category') == category and not force}
+
+    with trace.span('make_split_pdf', notes=len(notes), category=category):
+        groups = partitions(notes, category)
+        settings = pdf_maker.style_settings()
+        entries = []
+        # partitions to build: (entry, path, notes, orders)
+        missing = []
+        with trace.span('hash notes'):
+            for (value, numbers), name, group_orders in zip(groups, file_names(category, [v for v, _ in groups]),
+                                                            partition_orders(groups, notes, orders)):
+                group_notes = [notes[number] for number in numbers]
+                digest = hashlib.sha1(''.join(pdf_maker.note_hash(note, settings)
+                                              for note in group_notes).encode('ascii')).hexdigest()
+                entry = {'value': value, 'file': name, 'notes': len(numbers), 'hash': digest}
+                path = os.path.join(directory, name)
+                if old_hashes.get(name) != digest or not os.path.exists(path):
+                    missing.append((entry, path, group_notes, group_orders))
+                entries.append(entry)
+        trace.count('cached partitions', len(entries) - len(missing))
+
+        failed = {}
+        if workers > 1 and len(missing) > 1:
+            # spawn and plain dicts, as for the chunks of make_pdf
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(min(workers, len(missing)), mp_context=context) as pool:
+                futures = [(entry, pool.submit(trace.run_traced, trace.enabled(), build_partition, path,
+                                               [dict(full_note(note)) for note in group_notes], group_orders,
+                                               os.path.join(cache_dir, entry['file'][:-4])))
+                           for entry, path, group_notes, group_orders in missing]
+                for entry, future in futures:
+                    try:
+                        _, events = future.result()
+                        trace.add_events(events)
+                    except Exception as error:
+                        failed[entry['file']] = error
+        else:
+            for entry, path, group_notes, group_orders in missing:
+                try:
+                    # a single partition gets the processes to lay out its pages
+                    build_partition(path, group_notes, group_orders,
+                                    os.path.join(cache_dir, entry['file'][:-4]), workers)
+                except Exception as error:
+                    failed[entry['file']] = error
+
+        with trace.span('index'):
+            make_index(os.path.join(directory, index_name), category, entries)
+        # pdf of partitions that no longer exist, only those written by a previous export
+        names = {entry['file'] for entry in entries}
+        for name in old_files:
+            if name not in names:
+                if os.path.exists(os.path.join(directory, name)):
+                    os.remove(os.path.join(directory, name))
+                shutil.rmtree(os.path.join(cache_dir, name[:-4]), ignore_errors=True)
+        # a failed partition is left out of the manifest to be built again next time
+        write_manifest(manifest_path, {'category': category,
+                                       'partitions': [entry for entry in entries if entry['file'] not in failed]})
+    if failed:
+        raise next(iter(failed.values()))
+    return [path for _, path, _, _ in missing]
+
+
+def write_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def make_index(path, category, entries):
+    """small pdf linking to the pdf of every partition"""
+    styles = pdf_maker.StyleRegistry()
+    body_style = styles['BodyText', 10]
+    head_style = styles['BodyText', 12, True]
+    elements = [Paragraph('Notes by ' + category.replace('_', ' '), styles['Title', 14, True])]
+    data = [(Paragraph(category.replace('_', ' '), head_style), Paragraph('notes', head_style))]
+    for entry in entries:
+        # relative links: the index works wherever the directory is copied
+        data.append((Paragraph('<link href="' + entry['file'] + '" color="blue">'
+                               + escape(entry['value'] or 'none') + '</link>', body_style),
+                     Paragraph(str(entry['notes']), body_style)))
+    table = Table(data, colWidths=[pdf_maker.page_size[0] / 2, pdf_maker.page_size[0] / 5])
+    table.setStyle(TableStyle([('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+                               ('BOTTOMPADDING', (0, 0), (-1, 0), 15)]))
+    elements.append(table)
+    pdf_maker.make_doc(path, invariant=True).build(elements)
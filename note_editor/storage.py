@@ -0,0 +1,1164 @@
+import contextlib
+import csv
+import hashlib
+import io
+import itertools
+import json
+import locale
+import os
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+import zlib
+from array import array
+from collections.abc import MutableMapping
+
+from note_editor import trace
+from note_editor.locking import FileLock
+from note_editor.snapshot import Snapshot, write_snapshot
+
+# values shorter than this are interned: authors, years and media types repeat a lot
+intern_length = 64
+# category names of a kind of note -> position of each value, shared by all the notes of that kind
+layouts = {}
+# field of the persistent id of a note, after its categories (see new_note_id)
+id_field = 'note_id'
+id_lock = threading.Lock()
+last_id_time = 0
+
+
+def note_layout(names):
+    """shared name -> position mapping for notes with these categories, in that order"""
+    names = tuple(names)
+    positions = layouts.get(names)
+    if positions is None:
+        positions = layouts[names] = {name: i for i, name in enumerate(names)}
+    return positions
+
+
+def compact_value(value):
+    if type(value) is str and len(value) < intern_length:
+        return sys.intern(value)
+    return value
+
+
+class Note(MutableMapping):
+    """note behaving as a dict of its categories, with a smaller memory footprint
+
+    the names of the categories are shared with every note of the same kind (layout),
+    each note only holds a tuple of its values, short values being interned"""
+    __slots__ = ('positions', 'row')
+
+    def __init__(self, items=()):
+        items = items if isinstance(items, dict) else dict(items)
+        self.positions = note_layout(items)
+        self.row = tuple(map(compact_value, items.values()))
+
+    @classmethod
+    def from_rows(cls, names, rows):
+        """notes of the given categories from tuples of values, without checking them"""
+        positions = note_layout(names)
+        notes = []
+        for row in rows:
+            note = cls.__new__(cls)
+            note.positions = positions
+            note.row = row
+            notes.append(note)
+        return notes
+
+    def __getitem__(self, name):
+        position = self.positions.get(name)
+        if position is None:
+            return self.__missing__(name)
+        return self.row[position]
+
+    def __missing__(self, name):
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        position = self.positions.get(name)
+        value = compact_value(value)
+        if position is None:
+            self.positions = note_layout(tuple(self.positions) + (name,))
+            self.row = self.row + (value,)
+        else:
+            self.row = self.row[:position] + (value,) + self.row[position + 1:]
+
+    def __delitem__(self, name):
+        if name not in self.positions:
+            raise KeyError(name)
+        items = dict(self.items())
+        del items[name]
+        self.positions = note_layout(items)
+        self.row = tuple(items.values())
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.row)
+
+    def copy(self):
+        return Note(self.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class LazyNote(Note):
+    """note holding its light fields, the others are read from the storage on first access
+
+    source is the storage and ref locates the note in it; key is the content hash
+    of the note when the storage can tell it without reading the heavy fields.
+    Accessing a heavy field fills the note for good (a note opened to be edited), see
+    full_note to read it once"""
+    __slots__ = ('source', 'ref', 'key', '__weakref__')
+
+    def __init__(self, items, source, ref, key=None):
+        super().__init__(items)
+        self.source = source
+        self.ref = ref
+        self.key = key
+
+    def load(self):
+        """read the heavy fields, keeping the column order of the storage"""
+        source = self.source
+        if source is not None:
+            note = source.fetch(self)
+            # None when another thread read it first, its ref may already be stale
+            if note is not None:
+                self.fill(note)
+
+    def fill(self, note):
+        """replace the content with the full note, the note is no longer lazy"""
+        Note.__init__(self, note)
+        self.source = None
+
+    def __missing__(self, name):
+        if self.source is None:
+            raise KeyError(name)
+        self.load()
+        return self[name]
+
+    def __contains__(self, name):
+        if self.source is not None and name not in self.positions:
+            self.load()
+        return name in self.positions
+
+    def __setitem__(self, name, value):
+        self.load()
+        self.key = None
+        Note.__setitem__(self, name, value)
+
+    def __delitem__(self, name):
+        self.load()
+        self.key = None
+        Note.__delitem__(self, name)
+
+    def __iter__(self):
+        self.load()
+        return Note.__iter__(self)
+
+    def __len__(self):
+        self.load()
+        return Note.__len__(self)
+
+    def copy(self):
+        self.load()
+        return Note(self.items())
+
+    def __repr__(self):
+        self.load()
+        return Note.__repr__(self)
+
+
+def csv_row(values):
+    """a row as written by csv.DictWriter"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def full_note(note):
+    """the note with every category, a lazy note is read without keeping its heavy fields
+
+    pdf pages and the search index read each body once: filling the notes would keep
+    them all in memory for the rest of the session, only edited notes are filled"""
+    if isinstance(note, LazyNote) and note.source is not None:
+        full = note.source.fetch(note)
+        # None when it was filled meanwhile
+        if full is not None:
+            return full
+    return note
+
+
+def note_key(note):
+    """content hash of a note, stable across sessions
+
+    it is the hash of the csv row of the note, so that lazily loaded notes get it from
+    the bytes of the file without reading their heavy fields"""
+    key = getattr(note, 'key', None)
+    if key is None:
+        key = hashlib.blake2b(csv_row(full_note(note).values()).encode('utf-8'), digest_size=12).hexdigest()
+        if isinstance(note, LazyNote) and note.source is not None:
+            # rows of a storage without keys (sqlite) are never modified in place
+            note.key = key
+    return key
+
+
+def new_note_id():
+    """unique id of a new note, kept for its lifetime
+
+    microseconds since the epoch then random bits: ids sort in creation order and two
+    programs adding notes at once do not collide"""
+    global last_id_time
+    with id_lock:
+        last_id_time = max(time.time_ns() // 1000, last_id_time + 1)
+        now = last_id_time
+    return '{:014x}{}'.format(now, os.urandom(4).hex())
+
+
+def row_note_id(number, note):
+    """id of a note read without one, the same at every read of the file
+
+    its position in the file then a hash of its content, shaped as new_note_id: a file of a
+    version without ids opened read only gives the same ids each time (export manifest, page
+    cache), and they are the ones written by its first write"""
+    return '{:014x}{}'.format(number, note_key(note)[:8])
+
+
+def with_id(note, note_id):
+    """copy of a note with another id, the id stays the last field"""
+    items = dict(note)
+    items[id_field] = note_id
+    return Note(items)
+
+
+def by_id(notes):
+    """notes keyed by id, in order, and whether some were given a new id
+
+    notes without an id (a file written before ids, a row added by hand) or with the id
+    of a previous note get one from their position, see row_note_id"""
+    result = {}
+    repaired = False
+    for number, note in enumerate(notes):
+        note_id = note.get(id_field)
+        if not note_id or note_id in result:
+            note_id = row_note_id(number, note)
+            note = with_id(note, note_id)
+            repaired = True
+        result[note_id] = note
+    return result, repaired
+
+
+def file_state(path):
+    """inode, size and modification time of a file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def notes_digest(notes):
+    """content hash of a list of notes, in order"""
+    digest = hashlib.sha1()
+    for note in notes:
+        digest.update(note_key(note).encode('ascii'))
+    return digest.hexdigest()
+
+
+class CsvStorage:
+    """notes stored in a csv file
+
+    In journal mode (default), edits are appended to a small log next to the csv
+    and only compacted into a fresh csv past journal_limit bytes or on exit
+
+    Notes are handed out and taken as a dict of notes by id (see new_note_id), in the order
+    of the file. A file written before ids is given some on load and written again, unless
+    read_only is set: then the ids are only written by the first write of the notes
+
+    A binary snapshot of the csv (see note_editor.snapshot) is written next to it and
+    read instead of the csv as long as the csv did not change. Heavy fields are not kept
+    in memory: notes are loaded as LazyNote with their number in the snapshot, and
+    those fields are read from it when first needed
+
+    Several programs may edit the same file: reads and writes hold an advisory lock
+    (notes.lock), and each write first checks that the files are as this storage left
+    them. If another program wrote them meanwhile, the edits are merged (see merge)
+    and stale is set until the notes are read again (NoteManager.sync)"""
+
+    def __init__(self, path, fieldnames, journal=True, heavy=(), snapshot=True, read_only=False):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.read_only = read_only
+        # True while the notes read have ids that are not in the file, the next write rewrites it
+        self.unsaved_ids = False
+        # True when a read only load left a stale journal or a record cut by a crash in place,
+        # the next write rewrites the csv instead of appending to it
+        self.journal_damaged = False
+        self.heavy = heavy
+        # lazy notes are read from the snapshot, it can only be turned off without them
+        self.use_snapshot = snapshot or bool(heavy)
+        # same encoding as open() in text mode
+        self.encoding = locale.getpreferredencoding(False)
+        # header of the current snapshot, None if the file does not exist
+        self.header = None
+        # weak references to every LazyNote handed out, they are moved to the new file on compaction
+        self.lazy_notes = []
+        # fetching from a background thread must not see the file being replaced
+        self.lock = threading.Lock()
+        base, ext = os.path.splitext(self.path)
+        self.journal_path = base + '_journal.jsonl'
+        self.snapshot_path = base + '_snapshot.bin'
+        # a read only load does not create the lock file, see writing
+        self.file_lock = FileLock(base + '.lock', create=not read_only)
+        # state of the csv and the journal after the last read or write of this storage
+        self.seen = None
+        # notes by id as they were on disk after that read or write, the base of a merge
+        self.base = {}
+        # True once edits of another program were merged in, until the notes are read again
+        self.stale = False
+        # notes edited on both sides in the last merge, both versions are kept
+        self.conflicts = 0
+        # note id -> id of the copy written by a merge when both sides updated the note,
+        # later edits of the note go to the copy until the notes are read again
+        self.copies = {}
+        # open Snapshot of the current csv
+        self.snapshot = None
+        self.journal = journal
+        # compact once the journal grows past 1 MiB
+        self.journal_limit = 1 << 20
+        # History recording each version written, set by NoteManager
+        self.history = None
+        # checksum of the csv, the journal is only valid on top of that exact snapshot
+        self.snapshot_crc = None
+
+    def load(self):
+        """load current version of the csv then replay the journal"""
+        with self.file_lock:
+            notes = self.read()
+            self.seen = self.state()
+            self.base = dict(notes)
+            self.stale = False
+        return notes
+
+    def read(self):
+        notes = []
+        header = list(self.fieldnames)
+        if os.path.exists(self.path):
+            notes = self.load_snapshot() if self.use_snapshot else None
+            header = self.header
+            if notes is None:
+                with open(self.path, 'rb') as p:
+                    data = p.read()
+                self.snapshot_crc = zlib.crc32(data)
+                # a read only load parses the csv, as in a read only directory
+                if self.use_snapshot and not self.read_only:
+                    self.scan(data)
+                    notes = self.load_snapshot()
+                    header = self.header
+            if notes is None:
+                reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(data)), skipinitialspace=True)
+                notes = [Note(row) for row in reader]
+                header = reader.fieldnames or []
+        records = self.journal_records()
+        legacy = id_field not in header
+        if legacy:
+            # journal of a version without ids, its records hold positions
+            for record in records:
+                apply_numbered_record(notes, record)
+        notes, repaired = by_id(notes)
+        if not legacy:
+            for record in records:
+                apply_record(notes, record)
+        self.unsaved_ids = legacy or repaired
+        if self.unsaved_ids and not self.read_only:
+            # new ids are written at once, the journal and other programs refer to them
+            try:
+                self.write_csv(notes)
+            except OSError:
+                # read only directory: new ids at every start, nothing refers to them
+                return notes
+            return self.read()
+        return notes
+
+    def set_snapshot(self, snapshot):
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = snapshot
+
+    def scan(self, data):
+        """parse the csv and write its snapshot, with the byte range of every row"""
+        reader = csv.reader(io.StringIO(data.decode(self.encoding)), skipinitialspace=True)
+        header = next(reader, None) or []
+        rows = []
+        ranges = array('Q')
+        keys = []
+        # byte offset of the start of each physical line, computed without a python loop
+        offsets = [0]
+        offsets.extend(itertools.accumulate(map((1).__add__, map(len, data.split(b'\n')))))
+        start = offsets[reader.line_num]
+        for row in reader:
+            end = min(offsets[reader.line_num], len(data))
+            # rows are empty lines, as skipped by csv.DictReader
+            if row:
+                rows.append(row)
+                ranges.extend((start, end))
+                keys.append(hashlib.blake2b(data[start:end], digest_size=12).hexdigest())
+            start = end
+        columns = [[row[i] if i < len(row) else None for row in rows] for i in range(len(header))]
+
+        def replace():
+            self.set_snapshot(None)
+            try:
+                write_snapshot(self.snapshot_path, os.stat(self.path), self.snapshot_crc, header, columns, ranges,
+                               keys)
+            except OSError:
+                # read only directory: the csv is parsed at every start
+                pass
+        self.move_lazy_notes(keys, replace)
+
+    def move_lazy_notes(self, keys, replace):
+        """switch to the snapshot of another csv (written by another program, see reload)
+
+        keys are those of the rows of the new snapshot and replace() switches to it: the lazy
+        notes of the current one are pointed to the row with the same content, or read first
+        if there is none. Nothing to do at startup, no lazy note was handed out yet"""
+        lazy_notes = self.live_lazy_notes()
+        numbers = {}
+        for number, key in enumerate(keys if lazy_notes else ()):
+            numbers.setdefault(key, number)
+        with self.lock:
+            for note in lazy_notes:
+                if note.key not in numbers:
+                    note.fill(self.read_note(note.ref))
+            replace()
+            for note in lazy_notes:
+                if note.source is self:
+                    note.ref = numbers[note.key]
+
+    def load_snapshot(self):
+        """notes from the snapshot, None if there is none or it does not describe the current csv"""
+        try:
+            snapshot = Snapshot(self.snapshot_path)
+        except (OSError, ValueError):
+            return None
+        if not snapshot.matches(os.stat(self.path)):
+            snapshot.close()
+            return None
+        if self.snapshot is not None and self.snapshot.crc != snapshot.crc:
+            # another program rewrote the csv and its snapshot
+            self.move_lazy_notes(snapshot.keys(), lambda: self.set_snapshot(snapshot))
+        else:
+            with self.lock:
+                self.set_snapshot(snapshot)
+        self.header = snapshot.fields
+        self.snapshot_crc = snapshot.crc
+        light = [name for name in snapshot.fields if name not in self.heavy]
+        columns = []
+        for name in light:
+            # equal values share one string, as interned by Note
+            values = snapshot.column(name)
+            unique = {}
+            columns.append(list(map(unique.setdefault, values, values)))
+        if not self.heavy:
+            return Note.from_rows(light, zip(*columns))
+        notes = LazyNote.from_rows(light, zip(*columns))
+        for number, (note, key) in enumerate(zip(notes, snapshot.keys())):
+            note.source = self
+            note.ref = number
+            note.key = key
+        self.lazy_notes = list(map(weakref.ref, notes))
+        return notes
+
+    def live_lazy_notes(self):
+        """lazy notes still in use that are read from this storage"""
+        notes = [ref() for ref in self.lazy_notes]
+        notes = [note for note in notes if note is not None and note.source is self]
+        self.lazy_notes = list(map(weakref.ref, notes))
+        return notes
+
+    def reload(self, notes):
+        """read the csv and the journal again after another program changed them
+
+        see keep_unchanged, return the notes, the removed ones and the added ones"""
+        with self.file_lock:
+            notes, removed, added = keep_unchanged(notes, self.load_again())
+            self.base = dict(notes)
+            self.copies = {}
+        return notes, removed, added
+
+    def load_again(self):
+        """notes on disk, the lazy notes handed out before are still followed"""
+        previous = self.live_lazy_notes()
+        notes = self.load()
+        # notes no longer in the list may still be held by a pdf build, they are moved on compaction too
+        lazy_notes = {id(note): note for note in itertools.chain(previous, notes.values())
+                      if isinstance(note, LazyNote) and note.source is self}
+        self.lazy_notes = list(map(weakref.ref, lazy_notes.values()))
+        return notes
+
+    def files(self):
+        """paths whose changes mean that the notes changed"""
+        return [self.path, self.journal_path]
+
+    def state(self):
+        return [file_state(self.path), file_state(self.journal_path)]
+
+    def changed(self):
+        """True if another program wrote the notes since this storage read them
+
+        polled from the gui thread, which never waits for a write: while the lock is held
+        (the background writer, a compaction, another program) the answer is False and the
+        next call tells"""
+        if not self.file_lock.try_enter():
+            return False
+        try:
+            return self.stale or self.state() != self.seen
+        finally:
+            self.file_lock.__exit__()
+
+    def merge(self, notes):
+        """notes on disk, with the edits made to notes since base applied on top
+
+        a note removed or updated since base is removed or updated on disk, in place, unless
+        another program already removed or updated it: then its version is kept, and the one
+        of notes too under a new id when both sides updated it (see conflicts and copies).
+        Notes not in base are appended"""
+        base = self.base
+        merged = self.load_again()
+        edits = 0
+        conflicts = 0
+        for note_id, old in base.items():
+            note = notes.get(note_id)
+            if note is old:
+                continue
+            edits += 1
+            disk_id = self.copies.get(note_id, note_id)
+            if disk_id != note_id:
+                # the content hash covers the id
+                old = with_id(old, disk_id)
+                note = note and with_id(note, disk_id)
+            on_disk = merged.get(disk_id)
+            if on_disk is not None and note_key(on_disk) == note_key(old):
+                if note is None:
+                    del merged[disk_id]
+                else:
+                    merged[disk_id] = note
+            elif note is not None and (on_disk is None or note_key(on_disk) != note_key(note)):
+                conflicts += 1
+                if on_disk is None:
+                    merged[disk_id] = note
+                else:
+                    new_id = new_note_id()
+                    merged[new_id] = with_id(note, new_id)
+                    self.copies[note_id] = new_id
+            elif note is None and on_disk is not None:
+                conflicts += 1
+        for note_id, note in notes.items():
+            if note_id not in base:
+                edits += 1
+                merged[note_id] = note
+        trace.count('merged edits', edits)
+        self.conflicts = conflicts
+        # notes lacks the edits of the other program until it is read again, and base stays
+        # the one of its edits until they are written
+        self.base = base
+        self.stale = True
+        return merged
+
+    def read_note(self, number):
+        """full note from the snapshot, the caller holds the lock"""
+        return Note(zip(self.header, self.snapshot.note(number)))
+
+    def fetch(self, note):
+        """read the heavy fields of a lazy note, None if it is no longer lazy"""
+        with self.lock:
+            # filled by the writer thread (write_csv, move_lazy_notes) while waiting for the lock
+            if note.source is not self:
+                return None
+            return self.read_note(note.ref)
+
+    def journal_records(self):
+        """edits of the journal written on top of the current snapshot"""
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path, 'rb') as j:
+            lines = j.readlines()
+        records = []
+        valid_size = 0
+        for line in lines:
+            try:
+                # a record cut by a crash mid-write has no newline or no valid json
+                if not line.endswith(b'\n'):
+                    raise ValueError
+                records.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                break
+            valid_size += len(line)
+        stale = not records or records[0].get('snapshot') != self.snapshot_crc
+        partial = valid_size != sum(len(line) for line in lines)
+        if self.read_only and (stale or partial):
+            # left as it is until the next write
+            self.journal_damaged = True
+            return [] if stale else records[1:]
+        if stale:
+            # journal was written against a previous snapshot: it was already compacted
+            os.remove(self.journal_path)
+            return []
+        # drop a partial trailing record so that the next append starts on a clean line
+        if partial:
+            with open(self.journal_path, 'r+b') as j:
+                j.truncate(valid_size)
+        return records[1:]
+
+    def write(self, notes, records):
+        """persist edits (see apply_record): append them to the journal at once or rewrite the whole file
+
+        notes are those by id with every record applied"""
+        with self.writing():
+            # after a write of another program, the records are merged by dump, records of
+            # ids that are not in the file yet can not be replayed either
+            if (not self.journal or self.stale or self.unsaved_ids or self.journal_damaged
+                    or self.state() != self.seen):
+                self.dump(notes)
+                return
+            lines = [json.dumps(record).encode('utf-8') + b'\n' for record in records]
+            if not os.path.exists(self.journal_path):
+                lines.insert(0, json.dumps({'snapshot': self.snapshot_crc}).encode('utf-8') + b'\n')
+            with open(self.journal_path, 'ab') as j:
+                j.write(b''.join(lines))
+                j.flush()
+                os.fsync(j.fileno())
+            self.seen = self.state()
+            self.follow(notes, records)
+            if self.history is not None:
+                self.history.record(notes, {record['id']: notes.get(record['id']) for record in records})
+            if self.seen[1][1] > self.journal_limit:
+                self.dump(notes)
+
+    def writing(self):
+        """the file lock, taken to write: it is created even if the notes were loaded read only"""
+        self.file_lock.create = True
+        return self.file_lock
+
+    def follow(self, notes, records):
+        """apply records to base as to notes, cheaper than a copy of notes at each write"""
+        for note_id in {record['id'] for record in records}:
+            # a later record may have removed a note added or updated by an earlier one
+            if note_id in notes:
+                self.base[note_id] = notes[note_id]
+            else:
+                self.base.pop(note_id, None)
+
+    def dump(self, notes):
+        """write current version of the notes to file, the previous ones are kept by the history"""
+        with self.writing():
+            if self.stale or self.state() != self.seen:
+                with trace.span('merge', notes=len(notes)):
+                    notes_written = self.merge(notes)
+            else:
+                notes_written = notes
+            keys = self.write_csv(notes_written)
+            self.unsaved_ids = False
+            self.journal_damaged = False
+            self.seen = self.state()
+            self.base = dict(notes)
+            if self.history is not None:
+                self.history.record(notes_written, keys=keys)
+
+    def write_csv(self, notes):
+        """write notes by id to the csv and its snapshot, the caller holds the file lock
+
+        return the content hash of each note, in order"""
+        # write to a temporary file first so that the csv is never missing or truncated
+        tmp_path = self.path + '.tmp'
+        old = b''
+        lazy_notes = self.live_lazy_notes()
+        if lazy_notes and os.path.exists(self.path):
+            with open(self.path, 'rb') as p:
+                old = p.read()
+        # rows of lazy notes are copied from the current file when the columns did not move
+        same_header = self.header == list(self.fieldnames)
+        refs = {}
+        # content of the new snapshot
+        columns = [[] for _ in self.fieldnames]
+        ranges = array('Q')
+        keys = []
+        crc = 0
+        with open(tmp_path, 'wb') as output_file:
+            for row in self.rows(notes, old, same_header, refs, columns, ranges, keys):
+                output_file.write(row)
+                crc = zlib.crc32(row, crc)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        with self.lock:
+            # lazy notes that are not in the new file (removed, or held by a pdf build) are read now
+            for note in lazy_notes:
+                if id(note) not in refs:
+                    note.fill(self.read_note(note.ref))
+            # the mapping of the old snapshot is closed before its file is replaced
+            self.set_snapshot(None)
+            os.replace(tmp_path, self.path)
+            self.header = list(self.fieldnames)
+            self.snapshot_crc = crc
+            if self.use_snapshot:
+                write_snapshot(self.snapshot_path, os.stat(self.path), crc, self.fieldnames, columns, ranges, keys)
+                self.set_snapshot(Snapshot(self.snapshot_path))
+            for note in lazy_notes:
+                if note.source is self:
+                    note.ref = refs[id(note)]
+        # the journal is now part of the snapshot (and stale if a crash keeps it around)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        return keys
+
+    def rows(self, notes, old, same_header, refs, columns, ranges, keys):
+        """encoded header and rows of the csv
+
+        records the new number of lazy notes in refs, and the values, byte range and key
+        of every row in columns, ranges and keys for the snapshot"""
+        row = csv_row(self.fieldnames).encode(self.encoding)
+        position = len(row)
+        yield row
+        # heavy values of the lazy notes, read at once from the current snapshot
+        heavy_columns = None
+        for note in notes.values():
+            if same_header and isinstance(note, LazyNote) and note.source is self:
+                if heavy_columns is None:
+                    heavy_columns = {name: self.snapshot.column(name) for name in self.heavy}
+                start, end = self.snapshot.row(note.ref)
+                row = old[start:end]
+                values = [heavy_columns[name][note.ref] if name in heavy_columns else note[name]
+                          for name in self.fieldnames]
+                refs[id(note)] = len(keys)
+                key = note.key
+            else:
+                values = [note.get(name) for name in self.fieldnames]
+                row = csv_row(values).encode(self.encoding)
+                key = hashlib.blake2b(row, digest_size=12).hexdigest()
+            if self.use_snapshot:
+                for column, value in zip(columns, values):
+                    column.append(value)
+                ranges.extend((position, position + len(row)))
+            keys.append(key)
+            position += len(row)
+            yield row
+
+    def close(self, notes):
+        """merge pending journal records into the csv"""
+        if os.path.exists(self.journal_path):
+            self.dump(notes)
+
+
+class SqliteStorage:
+    """notes stored in a local sqlite file, one row per note
+
+    Rows are ordered by their position column then by their autoincrement id, which matches
+    the order of the notes; self.rowids maps note ids to row ids. An updated note gets a new
+    row, with the position of the one it replaces
+
+    Edits of other programs are merged by sqlite itself: rows are added or deleted by id,
+    never modified in place. A commit of another connection sets stale until the notes
+    are read again (NoteManager.sync)"""
+
+    # categories used for sorting and selection
+    indexed = ('title', 'author', 'year', 'media_type')
+
+    def __init__(self, path, fieldnames, csv_path=None, heavy=()):
+        self.path = path
+        self.fieldnames = fieldnames
+        # columns read on demand through LazyNote
+        self.heavy = heavy
+        # notes.csv to migrate from when the database does not exist yet
+        self.csv_path = csv_path
+        self.rowids = {}
+        # position of the last row, new notes come after it
+        self.last_position = 0
+        # PRAGMA data_version after the last read, it changes with commits of other connections
+        self.seen = None
+        self.stale = False
+        # History recording each version written, set by NoteManager
+        self.history = None
+        # row id -> LazyNote handed out by load
+        self.lazy_notes = weakref.WeakValueDictionary()
+        # note id -> id of the copy written when both programs updated the note, as CsvStorage.copies
+        self.copies = {}
+        migrate = not os.path.exists(self.path)
+        # lazy notes may be read from the pdf build thread, under self.lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+        if migrate and self.csv_path and os.path.exists(self.csv_path):
+            self.dump(by_id(read_csv(self.csv_path))[0])
+
+    def create_tables(self):
+        columns = ', '.join('"{}" TEXT NOT NULL DEFAULT \'\''.format(name) for name in self.fieldnames)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS notes '
+                                    '(id INTEGER PRIMARY KEY AUTOINCREMENT, position INTEGER, ' + columns + ')')
+            # a database of a previous version lacks the ids and the positions
+            existing = {row[1] for row in self.connection.execute('PRAGMA table_info(notes)')}
+            for name in self.fieldnames:
+                if name not in existing:
+                    self.connection.execute('ALTER TABLE notes ADD COLUMN "{}" TEXT NOT NULL DEFAULT \'\''.format(name))
+            if 'position' not in existing:
+                self.connection.execute('ALTER TABLE notes ADD COLUMN position INTEGER')
+                self.connection.execute('UPDATE notes SET position = id')
+            for name in self.indexed:
+                if name in self.fieldnames:
+                    self.connection.execute('CREATE INDEX IF NOT EXISTS "notes_{0}" '
+                                            'ON notes ("{0}" COLLATE NOCASE)'.format(name))
+            self.connection.execute('CREATE INDEX IF NOT EXISTS notes_position ON notes (position, id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS "notes_{0}" ON notes ("{0}")'.format(id_field))
+            rows = self.connection.execute('SELECT id FROM notes WHERE "{}" = \'\' ORDER BY position, id'
+                                           .format(id_field)).fetchall()
+            self.connection.executemany('UPDATE notes SET "{}" = ? WHERE id = ?'.format(id_field),
+                                        ((new_note_id(), row[0]) for row in rows))
+
+    def load(self):
+        """read all notes by id in order, without the heavy columns when lazy"""
+        notes, repaired, conflicts = self.read_rows()
+        if repaired:
+            # every commit holds the history lock: read again under it, another program
+            # may be giving the same rows a new id
+            with self.history_lock():
+                notes, repaired, conflicts = self.read_rows()
+                if repaired:
+                    with self.lock, self.connection:
+                        self.connection.executemany('UPDATE notes SET "{}" = ? WHERE id = ?'.format(id_field),
+                                                    repaired)
+                        self.seen = self.data_version()
+                    if self.history is not None:
+                        conflicts.update(note_id for note_id, _ in repaired)
+                        self.history.record(notes, {note_id: notes[note_id] for note_id in conflicts})
+        return notes
+
+    def read_rows(self):
+        """notes of load, with the (new id, row id) of the rows to repair and the ids they were copies of"""
+        light = [name for name in self.fieldnames if name not in self.heavy]
+        columns = ', '.join('"{}"'.format(name) for name in light)
+        notes = {}
+        self.rowids = {}
+        with self.lock:
+            rows = self.connection.execute('SELECT id, position, ' + columns
+                                           + ' FROM notes ORDER BY position, id').fetchall()
+            self.seen = self.data_version()
+            self.stale = False
+        self.last_position = max((row[1] for row in rows), default=0)
+        # rows of a note updated by two programs at once, both versions are kept
+        repaired = []
+        conflicts = set()
+        for row in rows:
+            if self.heavy:
+                note = LazyNote(zip(light, row[2:]), self, row[0])
+                self.lazy_notes[row[0]] = note
+            else:
+                note = Note(zip(self.fieldnames, row[2:]))
+            note_id = note[id_field]
+            if note_id in notes:
+                conflicts.add(note_id)
+                note_id = new_note_id()
+                note = with_id(note, note_id)
+                repaired.append((note_id, row[0]))
+            notes[note_id] = note
+            self.rowids[note_id] = row[0]
+        return notes, repaired, conflicts
+
+    def history_lock(self):
+        """held from a commit to its version in the history, which then follows the order of the commits"""
+        return self.history.file_lock if self.history is not None else contextlib.nullcontext()
+
+    def reload(self, notes):
+        """read the rows again after another program changed them, see keep_unchanged
+
+        rows are never modified in place: notes are compared by row id, none is read"""
+        old_rowids = self.rowids
+        notes, removed, added = keep_unchanged(notes, self.load(), old_rowids, self.rowids)
+        self.copies = {}
+        for note in notes.values():
+            if isinstance(note, LazyNote) and note.source is self:
+                self.lazy_notes[note.ref] = note
+        return notes, removed, added
+
+    def files(self):
+        """paths whose changes mean that the notes changed"""
+        return [self.path, self.path + '-wal']
+
+    def data_version(self):
+        """changes with every commit of another connection, the caller holds the lock"""
+        return self.connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def changed(self):
+        """True if another program wrote the notes since this storage read them
+
+        False while a write holds the lock, as CsvStorage.changed"""
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            self.changed_by_others()
+            return self.stale
+        finally:
+            self.lock.release()
+
+    def fetch(self, note):
+        """read the full row of a lazy note, rows are never modified in place"""
+        columns = ', '.join('"{}"'.format(name) for name in self.fieldnames)
+        with self.lock:
+            row = self.connection.execute('SELECT ' + columns + ' FROM notes WHERE id = ?', (note.ref,)).fetchone()
+        if row is None:
+            self.stale = True
+            raise ValueError('note deleted by another program, the notes are read again')
+        return Note(zip(self.fieldnames, row))
+
+    def insert(self, note, position=None):
+        """insert one note, after the others unless given a position, and return its row id, the caller commits"""
+        if position is None:
+            self.last_position += 1
+            position = self.last_position
+        columns = ', '.join('"{}"'.format(name) for name in self.fieldnames)
+        # None from a short csv row, the columns are NOT NULL
+        values = [note.get(name) or '' for name in self.fieldnames]
+        cursor = self.connection.execute('INSERT INTO notes (position, ' + columns + ') VALUES (?, '
+                                         + ', '.join('?' * len(values)) + ')', [position] + values)
+        return cursor.lastrowid
+
+    def dump(self, notes):
+        """replace the rows of the notes by id with the given notes in a single transaction
+
+        rows added by another program since the notes were read are kept"""
+        # rows are read before they are deleted, lazy notes then move to their new row
+        rows = {note_id: full_note(note) for note_id, note in notes.items()}
+        # lazy notes out of notes (removed, held by a pdf build) lose their row
+        kept = {id(note) for note in notes.values()}
+        for note in list(self.lazy_notes.values()):
+            if id(note) not in kept:
+                note.load()
+        with self.history_lock():
+            removed = [note_id for note_id in self.rowids if note_id not in notes]
+            copies = self.dump_rows(notes, rows)
+            with self.lock:
+                removed = [note_id for note_id in removed if note_id not in self.remaining(removed)]
+            if self.history is not None:
+                # the rows of other programs stay as they are
+                changes = dict(rows)
+                changes.update(dict.fromkeys(removed + copies))
+                self.history.record(rows, changes)
+
+    def dump_rows(self, notes, rows):
+        """rows of dump, the caller holds the history lock, return the ids of the copies deleted (see renamed)"""
+        with self.lock, self.connection:
+            self.changed_by_others()
+            copies = self.renamed(self.rowids)
+            self.connection.executemany('DELETE FROM notes WHERE id = ?', ((rowid,) for rowid in self.rowids.values()))
+            # and those another program wrote for the same notes, one row per id
+            self.connection.executemany('DELETE FROM notes WHERE "{}" = ?'.format(id_field),
+                                        ((note_id,) for note_id in rows))
+            self.last_position = 0
+            self.rowids = {note_id: self.insert(row) for note_id, row in rows.items()}
+            self.last_position = self.connection.execute('SELECT MAX(position) FROM notes').fetchone()[0] or 0
+            for note_id, note in notes.items():
+                if isinstance(note, LazyNote) and note.source is self:
+                    note.ref = self.rowids[note_id]
+                    self.lazy_notes[note.ref] = note
+        return copies
+
+    def renamed(self, rowids):
+        """ids of the rows of rowids (note id -> row id) that another program gave a new id
+
+        those are copies of a note updated by two programs at once (see load), they are deleted
+        with the note. The caller holds the lock"""
+        if not self.stale:
+            return []
+        query = 'SELECT "{}" FROM notes WHERE id = ?'.format(id_field)
+        rows = ((note_id, self.connection.execute(query, (rowid,)).fetchone()) for note_id, rowid in rowids.items())
+        return [row[0] for note_id, row in rows if row is not None and row[0] != note_id]
+
+    def remaining(self, note_ids):
+        """ids that still have a row, a note removed here stays once another program updated it
+
+        the caller holds the lock"""
+        if not self.stale:
+            return set()
+        query = 'SELECT 1 FROM notes WHERE "{}" = ?'.format(id_field)
+        return {note_id for note_id in note_ids if self.connection.execute(query, (note_id,)).fetchone()}
+
+    def changed_by_others(self):
+        """check for commits of another connection before writing, the caller holds the lock"""
+        if self.data_version() != self.seen:
+            self.stale = True
+
+    def release(self, note_id):
+        """read a lazy note (maybe held by a pdf build) before its row is deleted"""
+        note = self.lazy_notes.get(self.rowids[note_id])
+        if note is not None:
+            note.load()
+
+    def write(self, notes, records):
+        """apply edits (see apply_record) in a single transaction"""
+        with self.history_lock():
+            changes = self.write_rows(records)
+            if self.history is not None:
+                self.history.record(notes, changes)
+
+    def write_rows(self, records):
+        """rows of write, the caller holds the history lock, return the notes written by id (None when removed)
+
+        the transaction takes the write lock before reading: the rows of each note are read
+        again by id and the edit is merged as CsvStorage.merge does, no other program writes
+        in between"""
+        for record in records:
+            if record['op'] != 'add' and record['id'] in self.rowids:
+                self.release(record['id'])
+        try:
+            with self.lock:
+                self.connection.execute('BEGIN IMMEDIATE')
+                self.changed_by_others()
+                changes = {}
+                for record in records:
+                    self.write_row(record, changes)
+                self.connection.commit()
+            return changes
+        except Exception:
+            with self.lock:
+                self.connection.rollback()
+                self.rowids = dict(self.connection.execute('SELECT "{}", id FROM notes ORDER BY position, id'
+                                                           .format(id_field)))
+            raise
+
+    def write_row(self, record, changes):
+        """apply one record of write_rows and add the notes written to changes, the caller holds the lock
+
+        an updated note keeps its place. A note updated or removed by another program since it
+        was read keeps that version, and the one of the record too under a new id when both
+        updated it (see copies). A row that another program made a copy of the note (see load)
+        goes with the note"""
+        note_id = record['id']
+        note = record.get('note') if record['op'] != 'remove' else None
+        if record['op'] == 'add':
+            self.rowids[note_id] = self.insert(note)
+            changes[note_id] = note
+            return
+        disk_id = self.copies.get(note_id, note_id)
+        if note is not None and disk_id != note_id:
+            note = with_id(note, disk_id)
+        rowid = self.rowids.pop(note_id, None)
+        row = self.connection.execute('SELECT position, "{}" FROM notes WHERE id = ?'.format(id_field),
+                                      (rowid,)).fetchone()
+        if row is not None:
+            self.connection.execute('DELETE FROM notes WHERE id = ?', (rowid,))
+            if row[1] == disk_id:
+                # as it was read
+                if note is not None:
+                    self.rowids[note_id] = self.insert(note, row[0])
+                changes[disk_id] = note
+                return
+            changes[row[1]] = None
+        self.stale = True
+        columns = ', '.join('"{}"'.format(name) for name in self.fieldnames)
+        on_disk = self.connection.execute('SELECT id, position, ' + columns + ' FROM notes WHERE "{}" = ? '
+                                          'ORDER BY position, id'.format(id_field), (disk_id,)).fetchone()
+        if note is None:
+            # removed here, the version of the other program stays
+            return
+        if on_disk is None:
+            self.rowids[note_id] = self.insert(note)
+            changes[disk_id] = note
+        elif list(on_disk[2:]) == [note.get(name) or '' for name in self.fieldnames]:
+            self.rowids[note_id] = on_disk[0]
+        else:
+            new_id = new_note_id()
+            self.copies[note_id] = new_id
+            note = with_id(note, new_id)
+            self.rowids[note_id] = self.insert(note, on_disk[1])
+            changes[new_id] = note
+
+    def close(self, notes):
+        """every edit is already committed, the connection stays open for lazy notes"""
+        with self.lock:
+            self.connection.commit()
+
+    def sorted_ids(self, name):
+        """note ids sorted by a category, using the index, ties in id order as SortedIndex"""
+        query = 'SELECT "{}" FROM notes ORDER BY "{}" COLLATE NOCASE, "{}"'.format(id_field, name, id_field)
+        return [row[0] for row in self.connection.execute(query)]
+
+    def find(self, name, value):
+        """ids of the notes whose category equals value (case insensitive), in order"""
+        query = 'SELECT "{}" FROM notes WHERE "{}" = ? COLLATE NOCASE ORDER BY position, id'.format(id_field, name)
+        return [row[0] for row in self.connection.execute(query, (value,))]
+
+
+def keep_unchanged(old, fresh, old_keys=None, fresh_keys=None):
+    """fresh notes read again from the storage, where those with the same id and content as an
+    old note are that old note: it keeps its place in the indexes and its cached pages
+
+    notes are compared by note_key unless the storage gives other keys of both, by id.
+    An old lazy note takes the place in the storage of the fresh one it replaces, the notes
+    are returned with the old notes that are gone and the fresh ones that are new (or modified)"""
+    notes = {}
+    added = []
+    for note_id, note in fresh.items():
+        kept = old.get(note_id)
+        if kept is None or (note_key(kept) != note_key(note) if old_keys is None
+                            else old_keys.get(note_id) != fresh_keys[note_id]):
+            notes[note_id] = note
+            added.append(note)
+            continue
+        if isinstance(kept, LazyNote) and kept.source is not None:
+            if isinstance(note, LazyNote) and note.source is not None:
+                kept.source, kept.ref = note.source, note.ref
+            else:
+                kept.fill(note)
+        notes[note_id] = kept
+    removed = [note for note_id, note in old.items() if notes.get(note_id) is not note]
+    return notes, removed, added
+
+
+def apply_record(notes, record):
+    """apply one journal record to notes by id
+
+    {'op': 'add', 'id': i, 'note': {...}}, {'op': 'remove', 'id': i}
+    or {'op': 'update', 'id': i, 'note': {...}}, the updated note keeping its place"""
+    if record['op'] == 'remove':
+        del notes[record['id']]
+    else:
+        notes[record['id']] = Note(record['note'])
+
+
+def apply_numbered_record(notes, record):
+    """apply a record of a journal written before note ids, by position in a list"""
+    if record['op'] == 'add':
+        notes.append(Note(record['note']))
+    elif record['op'] == 'remove':
+        notes.pop(record['number'])
+    elif record['op'] == 'update':
+        notes.pop(record['number'])
+        notes.append(Note(record['note']))
+
+
+def read_csv(path):
+    """read all notes of a csv file, missing values of a short row are empty, extra ones are dropped"""
+    with open(path) as p:
+        return [Note((name, value or '') for name, value in row.items() if name is not None)
+                for row in csv.DictReader(p, skipinitialspace=True)]
+
+
+def write_csv(path, fieldnames, notes, sync=False):
+    """write notes to a csv file, optionally waiting for the data to reach the disk"""
+    with open(path, 'w', newline='') as output_file:
+        # fields of notes left out of fieldnames (their id) are not written
+        dict_writer = csv.DictWriter(output_file, fieldnames, extrasaction='ignore')
+        dict_writer.writeheader()
+        dict_writer.writerows(notes)
+        if sync:
+            output_file.flush()
+            os.fsync(output_file.fileno())
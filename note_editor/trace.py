@@ -0,0 +1,125 @@
+"""opt-in timing of the storage and pdf stages, saved as a chrome trace
+
+set NOTE_EDITOR_TRACE=/path/to/trace.json (or path in the [trace] section of config.ini)
+and open the file in chrome://tracing or https://ui.perfetto.dev once the program exits.
+Spans time a block of code, counters add up notes, pages and bytes.
+Disabled, span returns a shared no-op context and count returns at once."""
+import atexit
+import contextlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+env_var = 'NOTE_EDITOR_TRACE'
+
+# recorded events, None while tracing is disabled
+events = None
+# running total of each counter
+totals = {}
+path = None
+lock = threading.Lock()
+no_span = contextlib.nullcontext()
+
+
+def enabled():
+    return events is not None
+
+
+def enable(trace_path=None):
+    """start recording, events are written to trace_path on exit (kept in memory without one)"""
+    global events, path
+    with lock:
+        if events is None:
+            events = []
+            atexit.register(save)
+        path = trace_path or path
+
+
+def now():
+    """microseconds of a clock shared by every process of the machine"""
+    return time.perf_counter_ns() // 1000
+
+
+class Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, *exc):
+        end = now()
+        event = {'name': self.name, 'ph': 'X', 'ts': self.start, 'dur': end - self.start,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if self.args:
+            event['args'] = self.args
+        with lock:
+            events.append(event)
+
+
+def span(name, **args):
+    """time the enclosed block: with span('merge_pages', chunks=12): ..."""
+    if events is None:
+        return no_span
+    return Span(name, args)
+
+
+def count(name, value=1):
+    """add value to a counter, the trace shows its running total"""
+    if events is None:
+        return
+    with lock:
+        total = totals[name] = totals.get(name, 0) + value
+        events.append({'name': name, 'ph': 'C', 'ts': now(), 'pid': os.getpid(), 'args': {name: total}})
+
+
+def run_traced(trace, func, *args):
+    """run func in a worker process, return its result and the events it recorded
+
+    counters of the workers are merged into the totals of the main process by add_events"""
+    if not trace:
+        return func(*args), []
+    enable()
+    with lock:
+        del events[:]
+        totals.clear()
+    result = func(*args)
+    with lock:
+        return result, list(events)
+
+
+def add_events(new_events):
+    """events recorded by run_traced in another process"""
+    if events is None:
+        return
+    # counter events of the worker hold its running totals
+    worker_totals = {}
+    for event in new_events:
+        if event['ph'] == 'C':
+            name = event['name']
+            total = event['args'][name]
+            count(name, total - worker_totals.get(name, 0))
+            worker_totals[name] = total
+        else:
+            with lock:
+                events.append(event)
+
+
+def save():
+    """write the chrome trace, only the main process writes"""
+    if events is None or not path or multiprocessing.parent_process() is not None:
+        return
+    with lock:
+        data = {'traceEvents': list(events), 'displayTimeUnit': 'ms'}
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+if os.environ.get(env_var):
+    enable(os.environ[env_var])
@@ -0,0 +1,64 @@
+"""rebuild the pdf when another program changes the notes (a sync between machines, a script)
+
+the files of the storage are polled, one os.stat each per interval: as long as their size
+and modification time stay the same nothing is read, an idle watch costs next to no cpu.
+After a change the notes are read again once the files stayed quiet for delay seconds
+(a sync writing in several steps is read once), only the changed rows become new notes
+(see NoteManager.reload) and the pdf is built again from its cached pages"""
+import threading
+import time
+import traceback
+
+from note_editor import trace
+from note_editor.storage import file_state
+
+
+class Watcher:
+    """polls the files of a NoteManager, reloads it and calls export after each change
+
+    export is called with the removed and added notes, empty lists for the first build"""
+
+    def __init__(self, note_manager, export, interval=2.0, delay=5.0):
+        self.note_manager = note_manager
+        self.export = export
+        self.interval = interval
+        self.delay = delay
+        self.state = self.files_state()
+        # time.monotonic() of the last change not reloaded yet, None when up to date
+        self.changed = None
+        self.stopped = threading.Event()
+
+    def files_state(self):
+        return [file_state(path) for path in self.note_manager.storage.files()]
+
+    def poll(self):
+        """check the files once, reload and export if they stopped changing, return True if it did"""
+        state = self.files_state()
+        now = time.monotonic()
+        if state != self.state:
+            self.state = state
+            self.changed = now
+        if self.changed is None or now - self.changed < self.delay:
+            return False
+        # a file that can not be read is not read again before its next change
+        self.changed = None
+        with trace.span('watch rebuild'):
+            removed, added = self.note_manager.reload()
+            self.export(removed, added)
+        return True
+
+    def run(self):
+        """build once, then poll until stop is called"""
+        try:
+            self.export([], [])
+        except Exception:
+            traceback.print_exc()
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                # the notes or the pdf are broken until the next change, keep watching
+                traceback.print_exc()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,81 @@
+"""writes of NoteManager edits from a background thread
+
+the gui thread queues journal records (see storage.apply_record) and returns at once;
+a single thread hands them to the storage. The records queued while a write is running
+are written together by the next one: one append and one fsync of the journal, or one
+sqlite transaction, however many edits a burst made"""
+import atexit
+import threading
+
+from note_editor import trace
+
+
+class BackgroundWriter:
+    """queue of edits written by a daemon thread, flushed on exit"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        # records not handed to the storage yet
+        self.queue = []
+        # notes by id of the NoteManager, copied with each batch of records
+        self.notes = None
+        # number of records being written
+        self.writing = 0
+        # exception of the last write, its records are back in the queue
+        self.error = None
+        # also held by NoteManager while it changes its notes and queues the record of the change
+        self.condition = threading.Condition(threading.RLock())
+        self.thread = None
+
+    def submit(self, record, notes):
+        """queue one edit, notes are those by id with the edit applied"""
+        with self.condition:
+            self.queue.append(record)
+            self.notes = notes
+            # a new edit retries a failed write
+            self.error = None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='note writer', daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+            self.condition.notify_all()
+
+    def pending(self):
+        """number of edits not on disk yet"""
+        with self.condition:
+            return len(self.queue) + self.writing
+
+    def run(self):
+        while True:
+            with self.condition:
+                # after a failure, wait for the next edit or flush to try again
+                while not self.queue or self.error is not None:
+                    self.condition.wait()
+                records, self.queue = self.queue, []
+                # the storage may dump them while the notes keep changing
+                notes = dict(self.notes)
+                self.writing = len(records)
+            try:
+                with trace.span('write edits', edits=len(records)):
+                    self.storage.write(notes, records)
+                error = None
+            except Exception as e:
+                error = e
+            with self.condition:
+                if error is not None:
+                    self.queue[:0] = records
+                self.error = error
+                self.writing = 0
+                self.condition.notify_all()
+
+    def flush(self):
+        """wait until every queued edit is written, raise the error of a failed write"""
+        with self.condition:
+            if self.error is not None and self.queue:
+                # one more attempt
+                self.error = None
+                self.condition.notify_all()
+            while (self.queue or self.writing) and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
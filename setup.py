@@ -33,6 +33,8 @@ setup(
     ],
     description="i to keep notes on books, movies etc",
     install_requires=requirements,
+    # pypdf enables the incremental pdf build
+    extras_require={'incremental': ['pypdf']},
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -46,6 +48,6 @@ setup(
     version='0.1.0',
     zip_safe=False,
     entry_points={
-        'console_scripts': ['note=note_editor.main:run'],
+        'console_scripts': ['note=note_editor.main:run', 'note-batch=note_editor.cli:main'],
     }
 )
@@ -0,0 +1,44 @@
+"""fixtures shared by the tests: notes made from a title, and notes files in a temporary folder"""
+import pytest
+
+from note_editor.note_manager import NoteManager
+
+
+@pytest.fixture
+def make_note():
+    """make_note(title, **values): dict of a note, with an author, a year and a body unless given"""
+    def make_note(title, **values):
+        note = {'title': title, 'author': 'someone', 'year': '2000', 'notes': 'notes on ' + title}
+        note.update(values)
+        return note
+    return make_note
+
+
+@pytest.fixture
+def titles():
+    """titles(note_manager): titles of the notes, in their order"""
+    return lambda note_manager: [note['title'] for note in note_manager.notes.values()]
+
+
+@pytest.fixture(params=['csv', 'sqlite'])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def notes_path(tmp_path, backend):
+    return str(tmp_path / ('notes.db' if backend == 'sqlite' else 'notes.csv'))
+
+
+@pytest.fixture
+def open_notes(notes_path, backend):
+    """open_notes(**kwargs): a new NoteManager of the same notes at each call, as another program would"""
+    return lambda **kwargs: NoteManager(notes_path, backend=backend, **kwargs)
+
+
+@pytest.fixture
+def csv_path(tmp_path, make_note):
+    """notes.csv holding a, b and c, written by a first dump"""
+    path = str(tmp_path / 'notes.csv')
+    NoteManager(path).add_notes([make_note('a'), make_note('b'), make_note('c')])
+    return path
@@ -0,0 +1,123 @@
+"""note-batch: the commands of the command line, on both backends"""
+import json
+import os
+
+import pytest
+
+from note_editor import cli
+from note_editor.config import default_config
+
+
+@pytest.fixture
+def run(notes_path, backend, monkeypatch, capsys):
+    """run(*argv): exit code, standard output and error of note-batch on the notes of the test"""
+    # the config file next to the package is neither read nor created
+    monkeypatch.setattr(cli, 'load_config', default_config)
+
+    def run(*argv):
+        code = cli.main(['--notes', notes_path, '--backend', backend] + list(argv))
+        out, err = capsys.readouterr()
+        return code, out, err
+    return run
+
+
+@pytest.fixture
+def note_manager(open_notes, make_note):
+    note_manager = open_notes()
+    note_manager.add_notes([make_note('Dune', author='Frank Herbert', year='1965', media_type='book'),
+                            make_note('Dune', author='Frank Herbert', year='1965', media_type='book'),
+                            make_note('Stalker', author='Andrei Tarkovsky', year='1979', media_type='movie')])
+    return note_manager
+
+
+def files(directory):
+    """modification time of every file of directory"""
+    return {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+
+
+def test_stats(run, note_manager):
+    code, out, _ = run('stats')
+    assert code == 0
+    assert 'notes: 3\n' in out
+    assert 'authors: 2\n' in out
+    assert 'years: 1965 - 1979\n' in out
+    assert '  book         2\n' in out
+
+
+def test_reading_commands_leave_the_files(run, note_manager, tmp_path):
+    before = files(tmp_path)
+    for argv in (['stats'], ['duplicates'], ['history']):
+        assert run(*argv)[0] == 0
+    assert files(tmp_path) == before
+
+
+def test_duplicates(run, note_manager):
+    code, out, _ = run('duplicates')
+    assert code == 0
+    first, second = list(note_manager.notes)[:2]
+    line = '{}  Dune - Frank Herbert (1965)\n'
+    assert out.startswith(line.format(first) + line.format(second) + '\n')
+    assert '1 groups, 2 notes, found in ' in out
+
+
+def test_import(run, note_manager, open_notes, tmp_path, titles):
+    path = tmp_path / 'movies.jsonl'
+    rows = [{'Name': 'Solaris', 'author': 'Andrei Tarkovsky', 'year': 1972, 'media_type': 'movie'},
+            {'Name': 'Stalker', 'author': 'Andrei Tarkovsky', 'year': 1979, 'media_type': 'movie'},
+            {'Name': 'Mirror', 'author': 'Andrei Tarkovsky', 'year': 1975, 'media_type': 'film'}]
+    path.write_text('\n'.join(json.dumps(row) for row in rows))
+    code, out, err = run('import', str(path), '--map', 'Name=title')
+    assert code == 0
+    assert out.startswith('1 notes imported, 1 duplicates, 1 invalid, 3 rows read in ')
+    assert out.endswith(', 4 in total\n')
+    assert err == '{}: row 3: unknown media_type: film\n'.format(path)
+    assert titles(open_notes()) == ['Dune', 'Dune', 'Stalker', 'Solaris']
+
+
+def test_bad_arguments(run, note_manager, tmp_path):
+    code, _, err = run('import', str(tmp_path / 'books.csv'), '--map', 'Name')
+    assert code == 1
+    assert err == 'note-batch: --map expects COLUMN=CATEGORY, not Name\n'
+    assert run('import', str(tmp_path / 'missing.csv'))[0] == 1
+    assert run('restore')[0] == 1
+    with pytest.raises(SystemExit):
+        run('export')
+
+
+def test_history_and_restore(run, note_manager, open_notes, titles):
+    stalker = list(note_manager.notes)[2]
+    note_manager.remove_note(stalker)
+    code, out, _ = run('history')
+    assert code == 0
+    lines = out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].split()[0] == '1' and lines[0].endswith('3 added, 0 updated, 0 removed')
+    assert lines[1].endswith('0 added, 0 updated, 1 removed')
+    code, out, _ = run('history', '--note', stalker)
+    # number, date and time, then the note or removed
+    assert [line.split()[3:] for line in out.splitlines()] == [
+        ['Stalker', '-', 'Andrei', 'Tarkovsky', '(1979)'], ['removed']]
+
+    code, out, _ = run('restore', '1')
+    assert code == 0
+    assert out == 'version 1 restored: 0 notes removed, 1 added, 3 in total\n'
+    assert titles(open_notes()) == ['Dune', 'Dune', 'Stalker']
+    assert run('history', '--note', 'missing')[2] == 'note-batch: no note missing in the history\n'
+
+
+def test_export(run, note_manager, tmp_path):
+    pytest.importorskip('reportlab')
+    pdf = str(tmp_path / 'notes.pdf')
+    cache_dir = str(tmp_path / 'cache')
+    code, out, _ = run('export', pdf, '--cache-dir', cache_dir, '--workers', '1')
+    assert code == 0
+    assert out.startswith('3 notes exported to {} in '.format(pdf))
+    assert os.path.exists(pdf)
+    assert run('export', pdf, '--cache-dir', cache_dir, '--workers', '1')[1] == \
+        '{} is up to date, --force to build it anyway\n'.format(pdf)
+
+    split = str(tmp_path / 'split')
+    code, out, _ = run('export', split, '--split-by', 'media_type', '--cache-dir', cache_dir, '--workers', '1')
+    assert out.startswith('2 pdf rebuilt\n')
+    assert sorted(os.listdir(split)) == ['index.pdf', 'manifest.json', 'media_type_book.pdf',
+                                         'media_type_movie.pdf']
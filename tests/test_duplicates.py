@@ -0,0 +1,77 @@
+"""near duplicate notes: normalized titles, MinHash buckets, clusters"""
+import pytest
+
+from note_editor.duplicates import DuplicateIndex, normalize
+from note_editor.note_manager import NoteManager
+
+
+@pytest.fixture
+def note_manager(tmp_path, make_note):
+    note_manager = NoteManager(str(tmp_path / 'notes.csv'))
+    note_manager.add_notes([make_note('The Great Gatsby', author='F. Scott Fitzgerald'),
+                            make_note('Great Gatsbby', author='F Scott Fitzgerald'),
+                            make_note('The Great Gatsby', author='Baz Luhrmann'),
+                            make_note('Éléphant', author='Gus Van Sant'),
+                            make_note('elephant', author=''),
+                            make_note('Moby Dick', author='Herman Melville'),
+                            make_note('', author='Herman Melville')])
+    return note_manager
+
+
+@pytest.fixture
+def index(note_manager):
+    index = DuplicateIndex()
+    index.attach(note_manager)
+    return index
+
+
+def titles(found):
+    return sorted(note['title'] for _, note in found)
+
+
+def test_normalize():
+    assert normalize('The Great Gatsby!') == 'great gatsby'
+    assert normalize('  Éléphant ') == 'elephant'
+    # an article alone is the title
+    assert normalize('The') == 'the'
+    assert normalize('A-ha: Take on me') == 'ha take on me'
+
+
+def test_similar(index, make_note):
+    assert titles(index.similar(make_note('the great gatsby', author='f. scott fitzgerald'))) == \
+        ['Great Gatsbby', 'The Great Gatsby']
+    # a missing author does not tell notes apart
+    assert titles(index.similar(make_note('Elephant', author=''))) == ['elephant', 'Éléphant']
+    assert index.similar(make_note('Moby Dick', author='someone else')) == []
+    assert index.similar(make_note('', author='Herman Melville')) == []
+
+
+def test_similar_excludes_edited_note(index, note_manager):
+    moby = list(note_manager.notes.values())[5]
+    assert index.similar(moby, exclude=moby) == []
+    assert titles(index.similar(moby)) == ['Moby Dick']
+
+
+def test_follows_edits(index, note_manager, make_note):
+    """attach keeps the index up to date with the notes, notes without a title are not indexed"""
+    assert len(index) == 6
+    ids = list(note_manager.notes)
+    note_manager.update_note(make_note('Moby-Dick; or, The Whale', author='Herman Melville'), ids[1])
+    note_manager.remove_note(ids[0])
+    assert len(index) == 5
+    assert index.similar(make_note('The Great Gatsby', author='F. Scott Fitzgerald')) == []
+    assert titles(index.similar(make_note('moby dick', author='Herman Melvile'))) == ['Moby Dick']
+
+
+def test_clusters(index):
+    clusters = [sorted(note['title'] for note in cluster) for cluster in index.clusters()]
+    assert sorted(clusters) == [['Great Gatsbby', 'The Great Gatsby'], ['elephant', 'Éléphant']]
+
+
+def test_typo_found_among_many(make_note):
+    """buckets keep a duplicate with a typo among thousands of unrelated titles"""
+    index = DuplicateIndex()
+    index.build(make_note('note number {} about {}'.format(i, 'abcdefghij'[i % 10] * (i % 7 + 1)))
+                for i in range(3000))
+    index.add(make_note('A Tale of Two Cities'))
+    assert titles(index.similar(make_note('a tale of two citeis'))) == ['A Tale of Two Cities']
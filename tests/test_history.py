@@ -0,0 +1,71 @@
+"""versions of the notes kept in the history, and bringing them back"""
+import time
+
+import pytest
+
+from note_editor.note_manager import NoteManager
+
+
+@pytest.fixture
+def edited(open_notes, make_note):
+    """notes with three versions: a, b and c added, a updated, b removed"""
+    note_manager = open_notes()
+    note_manager.add_notes([make_note('a'), make_note('b'), make_note('c')])
+    a, b, c = note_manager.notes
+    note_manager.update_note(make_note('a1'), a)
+    note_manager.remove_note(b)
+    return note_manager
+
+
+def test_every_version_recorded(edited):
+    assert len(edited.history) == 3
+    assert [entry[2:] for entry in edited.history.log()] == [(3, 0, 0), (0, 1, 0), (0, 0, 1)]
+
+
+def test_restore_version(edited, open_notes, titles):
+    """the restore is a new version, the notes come back with their ids"""
+    ids = list(edited.history.state(1))
+    edited.restore(1)
+    assert titles(edited) == ['a', 'b', 'c']
+    assert list(edited.notes) == ids
+    assert len(edited.history) == 4
+
+    again = open_notes()
+    assert titles(again) == ['a', 'b', 'c']
+    assert list(again.notes) == ids
+    # and the restore can be undone too
+    again.restore(3)
+    assert titles(again) == ['a1', 'c']
+
+
+def test_versions_of_one_note(edited):
+    a, b = list(edited.history.state(1))[:2]
+    versions = edited.history.note_versions(a)
+    assert [(number, note['title']) for number, _, note in versions] == [(1, 'a'), (2, 'a1')]
+    versions = edited.history.note_versions(b)
+    assert [number for number, _, _ in versions] == [1, 3]
+    assert versions[0][2]['notes'] == 'notes on b'
+    assert versions[1][2] is None
+
+
+def test_version_at(edited):
+    times = [entry[1] for entry in edited.history.log()]
+    assert edited.history.version_at(times[1]) == 2
+    assert edited.history.version_at(times[0] - 1) == 0
+    assert edited.history.version_at(time.time()) == 3
+
+
+def test_unknown_version(edited):
+    with pytest.raises(ValueError):
+        edited.restore(4)
+    with pytest.raises(ValueError):
+        edited.history.notes(0)
+
+
+def test_first_version_on_open(tmp_path, make_note):
+    """notes written without a history get a first version when opened"""
+    path = str(tmp_path / 'notes.csv')
+    NoteManager(path, history=False).add_notes([make_note('a'), make_note('b')])
+    note_manager = NoteManager(path)
+    assert len(note_manager.history) == 1
+    assert [entry[2:] for entry in note_manager.history.log()] == [(2, 0, 0)]
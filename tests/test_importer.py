@@ -0,0 +1,87 @@
+"""bulk import: csv and json lines sources, column mapping, duplicates and invalid rows"""
+import csv
+import json
+
+import pytest
+
+from note_editor.importer import Importer, duplicate_key
+from note_editor.note_manager import NoteManager
+
+
+@pytest.fixture
+def note_manager(tmp_path, make_note):
+    note_manager = NoteManager(str(tmp_path / 'notes.csv'))
+    note_manager.add_notes([make_note('Dune', author='Frank Herbert', year='1965')])
+    return note_manager
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+def test_duplicate_key():
+    assert duplicate_key({'title': 'The  Dune!', 'author': 'frank herbert', 'year': '1965'}) == \
+        duplicate_key({'title': 'the dune', 'author': 'Frank, Herbert', 'year': '1965', 'notes': 'other'})
+    assert duplicate_key({'title': 'Dune', 'year': '1965'}) != duplicate_key({'title': 'Dune', 'year': '1984'})
+
+
+def test_import_csv(note_manager, tmp_path, titles):
+    path = write_csv(tmp_path / 'books.csv', [
+        {'Title': 'Solaris', 'AUTHOR': 'Stanislaw Lem', 'year': '1961', 'Media_Type': 'Book', 'pages': '204'},
+        {'Title': 'dune', 'AUTHOR': 'Frank  Herbert', 'year': '1965', 'Media_Type': 'book', 'pages': '412'},
+        {'Title': 'Stalker', 'AUTHOR': 'Andrei Tarkovsky', 'year': '1979', 'Media_Type': 'film', 'pages': ''},
+        {'Title': '', 'AUTHOR': '', 'year': '', 'Media_Type': '', 'pages': ''},
+        {'Title': 'Solaris', 'AUTHOR': 'Stanislaw Lem', 'year': '1961', 'Media_Type': 'book', 'pages': ''}])
+    report = Importer(note_manager, batch_size=1).run([path])
+
+    assert (report.read, report.imported, report.duplicates) == (5, 1, 2)
+    assert [(number, reason) for _, number, reason in report.invalid] == [(3, 'unknown media_type: film'),
+                                                                          (4, 'empty note')]
+    assert titles(note_manager) == ['Dune', 'Solaris']
+    solaris = list(note_manager.notes.values())[1]
+    # media types take the case of the categories, unknown columns are dropped
+    assert solaris['media_type'] == 'book'
+    assert 'pages' not in solaris
+    # written once at the end
+    assert titles(NoteManager(note_manager.path)) == ['Dune', 'Solaris']
+
+
+def test_import_json_lines_with_mapping(note_manager, tmp_path, titles):
+    path = tmp_path / 'movies.jsonl'
+    rows = [{'Name': 'Stalker', 'director': 'Andrei Tarkovsky', 'year': 1979, 'media_type': 'movie'},
+            {'Name': 'Solaris', 'director': 'Andrei Tarkovsky', 'year': 1972, 'media_type': 'movie'}]
+    path.write_text('\n'.join(json.dumps(row) for row in rows) + '\n\n')
+    report = Importer(note_manager, {'Name': 'title', 'Director': 'author'}).run([str(path)])
+    assert report.imported == 2
+    assert titles(note_manager) == ['Dune', 'Stalker', 'Solaris']
+    assert note_manager.find('author', 'andrei tarkovsky')
+    assert list(note_manager.notes.values())[2]['year'] == '1972'
+
+
+def test_unknown_category(note_manager):
+    with pytest.raises(ValueError):
+        Importer(note_manager, {'Name': 'name'})
+
+
+def test_bad_json_line_keeps_the_batches_before(note_manager, tmp_path, titles, make_note):
+    first = write_csv(tmp_path / 'first.csv', [make_note('Solaris')])
+    second = tmp_path / 'second.jsonl'
+    second.write_text(json.dumps(make_note('Stalker')) + '\n{not json\n')
+    with pytest.raises(ValueError, match='second.jsonl:2'):
+        Importer(note_manager, batch_size=1).run([first, str(second)])
+    assert titles(NoteManager(note_manager.path)) == ['Dune', 'Solaris', 'Stalker']
+
+
+def test_report(note_manager, tmp_path, make_note):
+    dune = make_note('Dune', author='Frank Herbert', year='1965')
+    path = write_csv(tmp_path / 'books.csv', [make_note('Solaris'), dune])
+    report = Importer(note_manager).run([path])
+    assert report.seconds > 0
+    # duplicates and invalid rows are read, not imported
+    assert report.rate() == pytest.approx(1 / report.seconds)
+    assert str(report).startswith('1 notes imported, 1 duplicates, 0 invalid, 2 rows read in ')
+    assert str(report).endswith(' notes/s)')
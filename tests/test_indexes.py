@@ -0,0 +1,82 @@
+"""sorted indexes of the notes: order, ties, and the same index however it was built"""
+import random
+
+import pytest
+
+from note_editor.indexes import SortedIndex, text_key, year_key
+from note_editor.note_manager import NoteManager
+from note_editor.storage import id_field
+
+
+def make_notes(count, seed=0):
+    """notes with ids in creation order and many equal titles"""
+    rng = random.Random(seed)
+    return [{'title': rng.choice(['b', 'B', 'a', 'Ä', 'c d', 'C', '']), 'year': str(rng.choice([987, 2000, 1999])),
+             id_field: '{:014x}00000000'.format(i)} for i in range(count)]
+
+
+def expected(notes, name='title', key=text_key):
+    return sorted(notes, key=lambda note: (key(note[name]), note[id_field]))
+
+
+def test_keys():
+    assert sorted(['b', 'B', 'a', 'C'], key=text_key) == ['a', 'b', 'B', 'C']
+    assert sorted(['2000', 'unknown', '987', '0999', ''], key=year_key) == ['987', '0999', '2000', '', 'unknown']
+
+
+def test_build_sorts_ties_by_id():
+    notes = make_notes(200)
+    index = SortedIndex('title')
+    index.build(list(reversed(notes)))
+    assert list(index) == expected(notes)
+    assert index.ids == [note[id_field] for note in expected(notes)]
+    assert len(index) == 200
+
+
+def test_incremental_equals_build():
+    """adding, removing and updating one note or many gives the index built at once"""
+    notes = make_notes(300)
+    rng = random.Random(1)
+    index = SortedIndex('year', year_key)
+    index.build(notes[:100])
+    for note in notes[100:150]:
+        index.add(note)
+    index.add_many(notes[150:])
+    for note in rng.sample(notes, 50):
+        index.remove(note)
+        notes.remove(note)
+    for i in rng.sample(range(len(notes)), 20):
+        new = dict(notes[i], year='1000')
+        index.update(notes[i], new)
+        notes[i] = new
+    built = SortedIndex('year', year_key)
+    built.build(notes)
+    assert list(index) == list(built) == expected(notes, 'year', year_key)
+    assert index.keys == built.keys
+
+
+def test_remove_note_modified_in_place():
+    notes = make_notes(10)
+    index = SortedIndex('title')
+    index.build(notes)
+    notes[3]['title'] = 'zzz'
+    index.remove(notes[3])
+    assert notes[3] not in list(index)
+    assert len(index) == 9
+
+
+@pytest.mark.parametrize('backend', ['csv', 'sqlite'])
+def test_note_manager_orders(tmp_path, backend, make_note):
+    """sorted ids follow the edits, ties in creation order"""
+    path = str(tmp_path / ('notes.db' if backend == 'sqlite' else 'notes.csv'))
+    note_manager = NoteManager(path, backend=backend)
+    note_manager.add_notes([make_note('b', author='x'), make_note('A', author='y'), make_note('c', author='x')])
+    b, a, c = note_manager.notes
+    assert note_manager.sorted_ids('title') == [a, b, c]
+    assert note_manager.sorted_ids('author') == [b, c, a]
+    note_manager.update_note(make_note('0', author='x'), c)
+    note_manager.remove_note(a)
+    assert note_manager.sorted_ids('title') == [c, b]
+    assert [note['title'] for note in note_manager.sorted_notes('title')] == ['0', 'b']
+    assert note_manager.sorted_ids('author') == [b, c]
+    assert NoteManager(path, backend=backend).sorted_ids('title') == [c, b]
@@ -0,0 +1,181 @@
+"""journal of the csv storage: replay, crash recovery and files of older versions"""
+import csv
+import json
+import os
+import zlib
+
+import pytest
+
+from note_editor.note_manager import NoteManager, categories
+
+
+def journal_path(path):
+    return os.path.splitext(path)[0] + '_journal.jsonl'
+
+
+def write_legacy_csv(path, notes):
+    """csv of a version without note ids, return its checksum"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, [category.name for category in categories], restval='')
+        writer.writeheader()
+        writer.writerows(notes)
+    with open(path, 'rb') as f:
+        return zlib.crc32(f.read())
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_edits_replayed_from_journal(csv_path, lazy, make_note, titles):
+    """edits are appended to the journal and replayed on top of the csv, ids included"""
+    note_manager = NoteManager(csv_path, lazy=lazy)
+    ids = list(note_manager.notes)
+    note_manager.update_note(make_note('b2'), ids[1])
+    note_manager.remove_note(ids[0])
+    new_id = note_manager.add_note(make_note('d'))
+    assert os.path.exists(journal_path(csv_path))
+
+    again = NoteManager(csv_path, lazy=lazy)
+    assert list(again.notes) == [ids[1], ids[2], new_id]
+    assert titles(again) == ['b2', 'c', 'd']
+    assert again.notes[new_id]['notes'] == 'notes on d'
+
+
+def test_compact_folds_journal_into_csv(csv_path, make_note, titles):
+    note_manager = NoteManager(csv_path)
+    note_manager.add_note(make_note('d'))
+    note_manager.compact()
+    assert not os.path.exists(journal_path(csv_path))
+    assert titles(NoteManager(csv_path)) == ['a', 'b', 'c', 'd']
+
+
+def test_record_cut_by_crash(csv_path, make_note, titles):
+    """a record cut mid-write is dropped, the journal is truncated to its last complete record"""
+    note_manager = NoteManager(csv_path)
+    note_manager.add_note(make_note('d'))
+    size = os.path.getsize(journal_path(csv_path))
+    with open(journal_path(csv_path), 'ab') as j:
+        j.write(b'{"op": "add", "id": "065e0a00000000deadbeef", "no')
+
+    again = NoteManager(csv_path)
+    assert titles(again) == ['a', 'b', 'c', 'd']
+    assert os.path.getsize(journal_path(csv_path)) == size
+    # the next record starts on a clean line
+    again.add_note(make_note('e'))
+    assert titles(NoteManager(csv_path)) == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_stale_journal_ignored(csv_path, make_note, titles):
+    """a journal left by a crash after its compaction is not replayed over a newer csv"""
+    note_manager = NoteManager(csv_path)
+    note_id = next(iter(note_manager.notes))
+    note_manager.update_note(make_note('a1'), note_id)
+    with open(journal_path(csv_path), 'rb') as j:
+        stale = j.read()
+    note_manager.compact()
+    note_manager.update_note(make_note('a2'), note_id)
+    note_manager.compact()
+    with open(journal_path(csv_path), 'wb') as j:
+        j.write(stale)
+
+    assert titles(NoteManager(csv_path)) == ['a2', 'b', 'c']
+    assert not os.path.exists(journal_path(csv_path))
+
+
+def test_legacy_journal_by_position(tmp_path, make_note, titles):
+    """a csv and a journal written before note ids: records hold positions, ids are given and written"""
+    path = str(tmp_path / 'notes.csv')
+    crc = write_legacy_csv(path, [make_note('a'), make_note('b'), make_note('c')])
+    full = dict.fromkeys([category.name for category in categories], '')
+    records = [{'snapshot': crc},
+               {'op': 'update', 'number': 0, 'note': dict(full, **make_note('a2'))},
+               {'op': 'remove', 'number': 0},
+               {'op': 'add', 'note': dict(full, **make_note('d'))}]
+    with open(journal_path(path), 'w') as j:
+        j.writelines(json.dumps(record) + '\n' for record in records)
+
+    note_manager = NoteManager(path)
+    # an update moved the note to the end in that version
+    assert titles(note_manager) == ['c', 'a2', 'd']
+    assert all(note_manager.notes)
+    assert not os.path.exists(journal_path(path))
+    again = NoteManager(path)
+    assert list(again.notes) == list(note_manager.notes)
+    assert titles(again) == ['c', 'a2', 'd']
+
+
+def test_read_only_open_writes_nothing(tmp_path, make_note, titles):
+    """a csv without ids opened read only is left as it is, its first edit writes the ids"""
+    path = str(tmp_path / 'notes.csv')
+    write_legacy_csv(path, [make_note('a'), make_note('b')])
+    with open(path, 'rb') as f:
+        before = f.read()
+    note_manager = NoteManager(path, read_only=True)
+    assert titles(note_manager) == ['a', 'b']
+    with open(path, 'rb') as f:
+        assert f.read() == before
+    assert not os.path.exists(os.path.splitext(path)[0] + '_history')
+
+    note_manager.add_note(make_note('c'))
+    again = NoteManager(path)
+    assert list(again.notes) == list(note_manager.notes)
+    assert titles(again) == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_snapshot_invalidated_by_csv_change(csv_path, lazy):
+    """a csv rewritten by another program is parsed again instead of read from its snapshot"""
+    NoteManager(csv_path, lazy=lazy)
+    snapshot_path = os.path.splitext(csv_path)[0] + '_snapshot.bin'
+    assert os.path.exists(snapshot_path)
+    with open(csv_path, newline='') as f:
+        rows = list(csv.reader(f))
+    rows[1][0] = 'a edited by hand'
+    rows[1][-2] = 'a longer body, edited by hand'
+    with open(csv_path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+    note_manager = NoteManager(csv_path, lazy=lazy)
+    note = next(iter(note_manager.notes.values()))
+    assert note['title'] == 'a edited by hand'
+    assert note['notes'] == 'a longer body, edited by hand'
+
+
+def test_read_only_ids_stable(tmp_path, make_note):
+    """a csv without ids opened read only twice gives the same ids, its export is skipped the second time"""
+    pdf_maker = pytest.importorskip('note_editor.pdf_maker')
+    path = str(tmp_path / 'notes.csv')
+    write_legacy_csv(path, [make_note('a'), make_note('b'), make_note('a')])
+    first = NoteManager(path, read_only=True, lazy=True)
+    second = NoteManager(path, read_only=True, lazy=True)
+    assert list(first.notes) == list(second.notes)
+    assert len(set(first.notes)) == 3
+    assert sorted(os.listdir(tmp_path)) == ['notes.csv']
+
+    pdf = str(tmp_path / 'notes.pdf')
+    assert pdf_maker.make_pdf(pdf, first, workers=1)
+    assert not pdf_maker.make_pdf(pdf, NoteManager(path, read_only=True), workers=1)
+    # and the first write keeps them
+    ids = list(first.notes)
+    first.remove_note(ids[1])
+    assert list(NoteManager(path).notes) == [ids[0], ids[2]]
+
+
+@pytest.mark.parametrize('stale', [False, True])
+def test_read_only_journal_left_in_place(csv_path, stale, make_note, titles):
+    """a damaged journal is only read by a read only load, the next write rewrites the csv"""
+    NoteManager(csv_path).add_note(make_note('d'))
+    with open(journal_path(csv_path), 'r+b') as j:
+        if stale:
+            j.write(b'{"snapshot": 0}')
+        else:
+            j.seek(0, os.SEEK_END)
+            j.write(b'{"op": "add"')
+    with open(journal_path(csv_path), 'rb') as j:
+        journal = j.read()
+
+    note_manager = NoteManager(csv_path, read_only=True)
+    assert titles(note_manager) == (['a', 'b', 'c'] if stale else ['a', 'b', 'c', 'd'])
+    with open(journal_path(csv_path), 'rb') as j:
+        assert j.read() == journal
+    note_manager.add_note(make_note('e'))
+    expected = ['a', 'b', 'c', 'e'] if stale else ['a', 'b', 'c', 'd', 'e']
+    assert titles(NoteManager(csv_path)) == expected
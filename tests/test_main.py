@@ -0,0 +1,104 @@
+"""main window with tk replaced by mocks: startup, indexes built in the background, exit"""
+import functools
+import os
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('tkinter')
+
+from note_editor import main  # noqa: E402
+from note_editor.config import default_config  # noqa: E402
+from note_editor.note_manager import NoteManager  # noqa: E402
+
+
+@pytest.fixture
+def window(tmp_path, monkeypatch, make_note):
+    """MainWindow on notes.csv in tmp_path holding a, b and c, the pdf is written to tmp_path"""
+    path = str(tmp_path / 'notes.csv')
+    NoteManager(path).add_notes([make_note('a'), make_note('b', author='another'), make_note('c')])
+    config = default_config()
+    config['save_path']['head'] = str(tmp_path)
+    config['pdf']['workers'] = '1'
+    monkeypatch.setattr(main, 'tk', mock.MagicMock())
+    monkeypatch.setattr(main, 'load_config', lambda: config)
+    monkeypatch.setattr(main, 'NoteManager', functools.partial(NoteManager, path))
+    window = main.MainWindow()
+    yield window
+    window.pdf_worker.wait()
+
+
+def wait_for_indexes(window):
+    for build in list(window.index_builds.values()):
+        build.thread.join()
+    window.poll_indexes()
+
+
+def test_startup(window):
+    assert window.index_builds == {}
+    assert window.search_index is None
+    window.root.after_idle.assert_called_with(window.on_shown)
+
+
+def test_indexes_follow_edits_made_during_the_build(window, make_note):
+    window.on_shown()
+    assert set(window.index_builds) == {'search_index', 'duplicate_index'}
+    a, b, c = window.note_manager.notes
+    window.note_manager.update_note(make_note('a renamed'), a)
+    window.note_manager.remove_note(c)
+    wait_for_indexes(window)
+
+    assert window.index_builds == {}
+    assert [note['title'] for note in window.search_index.search('renamed')] == ['a renamed']
+    assert window.search_index.search('c') == []
+    # the indexes are observers from now on
+    new = window.note_manager.add_note(make_note('a renamed', notes='twice'))
+    note = window.note_manager.notes[new]
+    assert window.search_index.search('twice') == [note]
+    assert [other['title'] for _, other in window.duplicate_index.similar(note, exclude=note)] == ['a renamed']
+
+
+def test_exit_writes_pdf(window, tmp_path, make_note):
+    window.on_shown()
+    wait_for_indexes(window)
+    window.note_manager.add_note(make_note('d'))
+    window.exit_gui()
+    window.pdf_worker.wait()
+    assert window.pdf_worker.status == 'done'
+    assert os.path.exists(tmp_path / 'notes_on_stuff.pdf')
+    assert os.path.exists(tmp_path / 'notes_index.bin')
+    window.root.destroy.assert_called_once_with()
+
+
+@pytest.fixture
+def gui(window, monkeypatch):
+    """tk of the note windows mocked too, with a canvas of 100 pixels and rows of 20"""
+    from note_editor import notes_class
+    monkeypatch.setattr(notes_class, 'tk', mock.MagicMock())
+    monkeypatch.setattr(notes_class, 'ttk', mock.MagicMock())
+    notes_class.tk.Canvas.return_value.winfo_height.return_value = 100
+    notes_class.tk.Canvas.return_value.canvasy.return_value = 0
+    notes_class.tk.Frame.return_value.winfo_reqheight.return_value = 20
+    return window
+
+
+def test_select_window_follows_removal(gui):
+    gui.select_note()
+    select = gui.select_window
+    a, b, c = gui.note_manager.notes
+    assert select.rows == [a, b, c]
+    gui.note_manager.remove_note(b)
+    # rows are drawn before the table is filtered again
+    select.refresh_rows()
+    select.root.after_idle.assert_called_once_with(select.refilter)
+    select.refilter()
+    assert select.rows == [a, c]
+    select.exit_window()
+    assert select.on_notes_changed not in gui.note_manager.observers
+
+
+def test_note_window_of_removed_note(gui):
+    a = next(iter(gui.note_manager.notes))
+    gui.note_manager.remove_note(a)
+    note_window = main.NoteWindow(gui, note_id=a)
+    assert note_window.note['title'] == ''
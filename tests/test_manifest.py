@@ -0,0 +1,67 @@
+"""export manifest: the pdf is not built again while the notes and the pdf are unchanged"""
+import os
+
+import pytest
+
+pytest.importorskip('reportlab')
+
+from note_editor import pdf_maker  # noqa: E402
+from note_editor.note_manager import NoteManager  # noqa: E402
+
+
+@pytest.fixture
+def export(csv_path, tmp_path):
+    """export(note_manager=None, **kwargs): make_pdf of the notes to notes.pdf, True if it was built"""
+    path = str(tmp_path / 'notes.pdf')
+
+    def export(note_manager=None, **kwargs):
+        return pdf_maker.make_pdf(path, note_manager or NoteManager(csv_path), cache_dir=str(tmp_path / 'cache'),
+                                  workers=1, **kwargs)
+    export.path = path
+    return export
+
+
+def test_skipped_until_notes_change(export, csv_path, make_note):
+    note_manager = NoteManager(csv_path)
+    assert export(note_manager)
+    assert os.path.exists(pdf_maker.manifest_path(export.path))
+    assert not export(note_manager)
+    # another session of the same notes
+    assert not export()
+    note_manager.update_note(make_note('a1'), next(iter(note_manager.notes)))
+    assert export(note_manager)
+    assert not export()
+
+
+def test_order_is_part_of_hash(export, csv_path, make_note):
+    note_manager = NoteManager(csv_path)
+    export(note_manager)
+    a = next(iter(note_manager.notes))
+    note_manager.remove_note(a)
+    note_manager.add_note(make_note('a'))
+    assert export(note_manager)
+
+
+def test_pdf_changed_outside(export):
+    assert export()
+    with open(export.path, 'ab') as f:
+        f.write(b'\n')
+    assert export()
+    os.remove(export.path)
+    assert export()
+
+
+def test_forced_or_damaged_manifest(export):
+    export()
+    assert export(force=True)
+    with open(pdf_maker.manifest_path(export.path), 'w') as f:
+        f.write('{not json')
+    assert export()
+    assert not export()
+
+
+def test_hash_of_notes_passed(export, csv_path):
+    """the gui hands a copy of the notes to the worker, the hash is the one of the note manager"""
+    note_manager = NoteManager(csv_path)
+    export(note_manager, notes=list(note_manager.notes.values()), orders=pdf_maker.table_orders(note_manager))
+    assert not export(note_manager)
@@ -0,0 +1,88 @@
+"""two programs editing the same notes: the edits of both are kept"""
+import pytest
+
+
+@pytest.fixture
+def open_notes(open_notes, make_note):
+    """notes a, b and c, opened as another program would at each call"""
+    open_notes().add_notes([make_note('a'), make_note('b'), make_note('c')])
+    return open_notes
+
+
+@pytest.fixture
+def titles(titles):
+    """titles in alphabetical order, a merge appends the notes of the other program"""
+    return lambda note_manager: sorted(titles(note_manager))
+
+
+@pytest.mark.parametrize('journal', [True, False])
+def test_edits_of_both_kept(open_notes, journal, make_note, titles):
+    first = open_notes(journal=journal)
+    second = open_notes(journal=journal)
+    a, b, c = first.notes
+    first.update_note(make_note('a1'), a)
+    second.update_note(make_note('b1'), b)
+    second.remove_note(c)
+    d = second.add_note(make_note('d'))
+    first.add_note(make_note('e'))
+
+    assert titles(open_notes()) == ['a1', 'b1', 'd', 'e']
+    # ids stay valid across the merge and the notes read again
+    assert first.sync()
+    assert titles(first) == ['a1', 'b1', 'd', 'e']
+    assert first.notes[d]['title'] == 'd'
+    assert first.notes[b]['title'] == 'b1'
+
+
+def test_same_note_updated_by_both(open_notes, make_note, titles):
+    """both versions are kept, the second under a new id"""
+    first = open_notes()
+    second = open_notes()
+    a = next(iter(first.notes))
+    first.update_note(make_note('a first'), a)
+    second.update_note(make_note('a second'), a)
+
+    notes = open_notes()
+    assert titles(notes) == ['a first', 'a second', 'b', 'c']
+    assert len(notes.notes) == len(set(notes.notes))
+
+
+def test_copy_of_conflict_follows_later_edits(open_notes, make_note, titles):
+    """an edit made before the notes are read again goes to the copy of a note updated by both"""
+    first = open_notes()
+    second = open_notes()
+    a = next(iter(first.notes))
+    first.update_note(make_note('a first'), a)
+    second.update_note(make_note('a second'), a)
+    second.update_note(make_note('a second again'), a)
+    assert titles(open_notes()) == ['a first', 'a second again', 'b', 'c']
+    second.remove_note(a)
+    assert titles(open_notes()) == ['a first', 'b', 'c']
+
+
+def test_removed_and_updated(open_notes, make_note, titles):
+    """a note removed by one program and updated by the other is kept with the update"""
+    first = open_notes()
+    second = open_notes()
+    a = next(iter(first.notes))
+    first.remove_note(a)
+    second.update_note(make_note('a1'), a)
+    assert titles(open_notes()) == ['a1', 'b', 'c']
+
+    first = open_notes()
+    second = open_notes()
+    first.update_note(make_note('a2'), a)
+    second.remove_note(a)
+    assert titles(open_notes()) == ['a2', 'b', 'c']
+
+
+def test_sync_reads_edits_of_another_program(open_notes, titles):
+    first = open_notes()
+    second = open_notes()
+    assert not first.sync()
+    b = list(second.notes)[1]
+    second.remove_note(b)
+    assert first.sync()
+    assert b not in first.notes
+    assert titles(first) == ['a', 'c']
+    assert [note['title'] for note in first.sorted_notes('title')] == ['a', 'c']
@@ -0,0 +1,87 @@
+"""pdf export: pages cached between exports and laid out by several processes match a full build"""
+import os
+
+import pytest
+
+pytest.importorskip('reportlab')
+pypdf = pytest.importorskip('pypdf')
+
+from note_editor import pdf_maker  # noqa: E402
+from note_editor.note_manager import NoteManager  # noqa: E402
+
+
+@pytest.fixture
+def note_manager(tmp_path, make_note):
+    """enough notes for several chunks of pages"""
+    note_manager = NoteManager(str(tmp_path / 'notes.csv'))
+    note_manager.add_notes([make_note('note {:03d}'.format(i), author='author {}'.format(i % 7),
+                                      notes='\tline one of {}\nline two'.format(i)) for i in range(80)])
+    return note_manager
+
+
+def content(path):
+    """text of every page"""
+    return [page.extract_text() for page in pypdf.PdfReader(path).pages]
+
+
+def anchors(path):
+    """page of every note anchor"""
+    reader = pypdf.PdfReader(path)
+    return {name: reader.get_destination_page_number(destination)
+            for name, destination in reader.named_destinations.items()}
+
+
+def build_all(path, note_manager):
+    """text of the whole pdf laid out in one document, without the page cache"""
+    pdf_maker.build_all(path, list(note_manager.notes.values()), pdf_maker.table_orders(note_manager))
+    return content(path)
+
+
+def test_chunks_follow_content():
+    """an edit moves the boundaries of its chunk only"""
+    hashes = ['{:08x}'.format(i * 7919) for i in range(500)]
+    chunks = pdf_maker.make_chunks(hashes)
+    assert chunks[0][0] == 0 and chunks[-1][1] == 500
+    assert all(end - start <= pdf_maker.max_chunk_size for start, end in chunks)
+    edited = hashes[:250] + ['00000001'] + hashes[251:]
+    assert set(pdf_maker.make_chunks(edited)) >= {chunk for chunk in chunks if chunk[1] < 250}
+
+
+def test_cached_pages_match_full_build(note_manager, tmp_path, make_note):
+    path = str(tmp_path / 'notes.pdf')
+    cache_dir = str(tmp_path / 'cache')
+    assert pdf_maker.make_pdf(path, note_manager, cache_dir=cache_dir, workers=1)
+    assert content(path) == build_all(str(tmp_path / 'all.pdf'), note_manager)
+    cached = set(os.listdir(cache_dir))
+
+    ids = list(note_manager.notes)
+    note_manager.update_note(make_note('note 040 edited'), ids[40])
+    note_manager.remove_note(ids[3])
+    note_manager.add_note(make_note('note 080'))
+    assert pdf_maker.make_pdf(path, note_manager, cache_dir=cache_dir, workers=1)
+    # most chunks come from the cache
+    assert len(cached & set(os.listdir(cache_dir))) > 1
+    assert content(path) == build_all(str(tmp_path / 'all.pdf'), note_manager)
+
+
+def test_parallel_matches_serial(note_manager, tmp_path):
+    serial = str(tmp_path / 'serial.pdf')
+    parallel = str(tmp_path / 'parallel.pdf')
+    pdf_maker.make_pdf(serial, note_manager, cache_dir=str(tmp_path / 'serial'), workers=1)
+    pdf_maker.make_pdf(parallel, note_manager, cache_dir=str(tmp_path / 'parallel'), workers=2)
+    assert content(parallel) == content(serial)
+    assert anchors(parallel) == anchors(serial)
+    # invariant documents: each chunk is the same whichever process laid it out
+    for name in os.listdir(tmp_path / 'serial'):
+        if name != 'index.json':
+            assert (tmp_path / 'serial' / name).read_bytes() == (tmp_path / 'parallel' / name).read_bytes()
+
+
+def test_anchors_by_note_id(note_manager, tmp_path):
+    path = str(tmp_path / 'notes.pdf')
+    pdf_maker.make_pdf(path, note_manager, cache_dir=str(tmp_path / 'cache'), workers=1)
+    pages = content(path)
+    pages_of_notes = anchors(path)
+    assert set(pages_of_notes) == {'anchor_' + note_id for note_id in note_manager.notes}
+    for note_id, note in note_manager.notes.items():
+        assert note['title'] in pages[pages_of_notes['anchor_' + note_id]]
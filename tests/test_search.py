@@ -0,0 +1,95 @@
+"""full text index: ranked and prefix search, edits, saved index"""
+import os
+
+import pytest
+
+from note_editor.search import SearchIndex, tokenize
+
+
+@pytest.fixture
+def notes(make_note):
+    return [make_note('Dune', author='Frank Herbert', notes='desert planet, spice and sandworms'),
+            make_note('The Left Hand of Darkness', author='Ursula K. Le Guin', notes='a winter planet'),
+            make_note('Solaris', author='Stanislaw Lem', notes='an ocean planet that thinks'),
+            make_note('Children of Dune', author='Frank Herbert', notes='the desert again')]
+
+
+@pytest.fixture
+def index(notes):
+    index = SearchIndex()
+    index.build(notes)
+    return index
+
+
+def titles(found):
+    return [note['title'] for note in found]
+
+
+def test_tokenize():
+    assert tokenize('Le Guin, Ursula K.') == ['le', 'guin', 'ursula', 'k']
+    assert tokenize('ÉTÉ straße') == ['été', 'strasse']
+
+
+def test_every_term_matches(index):
+    assert titles(index.search('herbert desert', prefix_last=False)) == ['Dune', 'Children of Dune']
+    assert titles(index.search('planet ocean', prefix_last=False)) == ['Solaris']
+    assert index.search('planet herbert mars', prefix_last=False) == []
+    assert index.search('  ') == []
+
+
+def test_title_ranks_first(index):
+    """a hit in the title weighs more than one in the body"""
+    assert titles(index.search('dune', prefix_last=False)) == ['Dune', 'Children of Dune']
+    assert titles(index.search('darkness winter', prefix_last=False)) == ['The Left Hand of Darkness']
+
+
+def test_prefix(index):
+    # the last word is a prefix while typing, not once followed by a space
+    assert titles(index.search('sol')) == ['Solaris']
+    assert index.search('sol ') == []
+    assert titles(index.search('sand* frank', prefix_last=False)) == ['Dune']
+
+
+def test_follows_edits(index, notes, make_note):
+    index.update(notes[2], make_note('Solaris', author='Stanislaw Lem', notes='a sentient sea'))
+    assert index.search('ocean', prefix_last=False) == []
+    assert titles(index.search('sentient')) == ['Solaris']
+    index.update(notes[0], None)
+    assert titles(index.search('dune', prefix_last=False)) == ['Children of Dune']
+    # two notes with the same content share a document
+    copy = make_note('Children of Dune', author='Frank Herbert', notes='the desert again')
+    index.update(None, copy)
+    assert len(index) == 3
+    assert index.search('children') == [notes[3], copy]
+
+
+def test_removed_documents_not_counted(index, notes, make_note):
+    """tombstoned documents do not make a term more common until the index is compacted"""
+    extra = [make_note('planet {}'.format(i)) for i in range(20)]
+    for note in extra:
+        index.update(None, note)
+    for note in extra:
+        index.update(note, None)
+    assert index.removed == 20
+    scores = index.term_scores(['planet'])
+    index.compact()
+    assert index.removed == 0
+    assert sorted(index.term_scores(['planet']).values()) == pytest.approx(sorted(scores.values()))
+
+
+def test_saved_index(tmp_path, notes, make_note):
+    """the saved index is loaded at the next build and only the changes are indexed again"""
+    path = str(tmp_path / 'notes_index.bin')
+    index = SearchIndex(path)
+    index.build(notes)
+    index.save()
+    assert os.path.exists(path)
+
+    again = SearchIndex(path)
+    again.build(notes[1:] + [make_note('Hyperion', notes='pilgrims and a planet')])
+    # documents of the saved index are kept, the removed note is tombstoned
+    assert again.keys == [None] + index.keys[1:] + again.keys[4:]
+    assert len(again.keys) == 5
+    assert sorted(titles(again.search('planet', prefix_last=False))) == ['Hyperion', 'Solaris',
+                                                                         'The Left Hand of Darkness']
+    assert again.search('dune', prefix_last=False) == [notes[3]]
@@ -0,0 +1,83 @@
+"""binary snapshot of notes.csv: file layout and notes loaded from it"""
+import os
+import struct
+
+import pytest
+
+from note_editor.note_manager import NoteManager
+from note_editor.snapshot import Snapshot, write_snapshot
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    """snapshot of a made up csv of three notes, values with an empty one, a NUL byte and non ascii text"""
+    csv_path = tmp_path / 'notes.csv'
+    csv_path.write_bytes(b'0123456789')
+    columns = [['a', 'b', 'c'], ['', 'nul\0inside', 'é ü ☃']]
+    keys = ['00' * 12, 'ab' * 12, 'ff' * 12]
+    path = str(tmp_path / 'notes_snapshot.bin')
+    write_snapshot(path, os.stat(csv_path), 1234, ['title', 'notes'], columns, [0, 3, 3, 7, 7, 10], keys)
+    snapshot = Snapshot(path)
+    yield snapshot
+    snapshot.close()
+
+
+def test_values(snapshot):
+    assert snapshot.count == 3
+    assert snapshot.crc == 1234
+    assert snapshot.fields == ['title', 'notes']
+    assert snapshot.column('title') == ['a', 'b', 'c']
+    assert snapshot.column('notes') == ['', 'nul\0inside', 'é ü ☃']
+    assert snapshot.value(2, 'notes') == 'é ü ☃'
+    assert snapshot.note(1) == ['b', 'nul\0inside']
+
+
+def test_rows_and_keys(snapshot):
+    assert list(snapshot.rows()) == [0, 3, 3, 7, 7, 10]
+    assert snapshot.row(1) == (3, 7)
+    assert snapshot.keys() == ['00' * 12, 'ab' * 12, 'ff' * 12]
+
+
+def test_matches_csv(snapshot, tmp_path):
+    csv_path = tmp_path / 'notes.csv'
+    assert snapshot.matches(os.stat(csv_path))
+    csv_path.write_bytes(b'01234567890')
+    assert not snapshot.matches(os.stat(csv_path))
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / 'notes_snapshot.bin'
+    path.write_bytes(struct.pack('<8sI', b'NOTESNAP', 99) + bytes(40))
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
+
+
+def test_empty(tmp_path):
+    csv_path = tmp_path / 'notes.csv'
+    csv_path.write_bytes(b'')
+    path = str(tmp_path / 'notes_snapshot.bin')
+    write_snapshot(path, os.stat(csv_path), 0, ['title'], [[]], [], [])
+    snapshot = Snapshot(path)
+    assert snapshot.column('title') == []
+    assert snapshot.keys() == []
+    snapshot.close()
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_notes_from_snapshot_equal_csv(csv_path, lazy, make_note):
+    """notes loaded from the snapshot are those parsed from the csv, ids and bodies included"""
+    note_manager = NoteManager(csv_path)
+    note_manager.add_note(make_note('d', notes='line\n\ttabbed, "quoted" and ☃'))
+    note_manager.compact()
+    assert os.path.exists(os.path.splitext(csv_path)[0] + '_snapshot.bin')
+    from_csv = NoteManager(csv_path, snapshot=False)
+    from_snapshot = NoteManager(csv_path, lazy=lazy)
+    assert list(from_snapshot.notes) == list(from_csv.notes)
+    assert [dict(note) for note in from_snapshot.notes.values()] == [dict(note) for note in from_csv.notes.values()]
+
+
+def test_no_snapshot(tmp_path, make_note):
+    path = str(tmp_path / 'notes.csv')
+    NoteManager(path, snapshot=False).add_notes([make_note('a')])
+    assert not os.path.exists(str(tmp_path / 'notes_snapshot.bin'))
+    assert NoteManager(path, snapshot=False).notes
@@ -0,0 +1,98 @@
+"""split export: one pdf per media type, author or year, partitions unchanged since the last export are kept"""
+import hashlib
+import json
+import os
+
+import pytest
+
+pytest.importorskip('reportlab')
+pypdf = pytest.importorskip('pypdf')
+
+from note_editor.note_manager import NoteManager  # noqa: E402
+from note_editor.split_pdf import file_names, make_split_pdf, partitions  # noqa: E402
+
+
+@pytest.fixture
+def note_manager(tmp_path, make_note):
+    note_manager = NoteManager(str(tmp_path / 'notes.csv'))
+    note_manager.add_notes([make_note('Dune', author='Frank Herbert', year='1965', media_type='book'),
+                            make_note('Dune', author='David Lynch', year='1984', media_type='movie'),
+                            make_note('Children of Dune', author='frank herbert ', year='1976', media_type='book'),
+                            make_note('Untitled', author='', year='', media_type='')])
+    return note_manager
+
+
+def split(note_manager, tmp_path, category, workers=1, **kwargs):
+    return make_split_pdf(str(tmp_path / 'split'), note_manager, category, cache_dir=str(tmp_path / 'cache'),
+                          workers=workers, **kwargs)
+
+
+def titles(path):
+    """titles of the notes of a partition"""
+    text = ''.join(page.extract_text() for page in pypdf.PdfReader(path).pages)
+    return sorted(title for title in ('Children of Dune', 'Dune', 'Untitled') if title in text)
+
+
+def test_partitions(note_manager):
+    notes = list(note_manager.notes.values())
+    assert partitions(notes, 'author') == [('', [3]), ('David lynch', [1]), ('Frank herbert', [0, 2])]
+    assert partitions(notes, 'year') == [('1965', [0]), ('1976', [2]), ('1984', [1]), ('', [3])]
+
+
+def test_file_names():
+    """values that only differ by case or punctuation get the hash of the value"""
+    digest = hashlib.sha1('frank herbert!'.encode('utf-8')).hexdigest()[:8]
+    assert file_names('author', ['Frank Herbert', 'frank herbert!', '', 'É/x']) == \
+        ['author_Frank_Herbert.pdf', 'author_frank_herbert_' + digest + '.pdf', 'author_none.pdf', 'author_É_x.pdf']
+
+
+def test_one_pdf_per_value(note_manager, tmp_path):
+    built = split(note_manager, tmp_path, 'media_type')
+    directory = tmp_path / 'split'
+    assert sorted(os.path.basename(path) for path in built) == ['media_type_book.pdf', 'media_type_movie.pdf',
+                                                                'media_type_none.pdf']
+    assert (directory / 'index.pdf').exists()
+    assert titles(str(directory / 'media_type_book.pdf')) == ['Children of Dune', 'Dune']
+    assert titles(str(directory / 'media_type_movie.pdf')) == ['Dune']
+    with open(directory / 'manifest.json') as f:
+        manifest = json.load(f)
+    assert manifest['category'] == 'media_type'
+    assert [(entry['value'], entry['notes']) for entry in manifest['partitions']] == [('', 1), ('book', 2),
+                                                                                      ('movie', 1)]
+
+
+def test_unchanged_partitions_kept(note_manager, tmp_path, make_note):
+    split(note_manager, tmp_path, 'author')
+    assert split(note_manager, tmp_path, 'author') == []
+    ids = list(note_manager.notes)
+    note_manager.update_note(make_note('Dune', author='David Lynch', year='1984', media_type='movie',
+                                       notes='edited'), ids[1])
+    assert [os.path.basename(path) for path in split(note_manager, tmp_path, 'author')] == ['author_David_lynch.pdf']
+    # a partition gone with its last note loses its pdf
+    note_manager.remove_note(ids[1])
+    assert split(note_manager, tmp_path, 'author') == []
+    assert not (tmp_path / 'split' / 'author_David_lynch.pdf').exists()
+    assert len(split(note_manager, tmp_path, 'author', force=True)) == 2
+
+
+def test_other_category_rebuilds(note_manager, tmp_path):
+    split(note_manager, tmp_path, 'media_type')
+    assert len(split(note_manager, tmp_path, 'year')) == 4
+    assert not (tmp_path / 'split' / 'media_type_book.pdf').exists()
+
+
+def test_parallel_matches_serial(note_manager, tmp_path):
+    serial = tmp_path / 'serial'
+    parallel = tmp_path / 'parallel'
+    serial.mkdir()
+    parallel.mkdir()
+    split(note_manager, serial, 'year')
+    split(note_manager, parallel, 'year', workers=2)
+    for name in os.listdir(serial / 'split'):
+        if name.endswith('.pdf'):
+            assert (serial / 'split' / name).read_bytes() == (parallel / 'split' / name).read_bytes()
+
+
+def test_unknown_category(note_manager, tmp_path):
+    with pytest.raises(ValueError):
+        split(note_manager, tmp_path, 'title')
@@ -0,0 +1,143 @@
+"""sqlite storage: rows of the notes, migration from the csv, indexes, edits of two connections at once"""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from note_editor.note_manager import NoteManager, categories
+from note_editor.storage import id_field
+
+
+@pytest.fixture
+def backend():
+    return 'sqlite'
+
+
+@pytest.fixture
+def notes_db(open_notes, notes_path, make_note):
+    open_notes().add_notes([make_note('a'), make_note('b'), make_note('c')])
+    return notes_path
+
+
+def note_ids(path):
+    """note id of every row, in order"""
+    with sqlite3.connect(path) as connection:
+        return [row[0] for row in connection.execute('SELECT "{}" FROM notes ORDER BY position, id'.format(id_field))]
+
+
+def test_update_waits_for_other_connection(notes_db, open_notes, make_note, titles):
+    """an update made while another connection writes the same note is merged once it committed"""
+    first = open_notes()
+    a = next(iter(first.notes))
+    other = sqlite3.connect(notes_db, timeout=5)
+    other.execute('BEGIN IMMEDIATE')
+    rowid, position = other.execute('SELECT id, position FROM notes WHERE "{}" = ?'.format(id_field), (a,)).fetchone()
+    other.execute('DELETE FROM notes WHERE id = ?', (rowid,))
+    other.execute('INSERT INTO notes (position, title, author, year, notes, "{}") VALUES (?, ?, ?, ?, ?, ?)'
+                  .format(id_field), (position, 'a other', 'someone', '2000', '', a))
+    update = threading.Thread(target=first.update_note, args=(make_note('a first'), a))
+    update.start()
+    time.sleep(0.2)
+    other.commit()
+    update.join()
+    other.close()
+
+    ids = note_ids(notes_db)
+    assert len(ids) == len(set(ids)) == 4
+    notes = open_notes()
+    assert titles(notes) == ['a other', 'a first', 'b', 'c']
+    assert notes.notes[a]['title'] == 'a other'
+    # the copy is the version of the first program in the history
+    copy = ids[1]
+    assert [note['title'] for _, _, note in notes.history.note_versions(copy)] == ['a first']
+
+
+def test_edits_of_copy_go_to_copy(notes_db, open_notes, make_note, titles):
+    """after a conflict, the next edits of the note go to the copy until the notes are read again"""
+    first = open_notes()
+    second = open_notes()
+    a = next(iter(first.notes))
+    first.update_note(make_note('a first'), a)
+    second.update_note(make_note('a second'), a)
+    second.update_note(make_note('a second again'), a)
+    assert titles(open_notes()) == ['a first', 'a second again', 'b', 'c']
+    second.remove_note(a)
+    assert titles(open_notes()) == ['a first', 'b', 'c']
+    assert second.sync()
+    assert titles(second) == ['a first', 'b', 'c']
+    assert len(set(note_ids(notes_db))) == 3
+
+
+def test_removed_by_other_connection(notes_db, open_notes, make_note, titles):
+    first = open_notes()
+    second = open_notes()
+    a, b, c = first.notes
+    second.remove_note(a)
+    second.remove_note(b)
+    first.update_note(make_note('a1'), a)
+    first.remove_note(b)
+    assert titles(open_notes()) == ['c', 'a1']
+
+
+def test_migration_from_csv(csv_path, open_notes, notes_path, make_note, titles):
+    """notes.csv next to a new notes.db is copied into it once, with its ids"""
+    csv_notes = NoteManager(csv_path)
+    notes = open_notes()
+    assert list(notes.notes) == list(csv_notes.notes)
+    assert [dict(note) for note in notes.notes.values()] == [dict(note) for note in csv_notes.notes.values()]
+    assert note_ids(notes_path) == list(csv_notes.notes)
+    csv_notes.add_note(make_note('d'))
+    assert titles(open_notes()) == ['a', 'b', 'c']
+
+
+def test_indexed_lookups(open_notes, make_note, notes_path):
+    notes = open_notes()
+    notes.add_notes([make_note('b', author='Lem'), make_note('A', author='lem'), make_note('c', author='Dick')])
+    b, a, c = notes.notes
+    assert notes.storage.sorted_ids('title') == [a, b, c]
+    assert notes.storage.sorted_ids('author') == [c, b, a]
+    assert notes.find('author', 'LEM') == [b, a]
+    assert notes.find('author', 'nobody') == []
+    with sqlite3.connect(notes_path) as connection:
+        plan = ' '.join(row[-1] for row in connection.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM notes WHERE author = ? COLLATE NOCASE', ('lem',)))
+    assert 'notes_author' in plan
+
+
+def test_export_csv(open_notes, make_note, tmp_path, titles):
+    notes = open_notes()
+    notes.add_notes([make_note('a', notes='two\nlines'), make_note('b')])
+    path = str(tmp_path / 'export.csv')
+    notes.export_csv(path)
+    exported = NoteManager(path)
+    assert titles(exported) == ['a', 'b']
+    assert list(exported.notes.values())[0]['notes'] == 'two\nlines'
+
+
+def test_legacy_database(notes_path, open_notes, titles):
+    """a database of a previous version, without positions nor ids, is given both in the order of its rows"""
+    names = [category.name for category in categories]
+    with sqlite3.connect(notes_path) as connection:
+        connection.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                           + ', '.join('"{}" TEXT NOT NULL DEFAULT \'\''.format(name) for name in names) + ')')
+        connection.executemany('INSERT INTO notes (title) VALUES (?)', [('b',), ('a',), ('c',)])
+    notes = open_notes()
+    assert titles(notes) == ['b', 'a', 'c']
+    ids = note_ids(notes_path)
+    assert ids == list(notes.notes) == sorted(ids)
+    assert list(open_notes().notes) == ids
+
+
+def test_lazy_notes(notes_db, open_notes, make_note):
+    """bodies are read on first access, a row deleted meanwhile marks the notes to be read again"""
+    notes = open_notes(lazy=True)
+    a, b, c = notes.notes.values()
+    assert a['notes'] == 'notes on a'
+    open_notes().remove_note(b[id_field])
+    with pytest.raises(ValueError):
+        b['notes']
+    assert notes.storage.stale
+    assert notes.sync()
+    assert [note['title'] for note in notes.notes.values()] == ['a', 'c']
+    assert notes.notes[c[id_field]]['notes'] == 'notes on c'
@@ -0,0 +1,88 @@
+"""watch: the notes are read again and exported once their files stopped changing"""
+import pytest
+
+from note_editor import watcher as watcher_module
+from note_editor.watcher import Watcher
+
+
+class Clock:
+    """time.monotonic of the watcher, moved by the test"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(watcher_module.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def watched(open_notes, make_note):
+    """the NoteManager watched, and the (removed, added) titles of every export"""
+    note_manager = open_notes()
+    note_manager.add_notes([make_note('a'), make_note('b')])
+    exports = []
+
+    def export(removed, added):
+        exports.append((sorted(note['title'] for note in removed), sorted(note['title'] for note in added)))
+    return note_manager, exports, export
+
+
+def test_export_after_quiet_delay(watched, open_notes, make_note, clock, titles):
+    note_manager, exports, export = watched
+    watcher = Watcher(note_manager, export, delay=5)
+    assert not watcher.poll()
+
+    other = open_notes()
+    a, b = other.notes
+    other.update_note(make_note('b2'), b)
+    assert not watcher.poll()
+    clock.now += 3
+    # still changing: the delay starts again
+    other.add_note(make_note('c'))
+    assert not watcher.poll()
+    clock.now += 3
+    assert not watcher.poll()
+    clock.now += 3
+    assert watcher.poll()
+    assert exports == [(['b'], ['b2', 'c'])]
+    assert titles(note_manager) == ['a', 'b2', 'c']
+    # up to date
+    clock.now += 10
+    assert not watcher.poll()
+    assert len(exports) == 1
+
+
+def test_own_writes_export_nothing_new(watched, make_note):
+    """the files changed by the watched NoteManager itself reload no note"""
+    note_manager, exports, export = watched
+    watcher = Watcher(note_manager, export, delay=0)
+    note_manager.add_note(make_note('c'))
+    assert watcher.poll()
+    assert exports == [([], [])]
+
+
+def test_run_keeps_watching_after_errors(watched, open_notes, make_note, capsys):
+    note_manager, exports, export = watched
+    calls = []
+
+    def failing_export(removed, added):
+        calls.append(len(calls))
+        if len(calls) == 1:
+            # first build, then the change seen by the next poll
+            open_notes().add_note(make_note('c'))
+            raise ValueError('pdf not written')
+        export(removed, added)
+        watcher.stop()
+
+    watcher = Watcher(note_manager, failing_export, interval=0, delay=0)
+    watcher.run()
+    assert calls == [0, 1]
+    assert exports == [([], ['c'])]
+    assert 'ValueError: pdf not written' in capsys.readouterr().err